@@ -7,29 +7,29 @@ from sqlalchemy.orm import DeclarativeBase
 from flask_login import LoginManager
 from flask_mail import Mail
 
+from db_routing import RoutingSession, normalize_url, engine_options, database_binds, configure_engines
+
 
 class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 # create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "cryptobot-secret-key-development")
 
 # configure the database with PostgreSQL (with fallback to SQLite)
-database_url = os.environ.get("DATABASE_URL")
-# If DATABASE_URL starts with "postgres://", replace it with "postgresql://"
-if database_url and database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
-
-app.config["SQLALCHEMY_DATABASE_URI"] = database_url or "sqlite:///crypto_bot.db"
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+database_url = normalize_url(os.environ.get("DATABASE_URL")) or "sqlite:///crypto_bot.db"
+
+app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+# pool sizes from DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT (see db_routing)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_url)
+# a separate small pool for the trade ledger, and the read replica if DATABASE_REPLICA_URL is set
+app.config["SQLALCHEMY_BINDS"] = database_binds(database_url, normalize_url(os.environ.get("DATABASE_REPLICA_URL")))
 # initialize the app with the extension
 db.init_app(app)
+configure_engines(app, db)
 
 # Set up login manager
 login_manager = LoginManager()
@@ -47,21 +47,45 @@ app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'Crypt
 # Create mail instance
 mail = Mail(app)
 
+# Periodic writers (portfolio snapshots) run in this process unless disabled. The
+# production entry point (wsgi.py) turns them off and leaves them to dedicated processes.
+app.config['RUN_BACKGROUND_JOBS'] = os.environ.get('RUN_BACKGROUND_JOBS', 'True') == 'True'
+
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 
-with app.app_context():
-    # Import routes after app is created to avoid circular imports
-    import routes  # noqa
-    
-    # Make sure to import the models here or their tables won't be created
-    import models  # noqa
-    
-    db.create_all()
+# Import routes after app is created to avoid circular imports. Nothing touches the
+# database at import: the schema is created by `flask --app app upgrade-db` (or
+# `python migrations.py`) as a deploy step, not by every process that imports the app.
+# Heavy subsystems (numpy backtests, ML models, sentiment, exchange feeds) are imported
+# by the views and daemons that use them, on first use.
+import routes  # noqa
+import models  # noqa
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    """Create missing tables, columns and indexes"""
+    from migrations import upgrade
+    upgrade()
+
 
 # Import and register login_manager loader
 from models import User
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    # served from cached column values, so an authenticated request does not query User
+    from dashboard_cache import get_user_cache
+    return get_user_cache().load(int(user_id))
+
+
+def create_app(config=None):
+    """Apply config overrides and return the application.
+
+    There is one app per process and modules import it directly, so this
+    configures the existing instance instead of building a new one.
+    """
+    if config:
+        app.config.update(config)
+    return app
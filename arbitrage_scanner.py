@@ -0,0 +1,429 @@
+"""Incremental cross-exchange arbitrage scanner.
+
+The scanner keeps the latest best bid/ask for every (exchange, symbol) and, on
+each quote update, re-evaluates only the updated symbol: buy on the exchange
+with the cheapest fee-adjusted ask, sell on the one with the richest
+fee-adjusted bid. Opportunities are emitted when the net spread crosses a
+threshold upwards (or the exchange pair changes while it stays above), not on
+every tick it persists. With several thresholds (one per user setting) each
+upward crossing is emitted, so a spread that widens past a higher user's
+threshold reaches that user even while the same pair stays open.
+
+ArbitrageService runs the scanner live, and the multi-leg cycle graph from
+cycle_arbitrage. It sits on the bot supervisor's market data hub and keeps
+order books from BookEvents, passing each book's changed top of book to both.
+"""
+import csv
+import asyncio
+import logging
+from bisect import bisect_right
+from datetime import datetime
+
+from exchanges import EXCHANGES, TAKER_FEES
+from notifications import notify
+from history import opportunity_to_dict
+from dashboard_cache import get_dashboard_cache
+
+INF = float('inf')
+FLUSH_INTERVAL = 1.0
+RELOAD_INTERVAL = 30.0
+
+
+class Opportunity:
+    """A fee-adjusted two-exchange spread; profit_percent is in percent like ArbitrageOpportunity.
+
+    reported is the highest threshold already emitted for this open spread
+    (None when it just opened): only thresholds above it are newly crossed.
+    """
+
+    __slots__ = ('symbol', 'buy_exchange', 'sell_exchange', 'buy_price', 'sell_price',
+                 'profit_percent', 'timestamp', 'reported')
+
+    def __init__(self, symbol, buy_exchange, sell_exchange, buy_price, sell_price,
+                 profit_percent, timestamp, reported=None):
+        self.symbol = symbol
+        self.buy_exchange = buy_exchange
+        self.sell_exchange = sell_exchange
+        self.buy_price = buy_price
+        self.sell_price = sell_price
+        self.profit_percent = profit_percent
+        self.timestamp = timestamp
+        self.reported = reported
+
+    def __repr__(self):
+        return (f'<Opportunity {self.symbol} {self.buy_exchange}->{self.sell_exchange} '
+                f'{self.profit_percent:.3f}%>')
+
+
+class _SymbolQuotes:
+    """Per-symbol quote vectors indexed by exchange position"""
+
+    __slots__ = ('bid', 'ask', 'net_bid', 'net_ask', 'open_pair', 'open_level')
+
+    def __init__(self, n_exchanges):
+        self.bid = [0.0] * n_exchanges
+        self.ask = [INF] * n_exchanges
+        self.net_bid = [0.0] * n_exchanges
+        self.net_ask = [INF] * n_exchanges
+        self.open_pair = None
+        # number of thresholds the open pair's spread is at or above
+        self.open_level = 0
+
+
+class ArbitrageScanner:
+    """Best bid/ask per (exchange, symbol) with O(exchanges) work per quote update"""
+
+    def __init__(self, threshold=0.003, fees=None, exchanges=EXCHANGES, on_opportunity=None):
+        self.set_thresholds((threshold,))
+        self.exchanges = tuple(exchanges)
+        self._index = {exchange: i for i, exchange in enumerate(self.exchanges)}
+        fees = dict(TAKER_FEES, **(fees or {}))
+        self._buy_cost = [1.0 + fees.get(e, 0.0) for e in self.exchanges]
+        self._sell_yield = [1.0 - fees.get(e, 0.0) for e in self.exchanges]
+        self._symbols = {}
+        self.on_opportunity = on_opportunity
+        self.quotes_processed = 0
+
+    def set_thresholds(self, thresholds):
+        """Fractional net spreads whose upward crossing emits an opportunity; empty emits nothing"""
+        self._thresholds = tuple(sorted(set(thresholds)))
+        self.threshold = self._thresholds[0] if self._thresholds else INF
+
+    def update(self, exchange, symbol, bid, ask, timestamp=None):
+        """Apply one top-of-book quote; returns an Opportunity when one opens, else None"""
+        i = self._index.get(exchange)
+        if i is None:
+            return None
+        quotes = self._symbols.get(symbol)
+        if quotes is None:
+            quotes = self._symbols[symbol] = _SymbolQuotes(len(self.exchanges))
+
+        self.quotes_processed += 1
+        if bid > 0 and ask > 0:
+            quotes.bid[i] = bid
+            quotes.ask[i] = ask
+            quotes.net_bid[i] = bid * self._sell_yield[i]
+            quotes.net_ask[i] = ask * self._buy_cost[i]
+        else:
+            # an empty or crossed-out side removes the exchange from consideration
+            quotes.bid[i] = quotes.net_bid[i] = 0.0
+            quotes.ask[i] = quotes.net_ask[i] = INF
+
+        buy, sell, profit = self._best_pair(quotes)
+        if buy is None or profit < self.threshold:
+            quotes.open_pair = None
+            quotes.open_level = 0
+            return None
+        level = bisect_right(self._thresholds, profit)
+        reported = None
+        if quotes.open_pair == (buy, sell):
+            if level <= quotes.open_level:
+                # narrowing closes the thresholds above it, so widening again re-emits them
+                quotes.open_level = level
+                return None
+            # thresholds may have been reloaded since the level was set
+            reported = self._thresholds[min(quotes.open_level, len(self._thresholds)) - 1]
+
+        quotes.open_pair = (buy, sell)
+        quotes.open_level = level
+        opportunity = Opportunity(
+            symbol, self.exchanges[buy], self.exchanges[sell],
+            quotes.ask[buy], quotes.bid[sell], profit * 100.0,
+            timestamp or datetime.utcnow(), reported
+        )
+        if self.on_opportunity is not None:
+            self.on_opportunity(opportunity)
+        return opportunity
+
+    @staticmethod
+    def _best_pair(quotes):
+        """Cheapest net ask and richest net bid on different exchanges, with their net profit"""
+        net_ask, net_bid = quotes.net_ask, quotes.net_bid
+        ask1 = ask2 = bid1 = bid2 = -1
+        for k in range(len(net_ask)):
+            if ask1 < 0 or net_ask[k] < net_ask[ask1]:
+                ask1, ask2 = k, ask1
+            elif ask2 < 0 or net_ask[k] < net_ask[ask2]:
+                ask2 = k
+            if bid1 < 0 or net_bid[k] > net_bid[bid1]:
+                bid1, bid2 = k, bid1
+            elif bid2 < 0 or net_bid[k] > net_bid[bid2]:
+                bid2 = k
+
+        if ask1 != bid1:
+            buy, sell = ask1, bid1
+        elif bid2 >= 0 and (ask2 < 0 or net_bid[bid2] / net_ask[ask1] >= net_bid[bid1] / net_ask[ask2]):
+            buy, sell = ask1, bid2
+        else:
+            buy, sell = ask2, bid1
+
+        if buy < 0 or sell < 0 or net_ask[buy] == INF or net_bid[sell] == 0.0:
+            return None, None, 0.0
+        return buy, sell, net_bid[sell] / net_ask[buy] - 1.0
+
+    def best_spread(self, symbol):
+        """Current best Opportunity for a symbol regardless of threshold, or None"""
+        quotes = self._symbols.get(symbol)
+        if quotes is None:
+            return None
+        buy, sell, profit = self._best_pair(quotes)
+        if buy is None:
+            return None
+        return Opportunity(symbol, self.exchanges[buy], self.exchanges[sell],
+                           quotes.ask[buy], quotes.bid[sell], profit * 100.0, datetime.utcnow())
+
+
+def read_replay_feed(path):
+    """Yield (timestamp, exchange, symbol, bid, ask) from a CSV quote recording"""
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield (datetime.utcfromtimestamp(int(row['timestamp']) / 1000.0),
+                   row['exchange'], row['symbol'], float(row['bid']), float(row['ask']))
+
+
+def replay(scanner, quotes):
+    """Drive a scanner from an iterable of (timestamp, exchange, symbol, bid, ask)"""
+    opportunities = []
+    for timestamp, exchange, symbol, bid, ask in quotes:
+        opportunity = scanner.update(exchange, symbol, bid, ask, timestamp)
+        if opportunity is not None:
+            opportunities.append(opportunity)
+    return opportunities
+
+
+class OpportunityRecorder:
+    """Fans scanner output out to users whose active arbitrage configs want it.
+
+    Use as the scanner's on_opportunity callback and call flush() periodically to
+    write the buffered ArbitrageOpportunity rows in one transaction.
+    """
+
+    def __init__(self):
+        self._watchers = {}
+        self._pending = []
+        self.thresholds = []
+        self.min_threshold = None
+
+    def load_configs(self):
+        """Index active arbitrage configs by pair; returns the lowest threshold in use"""
+        from app import db
+        from models import BotConfig, BotConfigPair
+
+        watchers = {}
+        rows = db.session.query(BotConfigPair.symbol, BotConfig.user_id, BotConfig.arb_profit_threshold) \
+            .join(BotConfig).filter(BotConfig.is_active.is_(True), BotConfig.arbitrage_active.is_(True))
+        for symbol, user_id, threshold in rows:
+            watchers.setdefault(symbol, []).append((user_id, threshold))
+        self._watchers = watchers
+        self.thresholds = sorted({t for entries in watchers.values() for _, t in entries})
+        self.min_threshold = self.thresholds[0] if self.thresholds else None
+        return self.min_threshold
+
+    def symbols_of(self, opportunity):
+        return (opportunity.symbol,)
+
+    def build_model(self, opportunity, user_id):
+        from models import ArbitrageOpportunity
+
+        return ArbitrageOpportunity(
+            symbol=opportunity.symbol,
+            exchange_1=opportunity.buy_exchange,
+            exchange_2=opportunity.sell_exchange,
+            price_1=opportunity.buy_price,
+            price_2=opportunity.sell_price,
+            profit_percent=opportunity.profit_percent,
+            timestamp=opportunity.timestamp,
+            user_id=user_id
+        )
+
+    def to_dict(self, row):
+        """Dashboard read-model entry for a recorded row, or None if the dashboard does not list it"""
+        return opportunity_to_dict(row)
+
+    def describe(self, row):
+        """(subject, body) of the email digest line for a recorded row"""
+        return (f'{row.symbol} {row.profit_percent:.2f}%',
+                f'buy on {row.exchange_1} at {row.price_1:g}, sell on {row.exchange_2} at {row.price_2:g}')
+
+    def __call__(self, opportunity):
+        seen = set()
+        # users at or below the already reported threshold have this spread already
+        reported = getattr(opportunity, 'reported', None)
+        for symbol in self.symbols_of(opportunity):
+            for user_id, threshold in self._watchers.get(symbol, ()):
+                if user_id in seen or opportunity.profit_percent < threshold * 100.0:
+                    continue
+                if reported is not None and threshold <= reported:
+                    continue
+                seen.add(user_id)
+                self._pending.append((opportunity, user_id))
+
+    def take(self):
+        """Buffered (opportunity, user_id) pairs, leaving the buffer empty"""
+        pending, self._pending = self._pending, []
+        return pending
+
+    def flush(self):
+        """Persist buffered opportunities; returns the number of rows written"""
+        return self.write(self.take())
+
+    def write(self, pending):
+        """Persist (opportunity, user_id) pairs taken from the buffer; returns the rows written"""
+        from app import db
+
+        if not pending:
+            return 0
+        rows = [self.build_model(opp, user_id) for opp, user_id in pending]
+        db.session.add_all(rows)
+        db.session.flush()
+        # read ids and fields now: commit expires the rows and each access would reload one
+        recorded = [(row.user_id, self.describe(row), self.to_dict(row)) for row in rows]
+        db.session.commit()
+        by_user = {}
+        for user_id, description, data in recorded:
+            notify(user_id, 'arbitrage', *description)
+            if data is not None:
+                by_user.setdefault(user_id, []).append(data)
+        if by_user:
+            cache = get_dashboard_cache()
+            for user_id, opportunities in by_user.items():
+                cache.add_opportunities(user_id, opportunities)
+        logging.info(f'Recorded {len(pending)} arbitrage opportunities')
+        return len(pending)
+
+
+class ArbitrageService:
+    """Live top of book for the scanner and cycle graph, from order books kept on a market data hub.
+
+    Runs on the bot supervisor's loop and hub, since the supervisor owns the
+    only ingestion service and already subscribes every pair an active config
+    trades. Book and status events maintain an OrderBookManager. When an
+    event changes a book's best bid/ask, the new top goes to the scanner and
+    the graph; an out-of-sync or disconnected book withdraws its exchange's
+    quote. Every flush_interval the recorders write what they collected, in
+    an executor. Every reload_interval they reload the configs that set the
+    thresholds.
+    """
+
+    def __init__(self, app, hub, flush_interval=FLUSH_INTERVAL, reload_interval=RELOAD_INTERVAL):
+        from order_book import OrderBookManager
+        from cycle_arbitrage import ArbitrageGraph, CycleOpportunityRecorder
+
+        self.app = app
+        self.hub = hub
+        self.flush_interval = flush_interval
+        self.reload_interval = reload_interval
+        self.books = OrderBookManager()
+        self.recorder = OpportunityRecorder()
+        self.scanner = ArbitrageScanner(on_opportunity=self.recorder)
+        self.cycle_recorder = CycleOpportunityRecorder()
+        self.graph = ArbitrageGraph(on_opportunity=self.cycle_recorder)
+        self.recorders = (self.recorder, self.cycle_recorder)
+        # nothing is emitted until the first config load sets the thresholds
+        self.scanner.set_thresholds(())
+        self.graph.set_thresholds(())
+        self._tops = {}
+        self._subscription = None
+        self._tasks = []
+        self.top_updates = 0
+
+    def _publish_top(self, book):
+        if book.needs_snapshot:
+            bid = ask = 0.0
+        else:
+            best_bid, best_ask = book.best_bid(), book.best_ask()
+            bid = best_bid[0] if best_bid else 0.0
+            ask = best_ask[0] if best_ask else 0.0
+        key = (book.exchange, book.symbol)
+        if self._tops.get(key) == (bid, ask):
+            return
+        self._tops[key] = (bid, ask)
+        self.top_updates += 1
+        self.on_top(book.exchange, book.symbol, bid, ask)
+
+    def on_top(self, exchange, symbol, bid, ask):
+        """A book's best bid/ask changed; 0 means the exchange has no usable quote"""
+        self.scanner.update(exchange, symbol, bid, ask)
+        self.graph.update_market(exchange, symbol, bid, ask)
+
+    async def _consume(self):
+        async for event in self._subscription:
+            book = self.books.on_event(event)
+            if book is not None:
+                self._publish_top(book)
+            elif getattr(event, 'status', 'connected') != 'connected':
+                for (exchange, _), book in list(self.books.books.items()):
+                    if exchange == event.exchange:
+                        self._publish_top(book)
+
+    def _load_configs(self):
+        with self.app.app_context():
+            for recorder in self.recorders:
+                recorder.load_configs()
+
+    def _write(self, batches):
+        with self.app.app_context():
+            for recorder, pending in batches:
+                recorder.write(pending)
+
+    def apply_thresholds(self):
+        self.scanner.set_thresholds(self.recorder.thresholds)
+        self.graph.set_thresholds(self.cycle_recorder.thresholds)
+
+    async def reload(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._load_configs)
+        self.apply_thresholds()
+
+    async def flush(self):
+        # take the buffers on the loop, where the scanner and graph append to them
+        batches = [(recorder, recorder.take()) for recorder in self.recorders]
+        if any(pending for _, pending in batches):
+            await asyncio.get_running_loop().run_in_executor(None, self._write, batches)
+
+    async def _maintain(self):
+        loop = asyncio.get_running_loop()
+        last_reload = None
+        while True:
+            try:
+                if last_reload is None or loop.time() - last_reload >= self.reload_interval:
+                    await self.reload()
+                    last_reload = loop.time()
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception('Arbitrage service maintenance failed')
+            await asyncio.sleep(self.flush_interval)
+
+    def start(self):
+        """Subscribe to the hub and start consuming on the running loop"""
+        from market_data import BookEvent, StatusEvent
+
+        # every diff matters to a book, but blocking would stall the shared feed for every
+        # consumer: unread diffs are merged per symbol instead, which leaves the same book
+        self._subscription = self.hub.subscribe(kinds=(BookEvent, StatusEvent), maxsize=100000,
+                                                policy='conflate')
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._consume(), name='arbitrage-books'),
+                       loop.create_task(self._maintain(), name='arbitrage-maintain')]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._subscription is not None:
+            self.hub.unsubscribe(self._subscription)
+            self._subscription = None
+        await self.flush()
+
+    def metrics(self):
+        return {
+            'books': len(self.books.books),
+            'top_updates': self.top_updates,
+            'feed_conflated': self._subscription.conflated if self._subscription else 0,
+            'feed_dropped': self._subscription.dropped if self._subscription else 0,
+            'quotes_processed': self.scanner.quotes_processed,
+            'active_cycles': len(self.graph.active),
+            'thresholds': list(self.recorder.thresholds),
+        }
@@ -0,0 +1,355 @@
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Exchange whose candles are used when a backtest does not name one
+DEFAULT_EXCHANGE = os.environ.get('BACKTEST_EXCHANGE', 'binance')
+
+# Legacy CSV dumps named <BASE>_<QUOTE>_<timeframe>.csv with columns
+# timestamp(ms), open, high, low, close, volume; imported into the store on first use
+MARKET_DATA_DIR = os.environ.get('MARKET_DATA_DIR', 'market_data')
+
+TIMEFRAME_SECONDS = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '1h': 3600,
+    '4h': 14400,
+    '1d': 86400,
+}
+
+DEFAULT_PARAMETERS = {
+    'timeframe': '1m',
+    'fee_rate': 0.001,
+    'arb_profit_threshold': 0.003,
+    'ml_confidence_threshold': 0.7,
+    'rebalance_frequency': 3600,
+}
+
+SECONDS_PER_YEAR = 365 * 86400
+
+
+class MarketData:
+    """Aligned OHLCV arrays of shape (n_bars, n_pairs), C-contiguous float64"""
+
+    def __init__(self, pairs, timestamps, open_, high, low, close, volume, timeframe='1m'):
+        self.pairs = list(pairs)
+        self.timeframe = timeframe
+        self.timestamps = np.ascontiguousarray(timestamps, dtype=np.int64)
+        self.open = np.ascontiguousarray(open_, dtype=np.float64)
+        self.high = np.ascontiguousarray(high, dtype=np.float64)
+        self.low = np.ascontiguousarray(low, dtype=np.float64)
+        self.close = np.ascontiguousarray(close, dtype=np.float64)
+        self.volume = np.ascontiguousarray(volume, dtype=np.float64)
+
+    @property
+    def n_bars(self):
+        return self.close.shape[0]
+
+    @property
+    def start_date(self):
+        return datetime.utcfromtimestamp(self.timestamps[0] / 1000.0)
+
+    @property
+    def end_date(self):
+        return datetime.utcfromtimestamp(self.timestamps[-1] / 1000.0)
+
+
+def parse_pairs(pairs):
+    """Normalize a comma separated pairs string (as entered in forms) to a list"""
+    if isinstance(pairs, (list, tuple, set, frozenset)):
+        return [p.strip().upper() for p in pairs if p.strip()]
+    return [p.strip().upper() for p in pairs.split(',') if p.strip()]
+
+
+def _pair_filename(pair, timeframe):
+    return os.path.join(MARKET_DATA_DIR, f"{pair.replace('/', '_')}_{timeframe}.csv")
+
+
+def _load_pair(store, exchange, pair, timeframe, since_ms):
+    if store.count(exchange, pair, timeframe) == 0:
+        path = _pair_filename(pair, timeframe)
+        if os.path.exists(path):
+            store.import_csv(exchange, pair, timeframe, path)
+
+    candles = store.read(exchange, pair, timeframe, start_ms=since_ms)
+    if len(candles['timestamp']) == 0:
+        raise ValueError(f'No historical data for {pair} ({timeframe}) on {exchange} '
+                         f'in the requested period')
+    return candles
+
+
+def align_ohlcv(pairs, frames, timeframe='1m'):
+    """Align per-pair OHLCV column dicts on their common timestamps"""
+    common = np.asarray(frames[0]['timestamp'])
+    for frame in frames[1:]:
+        common = np.intersect1d(common, frame['timestamp'], assume_unique=True)
+    if common.shape[0] < 2:
+        raise ValueError('Not enough overlapping candles across the selected pairs')
+
+    n_bars, n_pairs = common.shape[0], len(frames)
+    columns = np.empty((5, n_bars, n_pairs), dtype=np.float64)
+    for j, frame in enumerate(frames):
+        idx = np.searchsorted(frame['timestamp'], common)
+        for i, name in enumerate(('open', 'high', 'low', 'close', 'volume')):
+            columns[i, :, j] = frame[name][idx]
+
+    return MarketData(pairs, common, columns[0], columns[1], columns[2],
+                      columns[3], columns[4], timeframe=timeframe)
+
+
+def load_ohlcv(pairs, days_back, timeframe='1m', exchange=None, now=None, store=None):
+    """Load OHLCV for pairs over the last days_back days from the candle store"""
+    from ohlcv_store import get_store
+
+    pairs = parse_pairs(pairs)
+    if not pairs:
+        raise ValueError('At least one trading pair is required')
+
+    store = store or get_store()
+    exchange = exchange or DEFAULT_EXCHANGE
+    now = now or datetime.utcnow()
+    since_ms = int((now - timedelta(days=days_back)).timestamp() * 1000)
+    frames = [_load_pair(store, exchange, pair, timeframe, since_ms) for pair in pairs]
+    return align_ohlcv(pairs, frames, timeframe=timeframe)
+
+
+# ---------------------------------------------------------------------------
+# Vectorized indicators and signals
+# ---------------------------------------------------------------------------
+
+def rolling_mean(values, window):
+    """Trailing simple moving average along axis 0; the first window-1 rows are NaN"""
+    out = np.full(values.shape, np.nan)
+    if window > values.shape[0]:
+        return out
+    csum = np.cumsum(values, axis=0)
+    out[window - 1] = csum[window - 1]
+    out[window:] = csum[window:] - csum[:-window]
+    out[window - 1:] /= window
+    return out
+
+
+def rolling_std(values, window):
+    """Trailing rolling standard deviation along axis 0"""
+    mean = rolling_mean(values, window)
+    mean_sq = rolling_mean(values * values, window)
+    return np.sqrt(np.maximum(mean_sq - mean * mean, 0.0))
+
+
+def forward_fill_positions(entries, exits):
+    """Turn boolean entry/exit masks into a held 0/1 position without looping bars"""
+    n = entries.shape[0]
+    state = np.where(entries, 1.0, np.where(exits, 0.0, np.nan))
+    state[0] = np.where(np.isnan(state[0]), 0.0, state[0])
+    idx = np.where(~np.isnan(state), np.arange(n)[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return np.take_along_axis(state, idx, axis=0)
+
+
+def _pct_change(close):
+    returns = np.zeros_like(close)
+    np.divide(close[1:], close[:-1], out=returns[1:])
+    returns[1:] -= 1.0
+    return returns
+
+
+def _crossover_positions(close, fast, slow, threshold):
+    fast_ma = rolling_mean(close, fast)
+    slow_ma = rolling_mean(close, slow)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gap = fast_ma / slow_ma - 1.0
+    entries = gap > threshold
+    exits = gap < 0.0
+    return forward_fill_positions(entries, exits)
+
+
+def signals_hft(data, params):
+    """Fast moving-average momentum"""
+    return _crossover_positions(data.close, 5, 20, params['arb_profit_threshold'] / 10.0)
+
+
+def signals_scalping(data, params):
+    """Very short momentum bursts with a tight exit"""
+    return _crossover_positions(data.close, 3, 12, params['arb_profit_threshold'] / 20.0)
+
+
+def signals_arbitrage(data, params):
+    """Statistical arbitrage: buy dislocations below fair value, exit on reversion"""
+    fair = rolling_mean(data.close, 60)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        deviation = data.close / fair - 1.0
+    entries = deviation < -params['arb_profit_threshold']
+    exits = deviation >= 0.0
+    return forward_fill_positions(entries, exits)
+
+
+def signals_ml_prediction(data, params):
+    """Logistic confidence on risk-adjusted momentum, gated by ml_confidence_threshold"""
+    returns = _pct_change(data.close)
+    mean = rolling_mean(returns, 30)
+    std = rolling_std(returns, 30)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        score = mean / std * np.sqrt(30)
+        confidence = 1.0 / (1.0 + np.exp(-score))
+    threshold = params['ml_confidence_threshold']
+    entries = confidence >= threshold
+    exits = confidence < 1.0 - threshold
+    return forward_fill_positions(entries, exits)
+
+
+SIGNAL_FUNCTIONS = {
+    'hft': signals_hft,
+    'scalping': signals_scalping,
+    'arbitrage': signals_arbitrage,
+    'ml_prediction': signals_ml_prediction,
+}
+
+
+# ---------------------------------------------------------------------------
+# Equity curve and statistics
+# ---------------------------------------------------------------------------
+
+def _rebalanced_equity(data, params):
+    """Equal-weight portfolio reset to target weights every rebalance_frequency seconds"""
+    close = data.close
+    bar_seconds = TIMEFRAME_SECONDS.get(data.timeframe, 60)
+    step = max(1, int(params['rebalance_frequency'] // bar_seconds))
+
+    block = np.arange(close.shape[0]) // step
+    # each block grows from the previous block's last close, so the move into
+    # its first bar is counted; the first block starts from bar 0 itself
+    block_start = close[np.maximum(block * step - 1, 0)]
+    asset_growth = close / block_start
+    growth = asset_growth.mean(axis=1)
+
+    # rebalancing back to equal weight only trades the drift away from target
+    block_ends = np.minimum((np.arange(block[-1] + 1) + 1) * step, close.shape[0]) - 1
+    drifted = asset_growth[block_ends] / (growth[block_ends, None] * close.shape[1])
+    turnover = np.abs(drifted - 1.0 / close.shape[1]).sum(axis=1)
+    end_growth = growth[block_ends] * (1.0 - params['fee_rate'] * turnover)
+
+    # value carried into each block is the product of all earlier block endings
+    carried = np.concatenate(([1.0], np.cumprod(end_growth)[:-1]))
+    return carried[block] * growth
+
+
+def _win_rate(positions, strategy_returns):
+    """Share of round trips with a positive P&L, found by segmenting position runs"""
+    pos = positions.T.ravel()
+    rets = np.log1p(strategy_returns.T).ravel()
+    n_bars = positions.shape[0]
+
+    change = np.empty(pos.shape[0], dtype=bool)
+    change[0] = True
+    change[1:] = pos[1:] != pos[:-1]
+    change[::n_bars] = True
+    segment = np.cumsum(change) - 1
+
+    # returns accrue on the bar after the position is set
+    shifted = np.zeros_like(rets)
+    shifted[:-1] = rets[1:]
+    shifted[n_bars - 1::n_bars] = 0.0
+    pnl = np.bincount(segment, weights=shifted)
+    held = pos[change] != 0
+    if not held.any():
+        return 0.0
+    return float((pnl[held] > 0).mean())
+
+
+def compute_statistics(equity, bar_seconds):
+    """Sharpe ratio, max drawdown and total return from an equity curve"""
+    returns = np.diff(equity) / equity[:-1]
+    std = returns.std()
+    periods = SECONDS_PER_YEAR / bar_seconds
+    sharpe = float(returns.mean() / std * np.sqrt(periods)) if std > 0 else 0.0
+
+    peaks = np.maximum.accumulate(equity)
+    max_drawdown = float(np.max(1.0 - equity / peaks))
+    total_return = float(equity[-1] / equity[0] - 1.0)
+    return sharpe, max_drawdown, total_return
+
+
+def run_backtest(data, strategy, initial_capital, parameters=None):
+    """Run a vectorized backtest over aligned market data and return a summary dict"""
+    params = dict(DEFAULT_PARAMETERS)
+    params.update(parameters or {})
+    bar_seconds = TIMEFRAME_SECONDS.get(data.timeframe, 60)
+
+    if strategy == 'portfolio_optimization':
+        growth = _rebalanced_equity(data, params)
+        win_rate = float((np.diff(growth) > 0).mean()) if growth.shape[0] > 1 else 0.0
+    else:
+        if strategy not in SIGNAL_FUNCTIONS:
+            raise ValueError(f'Unsupported strategy: {strategy}')
+        positions = SIGNAL_FUNCTIONS[strategy](data, params)
+
+        returns = _pct_change(data.close)
+        held = np.zeros_like(positions)
+        held[1:] = positions[:-1]
+        turnover = np.abs(np.diff(positions, axis=0, prepend=0.0))
+        strategy_returns = held * returns - turnover * params['fee_rate']
+
+        # capital is split evenly across pairs
+        growth = np.cumprod(1.0 + strategy_returns.mean(axis=1))
+        win_rate = _win_rate(positions, strategy_returns)
+
+    equity = initial_capital * growth
+    sharpe, max_drawdown, total_return = compute_statistics(equity, bar_seconds)
+
+    return {
+        'strategy': strategy,
+        'pairs': data.pairs,
+        'start_date': data.start_date,
+        'end_date': data.end_date,
+        'initial_capital': float(initial_capital),
+        'final_capital': float(equity[-1]),
+        'total_return': total_return,
+        'sharpe_ratio': sharpe,
+        'max_drawdown': max_drawdown,
+        'win_rate': win_rate,
+        'parameters': params,
+        'n_bars': data.n_bars,
+        'equity': equity,
+    }
+
+
+def build_result_model(name, summary, user_id):
+    """Build (but do not commit) a BacktestResult row from a run_backtest summary"""
+    from models import BacktestResult
+
+    return BacktestResult(
+        name=name,
+        strategy=summary['strategy'],
+        pairs=json.dumps(summary['pairs']),
+        start_date=summary['start_date'],
+        end_date=summary['end_date'],
+        initial_capital=summary['initial_capital'],
+        final_capital=summary['final_capital'],
+        total_return=summary['total_return'],
+        sharpe_ratio=summary['sharpe_ratio'],
+        max_drawdown=summary['max_drawdown'],
+        win_rate=summary['win_rate'],
+        parameters=json.dumps(summary['parameters']),
+        user_id=user_id,
+    )
+
+
+def run_and_save(name, strategy, pairs, days_back, initial_capital, user_id, parameters=None):
+    """Load data, run the backtest and persist a single BacktestResult"""
+    from app import db
+
+    params = dict(DEFAULT_PARAMETERS)
+    params.update(parameters or {})
+    data = load_ohlcv(pairs, days_back, timeframe=params['timeframe'])
+    summary = run_backtest(data, strategy, initial_capital, params)
+
+    result = build_result_model(name, summary, user_id)
+    db.session.add(result)
+    db.session.commit()
+    logging.info(f"Backtest '{name}' finished: {summary['n_bars']} bars, "
+                 f"return {summary['total_return']:.2%}")
+    return result
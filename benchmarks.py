@@ -0,0 +1,1063 @@
+"""Performance benchmarks for the trading subsystems.
+
+Run all benchmarks with ``python benchmarks.py`` or a single one with
+``python benchmarks.py backtest``.
+"""
+import sys
+import time
+
+import numpy as np
+
+
+def synthetic_market_data(n_bars, n_pairs, timeframe='1m', seed=42):
+    """Geometric random walk candles for benchmarking without historical files"""
+    from backtester import MarketData, TIMEFRAME_SECONDS
+
+    rng = np.random.default_rng(seed)
+    log_returns = rng.normal(0.0, 0.0008, size=(n_bars, n_pairs))
+    close = 100.0 * np.exp(np.cumsum(log_returns, axis=0))
+    open_ = np.vstack([close[:1], close[:-1]])
+    spread = np.abs(rng.normal(0.0, 0.0004, size=close.shape))
+    high = np.maximum(open_, close) * (1.0 + spread)
+    low = np.minimum(open_, close) * (1.0 - spread)
+    volume = rng.uniform(1.0, 100.0, size=close.shape)
+
+    step_ms = TIMEFRAME_SECONDS[timeframe] * 1000
+    timestamps = 1_600_000_000_000 + np.arange(n_bars, dtype=np.int64) * step_ms
+    pairs = [f'SYM{i}/USDT' for i in range(n_pairs)]
+    return MarketData(pairs, timestamps, open_, high, low, close, volume, timeframe=timeframe)
+
+
+def bench_backtest(days=365, n_pairs=12):
+    """Bars per second of the vectorized backtest engine (365 days of 1m bars)"""
+    from backtester import run_backtest, SIGNAL_FUNCTIONS
+
+    data = synthetic_market_data(days * 1440, n_pairs)
+    total_bars = data.n_bars * n_pairs
+    print(f'backtest: {data.n_bars} bars x {n_pairs} pairs')
+
+    for strategy in list(SIGNAL_FUNCTIONS) + ['portfolio_optimization']:
+        start = time.perf_counter()
+        summary = run_backtest(data, strategy, 10000.0)
+        elapsed = time.perf_counter() - start
+        print(f'  {strategy:<24} {elapsed * 1000:8.1f} ms  '
+              f'{total_bars / elapsed:14,.0f} bars/s  '
+              f'return {summary["total_return"]:+.2%}')
+
+
+def bench_sweep(days=30, n_pairs=12, n_jobs=64):
+    """Backtests per second of the process-pool parameter sweep"""
+    from parameter_sweep import random_search, run_sweep
+
+    data = synthetic_market_data(days * 1440, n_pairs)
+    ranges = {
+        'arb_profit_threshold': (0.001, 0.01),
+        'ml_confidence_threshold': (0.5, 0.9),
+        'rebalance_frequency': (900, 86400),
+    }
+    parameter_sets = random_search(ranges, n_jobs, seed=1)
+
+    start = time.perf_counter()
+    summaries = run_sweep(data, 'ml_prediction', 10000.0, parameter_sets)
+    elapsed = time.perf_counter() - start
+    best = max(s['sharpe_ratio'] for s in summaries)
+    print(f'sweep: {n_jobs} backtests of {data.n_bars} bars x {n_pairs} pairs in {elapsed:.2f} s '
+          f'({n_jobs / elapsed:.1f} backtests/s, best Sharpe {best:.2f})')
+
+
+def bench_ohlcv_store(days=365):
+    """Time to append and read back a year of 1m candles from the columnar store"""
+    import tempfile
+    from ohlcv_store import OHLCVStore
+
+    data = synthetic_market_data(days * 1440, 1)
+    rows = np.column_stack([data.timestamps, data.open[:, 0], data.high[:, 0],
+                            data.low[:, 0], data.close[:, 0], data.volume[:, 0]])
+
+    with tempfile.TemporaryDirectory() as root:
+        store = OHLCVStore(root)
+        start = time.perf_counter()
+        store.append('binance', 'BTC/USDT', '1m', rows)
+        write_ms = (time.perf_counter() - start) * 1000
+
+        cold = OHLCVStore(root)
+        start = time.perf_counter()
+        candles = cold.read('binance', 'BTC/USDT', '1m')
+        total = float(candles['close'].sum())
+        read_ms = (time.perf_counter() - start) * 1000
+
+        mid = int(data.timestamps[len(rows) // 2])
+        start = time.perf_counter()
+        for _ in range(1000):
+            cold.read('binance', 'BTC/USDT', '1m', mid, mid + 86_400_000)
+        range_us = (time.perf_counter() - start) * 1000
+
+    print(f'ohlcv_store: {len(rows)} candles, append {write_ms:.1f} ms, '
+          f'full read+sum {read_ms:.2f} ms (checksum {total:.0f}), '
+          f'1-day range lookup {range_us:.1f} us')
+
+
+def bench_arbitrage_scanner(n_symbols=500, n_quotes=1_000_000):
+    """Quote updates per second through the incremental arbitrage scanner"""
+    from arbitrage_scanner import ArbitrageScanner, replay
+    from exchanges import EXCHANGES
+
+    rng = np.random.default_rng(7)
+    symbols = [f'SYM{i}/USDT' for i in range(n_symbols)]
+    mids = rng.uniform(0.1, 50_000.0, size=n_symbols)
+    sym_idx = rng.integers(0, n_symbols, size=n_quotes)
+    ex_idx = rng.integers(0, len(EXCHANGES), size=n_quotes)
+    mid = mids[sym_idx] * (1.0 + rng.normal(0.0, 0.0015, size=n_quotes))
+    half_spread = mid * 0.0002
+    feed = list(zip([None] * n_quotes,
+                    [EXCHANGES[i] for i in ex_idx],
+                    [symbols[i] for i in sym_idx],
+                    (mid - half_spread).tolist(),
+                    (mid + half_spread).tolist()))
+
+    scanner = ArbitrageScanner(threshold=0.003)
+    start = time.perf_counter()
+    opportunities = replay(scanner, feed)
+    elapsed = time.perf_counter() - start
+    print(f'arbitrage_scanner: {n_quotes:,} quotes over {n_symbols} symbols x {len(EXCHANGES)} exchanges '
+          f'in {elapsed:.2f} s ({n_quotes / elapsed:,.0f} quotes/s, {len(opportunities):,} opportunities)')
+
+
+def bench_cycle_arbitrage(n_assets=300, n_ticks=50_000):
+    """Quote updates per second through the incremental negative-cycle detector"""
+    from cycle_arbitrage import ArbitrageGraph
+    from exchanges import EXCHANGES
+
+    rng = np.random.default_rng(11)
+    usd = {'USDT': 1.0, 'BTC': 60_000.0, 'ETH': 3_000.0}
+    assets = [f'A{i}' for i in range(n_assets)]
+    usd.update({asset: float(p) for asset, p in zip(assets, rng.uniform(0.01, 500.0, n_assets))})
+    markets = [(exchange, f'{asset}/{quote}')
+               for exchange in EXCHANGES
+               for asset in assets for quote in ('USDT', 'BTC', 'ETH')]
+    markets += [(exchange, 'BTC/USDT') for exchange in EXCHANGES]
+    markets += [(exchange, 'ETH/USDT') for exchange in EXCHANGES]
+    markets += [(exchange, 'ETH/BTC') for exchange in EXCHANGES]
+
+    graph = ArbitrageGraph(max_legs=4, transfer_cost=0.0005)
+
+    def tick(exchange, symbol, noise):
+        base, quote = symbol.split('/')
+        mid = usd[base] / usd[quote] * (1.0 + noise)
+        return graph.update_market(exchange, symbol, mid * 0.9998, mid * 1.0002)
+
+    start = time.perf_counter()
+    for exchange, symbol in markets:
+        tick(exchange, symbol, 0.0)
+    warmup = time.perf_counter() - start
+
+    picks = rng.integers(0, len(markets), size=n_ticks)
+    noise = rng.normal(0.0, 0.001, size=n_ticks)
+    found = 0
+    start = time.perf_counter()
+    for i, n in zip(picks.tolist(), noise.tolist()):
+        found += len(tick(*markets[i], n))
+    elapsed = time.perf_counter() - start
+    print(f'cycle_arbitrage: {len(markets):,} markets / {len(graph.nodes):,} nodes built in {warmup:.2f} s; '
+          f'{n_ticks:,} ticks in {elapsed:.2f} s ({n_ticks / elapsed:,.0f} ticks/s, {found:,} cycles)')
+
+
+def bench_order_book(n_levels=5000, n_updates=500_000):
+    """Delta applications per second on a deep book, against a re-sorted dict baseline"""
+    from order_book import OrderBook
+
+    rng = np.random.default_rng(3)
+    tick = 0.01
+    mid = 30_000.0
+    offsets = np.abs(rng.standard_cauchy(n_updates)).clip(0, n_levels) // 1 + 1
+    sides = rng.integers(0, 2, size=n_updates)
+    amounts = np.where(rng.random(n_updates) < 0.3, 0.0, rng.uniform(0.01, 5.0, n_updates))
+    updates = [((mid - o * tick, a), None) if s else (None, (mid + o * tick, a))
+               for o, s, a in zip(offsets.tolist(), sides.tolist(), amounts.tolist())]
+
+    book = OrderBook('binance', 'BTC/USDT')
+    book.apply_snapshot([(mid - i * tick, 1.0) for i in range(1, n_levels + 1)],
+                        [(mid + i * tick, 1.0) for i in range(1, n_levels + 1)])
+    start = time.perf_counter()
+    for bid, ask in updates:
+        book.apply_delta((bid,) if bid else (), (ask,) if ask else ())
+        book.best_bid()
+        book.best_ask()
+    elapsed = time.perf_counter() - start
+
+    bids = {mid - i * tick: 1.0 for i in range(1, n_levels + 1)}
+    asks = {mid + i * tick: 1.0 for i in range(1, n_levels + 1)}
+    n_baseline = n_updates // 100
+    start = time.perf_counter()
+    for bid, ask in updates[:n_baseline]:
+        side, level = (bids, bid) if bid else (asks, ask)
+        if level[1] > 0:
+            side[level[0]] = level[1]
+        else:
+            side.pop(level[0], None)
+        sorted(bids, reverse=True)[:1]
+        sorted(asks)[:1]
+    baseline = (time.perf_counter() - start) / n_baseline
+
+    start = time.perf_counter()
+    for _ in range(10_000):
+        book.depth(20)
+    depth_us = (time.perf_counter() - start) / 10_000 * 1e6
+
+    print(f'order_book: {n_updates:,} deltas on {n_levels:,} levels/side in {elapsed:.2f} s '
+          f'({elapsed / n_updates * 1e6:.2f} us/update vs {baseline * 1e6:.0f} us re-sorted dict); '
+          f'top-20 snapshot {depth_us:.1f} us')
+
+
+def _bench_app(name):
+    """Import the Flask app against a throwaway SQLite database"""
+    import os
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), f'{name}.db')
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{path}')
+    from app import app, db
+    with app.app_context():
+        db.create_all()
+    return app, db
+
+
+def _bench_user(app, db, username='benchuser'):
+    from models import User
+
+    with app.app_context():
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            user = User(username=username, email=f'{username}@example.com')
+            user.set_password('BenchPassword1!')
+            db.session.add(user)
+            db.session.commit()
+        return user.id
+
+
+def bench_trade_ledger(n_trades=50_000):
+    """record() latency and sustained fills/s of the ledger vs commit-per-trade"""
+    import logging
+
+    app, db = _bench_app('ledger')
+    from models import Trade
+    from trade_ledger import TradeLedger
+
+    logging.getLogger().setLevel(logging.WARNING)
+    user_id = _bench_user(app, db)
+    ledger = TradeLedger(app, batch_size=1000, flush_interval=0.05)
+
+    start = time.perf_counter()
+    for i in range(n_trades):
+        ledger.record(user_id=user_id, exchange='binance', symbol='BTC/USDT', side='buy',
+                      type='market', quantity=0.001, price=60000.0 + i, strategy='hft')
+    record_elapsed = time.perf_counter() - start
+    ledger.close()
+    total_elapsed = time.perf_counter() - start
+
+    n_baseline = 500
+    with app.app_context():
+        start = time.perf_counter()
+        for i in range(n_baseline):
+            db.session.add(Trade(exchange='binance', symbol='BTC/USDT', side='buy', type='market',
+                                 quantity=0.001, price=60000.0, cost=60.0, status='filled',
+                                 strategy='hft', user_id=user_id))
+            db.session.commit()
+        baseline = (time.perf_counter() - start) / n_baseline
+
+    m = ledger.metrics()
+    print(f'trade_ledger: {n_trades:,} fills, record() {record_elapsed / n_trades * 1e6:.1f} us each, '
+          f'durable in {total_elapsed:.2f} s ({n_trades / total_elapsed:,.0f} fills/s, '
+          f'{m["batches"]} batches, flush p50 {m["flush_ms_p50"]} ms / p99 {m["flush_ms_p99"]} ms) '
+          f'vs {1 / baseline:,.0f} fills/s committing each trade')
+
+
+def bench_portfolio_optimizer(n_users=2000, n_assets=60, per_user=12, window=720, n_ticks=200):
+    """Batched optimization of every user vs one solve per user, and rolling vs full covariance"""
+    from portfolio_optimizer import RollingCovariance, optimize_weights, shrink
+
+    rng = np.random.default_rng(3)
+    returns = rng.normal(0.0002, 0.01, size=(window + n_ticks, n_assets))
+    returns += rng.normal(0.0, 0.006, size=(window + n_ticks, 1))
+
+    stats = RollingCovariance(n_assets, window)
+    stats.update(returns[:window])
+    start = time.perf_counter()
+    for t in range(window, window + n_ticks):
+        stats.update(returns[t:t + 1])
+        stats.covariance()
+    rolling = (time.perf_counter() - start) / n_ticks
+    start = time.perf_counter()
+    for t in range(window, window + n_ticks):
+        np.cov(returns[t + 1 - window:t + 1], rowvar=False)
+    full = (time.perf_counter() - start) / n_ticks
+    error = np.abs(stats.covariance() - np.cov(returns[-window:], rowvar=False)).max()
+
+    active = np.zeros((n_users, n_assets), dtype=bool)
+    for row in range(n_users):
+        active[row, rng.choice(n_assets, per_user, replace=False)] = True
+    mu = np.broadcast_to(stats.mean(), active.shape)
+    cov = shrink(stats.covariance(), 0.1)
+
+    start = time.perf_counter()
+    batch = optimize_weights(mu, cov, active)
+    batched = time.perf_counter() - start
+
+    n_loop = min(n_users, 200)
+    start = time.perf_counter()
+    for row in range(n_loop):
+        idx = np.flatnonzero(active[row])
+        single = optimize_weights(mu[row, idx], cov[np.ix_(idx, idx)])
+    looped = (time.perf_counter() - start) / n_loop * n_users
+    assert np.allclose(single[0], batch[n_loop - 1, idx])
+
+    print(f'portfolio_optimizer: covariance update {rolling * 1e6:.0f} us vs {full * 1e6:.0f} us '
+          f'recomputed ({n_assets} assets, window {window}, max error {error:.1e}); '
+          f'{n_users} long-only max-Sharpe portfolios in {batched * 1000:.0f} ms batched '
+          f'vs {looped * 1000:.0f} ms one user at a time')
+
+
+def bench_rebalance_scheduler(n_configs=20_000, spread=2.0):
+    """Dispatch latency of the heap scheduler vs scanning every config each tick"""
+    from rebalance_scheduler import RebalanceScheduler
+
+    app, db = _bench_app('scheduler')
+    rng = np.random.default_rng(5)
+    frequencies = rng.integers(60, 86401, size=n_configs)
+    dispatched = []
+    scheduler = RebalanceScheduler(app, rebalance=lambda app, ids: dispatched.extend(ids),
+                                   reload_interval=3600)
+
+    start = time.time()
+    offsets = rng.uniform(0.0, spread, size=n_configs)
+    t0 = time.perf_counter()
+    for config_id in range(n_configs):
+        # last run chosen so that every config falls due within the next `spread` seconds
+        scheduler.schedule(config_id, int(frequencies[config_id]),
+                           start + offsets[config_id] - frequencies[config_id])
+    schedule_us = (time.perf_counter() - t0) / n_configs * 1e6
+    scheduler.start()
+    while len(dispatched) < n_configs and time.time() - start < spread + 10:
+        time.sleep(0.05)
+    m = scheduler.metrics()
+    scheduler.stop()
+
+    due = (start + offsets).tolist()
+    t0 = time.perf_counter()
+    for _ in range(20):
+        [config_id for config_id in range(n_configs) if due[config_id] <= start + 1.0]
+    scan_ms = (time.perf_counter() - t0) / 20 * 1000
+
+    print(f'rebalance_scheduler: {n_configs:,} configs, schedule() {schedule_us:.1f} us, '
+          f'{len(set(dispatched)):,} dispatched in {m["completed"]:,} completions; '
+          f'dispatch latency p50 {m["dispatch_latency_ms_p50"]} ms / p99 {m["dispatch_latency_ms_p99"]} ms; '
+          f'a full poll of every config costs {scan_ms:.1f} ms per tick')
+
+
+def bench_bot_supervisor(n_bots=500, n_symbols=50, pairs_per_bot=5, n_events=100_000):
+    """Routed ticks/s through one shared feed to many bots, vs per-bot indicator state"""
+    import asyncio
+    from market_data import TradeEvent
+    from bot_supervisor import BotSupervisor, BotSpec
+    from indicators import IndicatorCache
+
+    rng = np.random.default_rng(11)
+    symbols = [f'SYM{i}/USDT' for i in range(n_symbols)]
+    specs = [BotSpec(i, 1, f'bot{i}', tuple(sorted(rng.choice(symbols, pairs_per_bot, replace=False))),
+                     ('hft', 'scalping', 'arbitrage', 'ml_prediction'), 0.003, 0.7)
+             for i in range(n_bots)]
+    prices = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.001, size=n_events)))
+    which = rng.integers(0, n_symbols, size=n_events)
+    events = [TradeEvent('binance', symbols[s], i, float(p), 1.0, 'buy')
+              for i, (s, p) in enumerate(zip(which, prices))]
+    orders = []
+
+    async def run():
+        supervisor = BotSupervisor(executor=lambda *args: orders.append(args), manage_feed=False,
+                                   indicators=IndicatorCache())
+        supervisor.start()
+        for spec in specs:
+            supervisor.start_bot(spec)
+        start = time.perf_counter()
+        for i, event in enumerate(events):
+            await supervisor.hub.publish(event)
+            if i % 100 == 99:
+                # yield as a websocket reader would between frames
+                await asyncio.sleep(0)
+        while supervisor.routed < n_events or any(b.inbox for b in supervisor.bots.values()):
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        metrics = supervisor.metrics()
+        await supervisor.stop()
+        return elapsed, metrics
+
+    elapsed, metrics = asyncio.run(run())
+    per_bot = metrics['per_bot'].values() if metrics['per_bot'] else []
+    deliveries = sum(len([1 for spec in specs if e.symbol in spec.pairs]) for e in events[:2000]) / 2000 * n_events
+
+    print(f'bot_supervisor: {n_bots} bots on {n_symbols} symbols, {n_events:,} ticks '
+          f'(~{deliveries:,.0f} bot deliveries) in {elapsed:.2f} s = {n_events / elapsed:,.0f} ticks/s, '
+          f'{len(orders):,} paper orders; indicators updated once per tick '
+          f'instead of {deliveries / n_events:.0f}x with per-bot state')
+
+
+def bench_indicators(n_bars=200_000, window=200):
+    """O(1) streaming indicator updates vs recomputing the window each bar, and cache sharing"""
+    from indicators import IndicatorCache, SMA, RSI
+
+    rng = np.random.default_rng(13)
+    close = (100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.001, size=n_bars)))).tolist()
+
+    cache = IndicatorCache(capacity=1000)
+    specs = [('ema', {'span': 20}), ('sma', {'window': window}), ('bollinger', {'window': 20, 'k': 2.0}),
+             ('rsi', {'period': 14}), ('atr', {'period': 14}), ('macd', {})]
+    for name, params in specs:
+        cache.get('BTC/USDT', '1m', name, **params)
+    start = time.perf_counter()
+    for price in close:
+        cache.update('BTC/USDT', '1m', price, price * 1.001, price * 0.999)
+    streaming = (time.perf_counter() - start) / n_bars
+
+    # the naive path: rebuild every indicator from a 500-bar lookback on each new bar
+    from indicators import INDICATORS
+    n_naive, lookback = 100, 500
+    start = time.perf_counter()
+    for t in range(lookback, lookback + n_naive):
+        for name, params in specs:
+            indicator = INDICATORS[name](**params)
+            for price in close[t - lookback:t]:
+                indicator.update(price, price * 1.001, price * 0.999)
+    naive = (time.perf_counter() - start) / n_naive
+    series = np.asarray(close)
+
+    sma, rsi = SMA(window), RSI(14)
+    for price in close:
+        sma.update(price, price, price)
+        rsi.update(price, price, price)
+    error = abs(sma.value - series[-window:].mean())
+
+    for bot in range(500):
+        cache.get(f'SYM{bot % 50}/USDT', '1m', 'rsi', period=14)
+    m = cache.metrics()
+    print(f'indicators: {len(specs)} indicators updated in {streaming * 1e6:.2f} us per bar vs '
+          f'{naive * 1e6:,.0f} us rebuilding from a {lookback}-bar lookback (SMA error {error:.1e}); 500 bots on 50 pairs '
+          f'share {m["size"] - len(specs)} RSI instances ({m["hits"]} hits / {m["misses"]} misses)')
+
+
+def bench_ml_inference(n_requests=100_000, burst=50):
+    """Micro-batched predictions/s vs one forward pass per request, for a small MLP"""
+    from ml_inference import InferenceServer, FEATURES
+
+    rng = np.random.default_rng(17)
+    features = rng.normal(0.0, 1.0, size=(n_requests, len(FEATURES)))
+    rows = [tuple(row) for row in features.tolist()]
+
+    class MLP:
+        # 5-128-128-1 network, standing in for a framework model's forward pass
+        layers = [(rng.normal(0, 0.3, size=shape), np.zeros(shape[1]))
+                  for shape in ((len(FEATURES), 128), (128, 128), (128, 1))]
+
+        def predict_proba(self, x):
+            for i, (w, b) in enumerate(self.layers):
+                x = x @ w + b
+                if i < len(self.layers) - 1:
+                    x = np.tanh(x)
+            return 1.0 / (1.0 + np.exp(-x[:, 0]))
+
+    model = MLP()
+
+    n_single = 20_000
+    start = time.perf_counter()
+    for row in rows[:n_single]:
+        model.predict_proba(np.array([row]))
+    single = (time.perf_counter() - start) / n_single
+
+    server = InferenceServer(model, window=0.002)
+    start = time.perf_counter()
+    results = []
+    for i in range(0, n_requests, burst):
+        for row in rows[i:i + burst]:
+            server.submit(row, lambda prediction, error: results.append(prediction))
+        time.sleep(0)
+    while len(results) < n_requests:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    assert abs(server.predict(rows[0]).probability - model.predict_proba(features[:1])[0]) < 1e-12
+    server.stop()
+    m = server.metrics()
+    print(f'ml_inference: {n_requests:,} predictions in {elapsed:.2f} s ({n_requests / elapsed:,.0f}/s, '
+          f'{m["batches"]} batches, avg size {m["avg_batch_size"]}, mean latency '
+          f'{m["latency_ms_histogram"]["mean"]} ms) vs {1 / single:,.0f}/s calling the model per request')
+
+
+def bench_news_pipeline(n_articles=20_000, duplicate_rate=0.2):
+    """Articles/s through dedupe, asset matching, scoring and bulk insert vs one article at a time"""
+    import json
+    import logging
+    import os
+    import tempfile
+
+    app, db = _bench_app('news')
+    from news_pipeline import NewsPipeline, AssetMatcher, load_scorer, read_feed_directory
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = np.random.default_rng(5)
+    words = ('bitcoin ETH solana rally surge plunge hack approval market traders exchange volume '
+             'Cardano DOGE record lawsuit inflows analysts week price network upgrade the of and').split()
+    n_unique = int(n_articles * (1 - duplicate_rate))
+    feed = tempfile.mkdtemp()
+    with open(os.path.join(feed, 'articles.jsonl'), 'w') as f:
+        for i in rng.integers(0, n_unique, size=n_articles).tolist():
+            text = ' '.join(words[j] for j in rng.integers(0, len(words), size=120).tolist())
+            f.write(json.dumps({'title': f'Headline {i}', 'content': text, 'source': 'bench',
+                                'url': f'https://news.example.com/{i}?utm_source=feed'}) + '\n')
+
+    scorer = load_scorer()
+    seen_by_model = []
+    score = scorer.score
+    scorer.score = lambda texts: seen_by_model.extend(texts) or score(texts)
+
+    pipeline = NewsPipeline(app, scorer=scorer, matcher=AssetMatcher(), batch_size=64)
+    m = pipeline.run(read_feed_directory(feed))
+    with app.app_context():
+        from models import NewsItem
+        stored = NewsItem.query.count()
+    assert len(seen_by_model) == stored == m['inserted'], 'duplicates reached the model'
+
+    single = NewsPipeline(app, scorer=scorer, matcher=AssetMatcher(), batch_size=1)
+    n_single = 1000
+    with app.app_context():
+        from models import NewsItemAsset
+        db.session.query(NewsItemAsset).delete()
+        db.session.query(NewsItem).delete()
+        db.session.commit()
+    single.run(article for _, article in zip(range(n_single), read_feed_directory(feed)))
+
+    print(f'news_pipeline: {m["received"]:,} articles at {m["articles_per_s"]:,} articles/s '
+          f'({m["duplicates"]:,} duplicates skipped before scoring, {m["inserted"]:,} stored, '
+          f'{m["scorer"]} scorer at {m["scored_per_s"]:,}/s) vs {single.metrics()["articles_per_s"]:,} '
+          f'articles/s one at a time')
+
+
+def bench_sentiment_aggregates(n_items=50_000, n_assets=40, n_lookups=100_000):
+    """Per-asset rolling sentiment lookups vs scanning and decoding the last 24h of NewsItem"""
+    import json
+    import logging
+    from datetime import datetime, timedelta
+
+    app, db = _bench_app('sentiment')
+    from models import NewsItem
+    from sentiment_aggregates import SentimentAggregates
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = np.random.default_rng(9)
+    assets = [f'A{i}' for i in range(n_assets)]
+    now = datetime.utcnow()
+    ages = rng.uniform(0, 86400, size=n_items).tolist()
+    scores = rng.uniform(-1, 1, size=n_items).tolist()
+    picks = rng.integers(0, n_assets, size=(n_items, 2)).tolist()
+    with app.app_context():
+        db.session.execute(db.insert(NewsItem), [
+            {'title': f'item {i}', 'content': '', 'source': 'bench', 'url': f'https://x/{i}',
+             'url_hash': str(i), 'sentiment_score': scores[i], 'timestamp': now - timedelta(seconds=ages[i]),
+             'related_assets': json.dumps(sorted({assets[a] for a in picks[i]}))}
+            for i in range(n_items)])
+        db.session.commit()
+
+    aggregates = SentimentAggregates(app)
+    start = time.perf_counter()
+    aggregates.load()
+    load_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(n_lookups):
+        aggregates.get(assets[i % n_assets], '1h')
+    lookup = (time.perf_counter() - start) / n_lookups
+
+    n_scans = 5
+    # the 1h window is the last 12 five-minute buckets, the current one included
+    since = datetime.utcfromtimestamp((int(time.time() // 300) - 11) * 300)
+    with app.app_context():
+        start = time.perf_counter()
+        for i in range(n_scans):
+            asset = assets[i]
+            rows = NewsItem.query.filter(NewsItem.timestamp >= since).all()
+            matched = [r.sentiment_score for r in rows if asset in r.get_related_assets()]
+        scan = (time.perf_counter() - start) / n_scans
+    assert aggregates.get(assets[n_scans - 1], '1h')['count'] == len(matched)
+
+    print(f'sentiment_aggregates: {n_items:,} items over {n_assets} assets loaded in {load_elapsed:.2f} s; '
+          f'lookup {lookup * 1e6:.2f} us vs {scan * 1e3:.1f} ms scanning the last hour of NewsItem')
+
+
+def bench_config_routing(n_configs=20_000, n_symbols=300, pairs_per_config=8, n_lookups=200):
+    """Active configs trading a symbol via bot_config_pair vs decoding every config's pairs"""
+    import json
+    import logging
+
+    app, db = _bench_app('routing')
+    from models import BotConfig
+
+    logging.getLogger().setLevel(logging.WARNING)
+    user_id = _bench_user(app, db)
+    rng = np.random.default_rng(13)
+    symbols = [f'SYM{i}/USDT' for i in range(n_symbols)]
+    with app.app_context():
+        for start in range(0, n_configs, 2000):
+            db.session.add_all(
+                BotConfig(name=f'bot {i}', user_id=user_id, is_active=bool(i % 2),
+                          strategies=json.dumps(['hft']),
+                          pairs=json.dumps([symbols[j] for j in rng.choice(n_symbols, pairs_per_config,
+                                                                              replace=False).tolist()]))
+                for i in range(start, min(start + 2000, n_configs)))
+            db.session.commit()
+
+        start = time.perf_counter()
+        for i in range(n_lookups):
+            indexed = {config_id for (config_id,) in
+                       BotConfig.trading(symbols[i % n_symbols]).with_entities(BotConfig.id)}
+        indexed_elapsed = (time.perf_counter() - start) / n_lookups
+
+        n_scans = 5
+        start = time.perf_counter()
+        for i in range(n_lookups - n_scans, n_lookups):
+            scanned = {c.id for c in BotConfig.query.filter_by(is_active=True).all()
+                       if symbols[i % n_symbols] in c.get_pairs()}
+        scan_elapsed = (time.perf_counter() - start) / n_scans
+    assert indexed == scanned
+
+    print(f'config_routing: active configs trading a symbol among {n_configs:,} in '
+          f'{indexed_elapsed * 1e3:.2f} ms via bot_config_pair vs {scan_elapsed * 1e3:.0f} ms decoding pairs JSON')
+
+
+def bench_bot_status(n_configs=50, n_polls=2000):
+    """/api/bot_status polls/s answered with 304 from the status cache vs rebuilding the payload"""
+    import json
+    import logging
+
+    app, db = _bench_app('status')
+    from models import BotConfig
+    from status_cache import get_status_cache, load_bot_status
+
+    logging.getLogger().setLevel(logging.WARNING)
+    user_id = _bench_user(app, db)
+    with app.app_context():
+        db.session.add_all(BotConfig(name=f'bot {i}', user_id=user_id, strategies=json.dumps(['hft', 'scalping']),
+                                     pairs=json.dumps([f'SYM{j}/USDT' for j in range(i % 10 + 1)]))
+                           for i in range(n_configs))
+        db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    etag = client.get('/api/bot_status').headers['ETag']
+
+    start = time.perf_counter()
+    for _ in range(n_polls):
+        response = client.get('/api/bot_status', headers={'If-None-Match': etag})
+    cached = (time.perf_counter() - start) / n_polls
+    assert response.status_code == 304
+
+    cache = get_status_cache()
+    start = time.perf_counter()
+    for _ in range(n_polls):
+        cache.bump(user_id)
+        client.get('/api/bot_status', headers={'If-None-Match': etag})
+    rebuilt = (time.perf_counter() - start) / n_polls
+
+    with app.app_context():
+        start = time.perf_counter()
+        for _ in range(n_polls):
+            load_bot_status(user_id)
+        load = (time.perf_counter() - start) / n_polls
+
+    print(f'bot_status: {1 / cached:,.0f} polls/s answered 304 from cache vs {1 / rebuilt:,.0f} polls/s '
+          f'rebuilding {n_configs} configs every poll (query + decode {load * 1e3:.2f} ms of it)')
+
+
+def _smtp_sink():
+    """Minimal local SMTP server that accepts and counts messages; returns (server, port)"""
+    import socketserver
+    import threading
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write(b'220 sink\r\n')
+            for line in self.rfile:
+                command = line[:4].upper()
+                if command == b'DATA':
+                    self.wfile.write(b'354 go ahead\r\n')
+                    for data in self.rfile:
+                        if data in (b'.\r\n', b'.\n'):
+                            break
+                    self.server.messages += 1
+                    self.wfile.write(b'250 queued\r\n')
+                elif command == b'QUIT':
+                    self.wfile.write(b'221 bye\r\n')
+                    return
+                else:
+                    self.wfile.write(b'250 ok\r\n')
+
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.messages = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+
+def bench_notifications(n_users=20, fills_per_user=200):
+    """Emails and producer-side cost for a minute of fills: digests vs one email per fill"""
+    import logging
+    import smtplib
+
+    app, db = _bench_app('notifications')
+    from notifications import NotificationDispatcher
+
+    logging.getLogger().setLevel(logging.WARNING)
+    server, port = _smtp_sink()
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_USE_TLS=False, MAIL_USERNAME=None)
+    user_ids = [_bench_user(app, db, f'notify{i}') for i in range(n_users)]
+    rows = [{'user_id': user_id, 'side': 'buy', 'quantity': 0.01, 'symbol': 'BTC/USDT', 'price': 50000.0 + i,
+             'strategy': 'hft', 'exchange': 'binance'}
+            for i in range(fills_per_user) for user_id in user_ids]
+
+    dispatcher = NotificationDispatcher(app, rate_limit=3600)
+    start = time.perf_counter()
+    dispatcher.on_trades(rows)
+    queued = (time.perf_counter() - start) / len(rows)
+    start = time.perf_counter()
+    dispatcher.flush()
+    delivered = time.perf_counter() - start
+    digests = server.messages
+    dispatcher.stop()
+
+    server.messages = 0
+    sample = rows[:500]
+    start = time.perf_counter()
+    for row in sample:
+        with app.app_context():
+            from models import User
+            address = db.session.get(User, row['user_id']).email
+        with smtplib.SMTP('127.0.0.1', port) as connection:
+            connection.sendmail('bench@example.com', [address], f'Subject: fill {row["price"]}\r\n\r\nfill')
+    naive = (time.perf_counter() - start) / len(sample)
+    server.shutdown()
+
+    print(f'notifications: {len(rows):,} fills -> {digests} digest emails over '
+          f'{dispatcher.metrics()["smtp_connects"]} SMTP connection(s); notify() {queued * 1e6:.1f} us/fill, '
+          f'delivery {delivered * 1e3:.0f} ms total vs {naive * 1e3:.2f} ms/fill '
+          f'({naive * len(rows):.1f} s) for lookup + connect + send per fill')
+
+
+def _load_test(port, paths, cookie, concurrency, duration):
+    """Keep-alive HTTP clients hitting paths round-robin; returns (requests, seconds, {path: latencies})"""
+    import http.client
+    import threading
+
+    latencies = {path: [] for path in paths}
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        i = offset
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            connection.request('GET', path, headers={'Cookie': f'session={cookie}'})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append((path, response.status))
+            latencies[path].append(time.perf_counter() - start)
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise RuntimeError(f'{len(errors)} failed requests, e.g. {errors[0]}')
+    return sum(len(v) for v in latencies.values()), elapsed, latencies
+
+
+def bench_web_load(concurrency=16, duration=5.0, workers=None, warmup=1.0):
+    """Requests/s and p50/p99 latency on the dashboard and API routes: dev server vs gunicorn"""
+    import os
+    import json
+    import socket
+    import logging
+    import threading
+    import subprocess
+    import importlib.util
+    from datetime import datetime
+    from werkzeug.serving import make_server
+
+    app, db = _bench_app('web')
+    from models import BotConfig, Trade
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    user_id = _bench_user(app, db)
+    with app.app_context():
+        db.session.add_all(BotConfig(name=f'bot {i}', user_id=user_id, strategies=json.dumps(['hft']),
+                                     pairs=json.dumps(['BTC/USDT', 'ETH/USDT'])) for i in range(10))
+        db.session.add_all(Trade(user_id=user_id, exchange='binance', symbol='BTC/USDT', side='buy', type='market',
+                                 quantity=0.01, price=50000.0 + i, cost=500.0 + i, status='filled',
+                                 strategy='hft', timestamp=datetime.utcnow()) for i in range(2000))
+        db.session.commit()
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'_user_id': str(user_id), '_fresh': True})
+    paths = ['/dashboard', '/api/bot_status', '/api/history/trades?limit=50']
+
+    def report(label, total, elapsed, latencies):
+        parts = []
+        for path, values in latencies.items():
+            values = sorted(values)
+            parts.append(f'{path.split("?")[0]} p50 {values[len(values) // 2] * 1e3:.1f} / '
+                         f'p99 {values[int(len(values) * 0.99)] * 1e3:.1f} ms')
+        print(f'web_load [{label}]: {total / elapsed:,.0f} req/s at concurrency {concurrency}; ' + ', '.join(parts))
+
+    def run(port):
+        # the first requests of each worker load per-process caches; leave them out
+        _load_test(port, paths, cookie, concurrency, warmup)
+        return _load_test(port, paths, cookie, concurrency, duration)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    report('werkzeug threaded, 1 process', *run(server.server_port))
+    server.shutdown()
+
+    if importlib.util.find_spec('gunicorn') is None:
+        print('web_load: gunicorn is not installed, skipping the production server run')
+        return
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    workers = workers or os.cpu_count()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), GUNICORN_ACCESS_LOG='',
+               GUNICORN_LOG_LEVEL='warning')
+    process = subprocess.Popen(['gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{port}', 'wsgi:app'],
+                               env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        for _ in range(300):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        report(f'gunicorn {workers} workers', *run(port))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_dashboard(history_sizes=(1_000, 100_000), n_views=300):
+    """/dashboard p50/p99 from the read-model cache vs rebuilt per view, as trade history grows"""
+    import logging
+    from datetime import datetime, timedelta
+
+    app, db = _bench_app('dashboard')
+    from models import Trade, ArbitrageOpportunity
+    from dashboard_cache import get_dashboard_cache
+
+    logging.getLogger().setLevel(logging.WARNING)
+    user_id = _bench_user(app, db)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    cache = get_dashboard_cache()
+
+    def views(rebuild):
+        latencies = []
+        for _ in range(n_views):
+            if rebuild:
+                cache.invalidate(user_id)
+            start = time.perf_counter()
+            response = client.get('/dashboard')
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200
+        latencies.sort()
+        return latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3
+
+    stored = 0
+    now = datetime.utcnow()
+    for size in history_sizes:
+        with app.app_context():
+            rows = [{'user_id': user_id, 'exchange': 'binance', 'symbol': 'BTC/USDT', 'side': 'buy',
+                     'type': 'market', 'quantity': 0.01, 'price': 50000.0, 'cost': 500.0, 'status': 'filled',
+                     'strategy': 'hft', 'timestamp': now - timedelta(seconds=i)} for i in range(stored, size)]
+            db.session.execute(db.insert(Trade), rows)
+            db.session.execute(db.insert(ArbitrageOpportunity), [
+                {'user_id': user_id, 'symbol': 'BTC/USDT', 'exchange_1': 'binance', 'exchange_2': 'kraken',
+                 'price_1': 50000.0, 'price_2': 50100.0, 'profit_percent': 0.2, 'executed': False,
+                 'timestamp': now - timedelta(seconds=i)} for i in range(stored // 10, size // 10)])
+            db.session.commit()
+        stored = size
+        views(False)
+        cached = views(False)
+        rebuilt = views(True)
+        print(f'dashboard with {size:,} trades: p50/p99 {cached[0]:.2f}/{cached[1]:.2f} ms from the read model '
+              f'vs {rebuilt[0]:.2f}/{rebuilt[1]:.2f} ms rebuilding it every view')
+
+
+def bench_db_pool(web_threads=8, duration=3.0, batch=200):
+    """Ledger flush latency under web load: ledger sharing the web pool vs its own writer pool"""
+    import os
+    import logging
+    import tempfile
+    import threading
+    from datetime import datetime
+    from sqlalchemy import create_engine, event, exc, select
+
+    from db_routing import engine_options, _sqlite_pragmas
+
+    app, db = _bench_app('pool')
+    from models import Trade
+
+    logging.getLogger().setLevel(logging.WARNING)
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'pool.db')}"
+    os.environ.update(DB_POOL_SIZE='4', DB_MAX_OVERFLOW='0', DB_POOL_TIMEOUT='5')
+    try:
+        web = create_engine(url, **engine_options(url))
+        writer = create_engine(url, **engine_options(url, 'writer'))
+    finally:
+        for name in ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT'):
+            del os.environ[name]
+    for engine in (web, writer):
+        event.listen(engine, 'connect', _sqlite_pragmas)
+    db.metadata.create_all(web)
+    row = {'user_id': 1, 'exchange': 'binance', 'symbol': 'BTC/USDT', 'side': 'buy', 'type': 'market',
+           'quantity': 0.01, 'price': 50000.0, 'cost': 500.0, 'status': 'filled', 'strategy': 'hft'}
+    with web.begin() as connection:
+        connection.execute(db.insert(Trade), [dict(row, timestamp=datetime.utcnow()) for _ in range(5000)])
+
+    def run(ledger_engine):
+        stop = threading.Event()
+
+        def request_loop():
+            # a request holds its connection while it queries and renders
+            while not stop.is_set():
+                try:
+                    with web.connect() as connection:
+                        connection.execute(select(Trade).order_by(Trade.id.desc()).limit(50)).all()
+                        time.sleep(0.005)
+                except exc.TimeoutError:
+                    pass
+
+        threads = [threading.Thread(target=request_loop) for _ in range(web_threads)]
+        for thread in threads:
+            thread.start()
+        latencies = []
+        timeouts = 0
+        deadline = time.perf_counter() + duration
+        try:
+            while time.perf_counter() < deadline:
+                rows = [dict(row, timestamp=datetime.utcnow()) for _ in range(batch)]
+                start = time.perf_counter()
+                try:
+                    with ledger_engine.begin() as connection:
+                        connection.execute(db.insert(Trade), rows)
+                except exc.TimeoutError:
+                    timeouts += 1
+                latencies.append(time.perf_counter() - start)
+                time.sleep(0.02)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        latencies.sort()
+        return latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3, timeouts
+
+    shared = run(web)
+    separate = run(writer)
+    wait = web.pool.metrics.as_dict()
+    print(f'db_pool: ledger flush of {batch} rows with {web_threads} requests on a 4-connection pool: '
+          f'p50/p99 {shared[0]:.1f}/{shared[1]:.1f} ms ({shared[2]} pool timeouts) sharing it vs '
+          f'{separate[0]:.1f}/{separate[1]:.1f} ms ({separate[2]} timeouts) on its own writer pool; '
+          f'web checkout wait mean {wait["wait_ms_mean"]} ms, max {wait["wait_ms_max"]} ms')
+
+
+HEAVY_MODULES = ('numpy', 'pandas', 'torch', 'tensorflow', 'transformers', 'sklearn', 'ccxt')
+
+
+def bench_startup(runs=3, budget_ms=None):
+    """Import-time profile of `import app` and a check against the startup budget.
+
+    Fails if importing the app takes longer than STARTUP_BUDGET_MS (best of
+    runs, in a fresh interpreter) or loads any of HEAVY_MODULES.
+    """
+    import os
+    import subprocess
+
+    budget_ms = budget_ms or float(os.environ.get('STARTUP_BUDGET_MS', 1500))
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, SESSION_SECRET=os.environ.get('SESSION_SECRET', 'bench'), PYTHONPATH=here)
+    env.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+    probe = ('import sys, time; start = time.perf_counter(); import app; '
+             'print((time.perf_counter() - start) * 1e3); '
+             f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+
+    timings = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', probe], env=env, cwd=here,
+                             capture_output=True, text=True, check=True).stdout.split('\n')
+        timings.append(float(out[0]))
+        loaded = [m for m in out[1].split(',') if m]
+
+    profile = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], env=env, cwd=here,
+                             capture_output=True, text=True, check=True).stderr
+    # direct imports of app (one indent level below it) with their cumulative time
+    direct = []
+    for line in profile.splitlines():
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        if fields[2].startswith('   ') and not fields[2].startswith('    '):
+            direct.append((int(fields[1]), fields[2].strip()))
+    top = sorted(direct, reverse=True)[:8]
+
+    best = min(timings)
+    print(f'startup: import app {best:.0f} ms (best of {runs}, budget {budget_ms:.0f} ms); slowest imports: ' +
+          ', '.join(f'{name} {us / 1e3:.0f} ms' for us, name in top))
+    if loaded:
+        raise AssertionError(f'import app loaded heavy modules: {", ".join(loaded)}')
+    if best > budget_ms:
+        raise AssertionError(f'import app took {best:.0f} ms, over the {budget_ms:.0f} ms budget')
+
+
+BENCHMARKS = {
+    'backtest': bench_backtest,
+    'sweep': bench_sweep,
+    'ohlcv_store': bench_ohlcv_store,
+    'arbitrage_scanner': bench_arbitrage_scanner,
+    'cycle_arbitrage': bench_cycle_arbitrage,
+    'order_book': bench_order_book,
+    'trade_ledger': bench_trade_ledger,
+    'portfolio_optimizer': bench_portfolio_optimizer,
+    'rebalance_scheduler': bench_rebalance_scheduler,
+    'bot_supervisor': bench_bot_supervisor,
+    'indicators': bench_indicators,
+    'ml_inference': bench_ml_inference,
+    'news_pipeline': bench_news_pipeline,
+    'sentiment_aggregates': bench_sentiment_aggregates,
+    'config_routing': bench_config_routing,
+    'bot_status': bench_bot_status,
+    'notifications': bench_notifications,
+    'web_load': bench_web_load,
+    'startup': bench_startup,
+    'dashboard': bench_dashboard,
+    'db_pool': bench_db_pool,
+}
+
+
+if __name__ == '__main__':
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        BENCHMARKS[name]()
@@ -0,0 +1,516 @@
+"""Bot runtime: one asyncio task per active BotConfig on a shared market data feed.
+
+The supervisor owns the only IngestionService (one websocket per exchange
+for the union of all bots' pairs) and a single hub subscription. Each trade
+is routed by symbol to the bots that trade that pair. A symbol's 'tick'
+indicators in the shared IndicatorCache are updated once per trade, before
+fan-out, so no indicator is computed more than once however many bots share
+a pair. Signal decisions are memoized per tick, keyed by strategy and
+thresholds, so bots with equal settings share them too. Each bot consumes
+its own bounded drop-oldest inbox. ml_prediction bots act on the latest
+prediction for their symbol, requested once per tick from the shared
+micro-batching InferenceServer. A slow bot loses stale ticks instead of
+holding back the others. Per-bot CPU time (thread_time around its handler)
+and tick-to-decision latency are accounted in BotStats. The default executor
+only simulates: its fills are written with status 'paper', which the
+valuation engine and trade-fill emails ignore.
+
+The same process runs the cross-exchange arbitrage scanner and the
+multi-leg cycle graph (arbitrage_scanner.ArbitrageService) off the hub's
+order book events, so arbitrage configs get ArbitrageOpportunity and
+CycleArbitrageOpportunity rows from live books, and publishes live marks
+for the portfolio valuation engines (portfolio_valuation.PricePublisher).
+
+/api/start_bot and /api/stop_bot flip BotConfig.is_active. The supervisor
+polls BotConfig.updated_at and starts or gracefully stops tasks to match:
+
+    python bot_supervisor.py
+"""
+import os
+import time
+import signal
+import asyncio
+import logging
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+
+from exchanges import EXCHANGES
+from market_data import MarketDataHub, IngestionService, TradeEvent
+from indicators import get_indicator_cache
+from ml_inference import tick_features
+from notifications import get_notifier, notify
+from dashboard_cache import get_dashboard_cache
+
+BotSpec = namedtuple('BotSpec', 'config_id user_id name pairs strategies '
+                                'arb_profit_threshold ml_confidence_threshold')
+
+ORDER_NOTIONAL = float(os.environ.get('BOT_ORDER_NOTIONAL', 100.0))
+RELOAD_INTERVAL = 1.0
+BOT_QUEUE_SIZE = 1000
+
+
+class PairState:
+    """Latest price of one symbol plus handles to its shared tick indicators"""
+
+    __slots__ = ('symbol', 'price', 'ticks', 'indicators', 'decisions', 'prediction')
+
+    def __init__(self, symbol, indicators):
+        self.symbol = symbol
+        self.price = None
+        self.ticks = 0
+        self.indicators = indicators
+        # (strategy, thresholds) -> signal at the current tick, shared by bots with equal settings
+        self.decisions = {}
+        self.prediction = None
+
+    def update(self, price):
+        self.decisions.clear()
+        self.price = price
+        self.ticks += 1
+        self.indicators.update(self.symbol, 'tick', price)
+
+    def indicator(self, name, **params):
+        return self.indicators.get(self.symbol, 'tick', name, **params)
+
+    def set_prediction(self, prediction):
+        self.prediction = prediction
+
+
+# -- live signals (the streaming analogues of backtester.SIGNAL_FUNCTIONS) ---
+# each returns 1 to enter, -1 to exit, 0 to hold
+
+def _crossover(state, fast, slow, threshold):
+    fast, slow = state.indicator('ema', span=fast), state.indicator('ema', span=slow)
+    if not slow.ready:
+        return 0
+    gap = fast.current / slow.current - 1.0
+    if gap > threshold:
+        return 1
+    return -1 if gap < 0.0 else 0
+
+
+def live_hft(state, spec):
+    return _crossover(state, 5, 20, spec.arb_profit_threshold / 10.0)
+
+
+def live_scalping(state, spec):
+    return _crossover(state, 3, 12, spec.arb_profit_threshold / 20.0)
+
+
+def live_arbitrage(state, spec):
+    fair = state.indicator('ema', span=60)
+    if not fair.ready:
+        return 0
+    deviation = state.price / fair.current - 1.0
+    if deviation < -spec.arb_profit_threshold:
+        return 1
+    return -1 if deviation >= 0.0 else 0
+
+
+def live_ml_prediction(state, spec):
+    """Acts on the latest batched model prediction for the symbol (see ml_inference)"""
+    prediction = state.prediction
+    if prediction is None:
+        return 0
+    if prediction.probability >= spec.ml_confidence_threshold:
+        return 1
+    return -1 if prediction.probability < 1.0 - spec.ml_confidence_threshold else 0
+
+
+LIVE_SIGNALS = {
+    'hft': live_hft,
+    'scalping': live_scalping,
+    'arbitrage': live_arbitrage,
+    'ml_prediction': live_ml_prediction,
+}
+
+
+def paper_execute(spec, strategy, event, side, quantity, price):
+    """Default executor: record a simulated fill at price, status PAPER_STATUS, in the trade ledger"""
+    from trade_ledger import get_ledger, PAPER_STATUS
+
+    get_ledger().record(user_id=spec.user_id, exchange=event.exchange, symbol=event.symbol,
+                        side=side, type='market', quantity=quantity, price=price,
+                        strategy=strategy, status=PAPER_STATUS)
+
+
+class BotStats:
+    __slots__ = ('events', 'dropped', 'orders', 'cpu_seconds', 'latencies', 'started_at')
+
+    def __init__(self):
+        self.events = 0
+        self.dropped = 0
+        self.orders = 0
+        self.cpu_seconds = 0.0
+        self.latencies = deque(maxlen=1024)
+        self.started_at = datetime.utcnow()
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+        return {
+            'events': self.events,
+            'dropped': self.dropped,
+            'orders': self.orders,
+            'cpu_ms': round(self.cpu_seconds * 1000, 3),
+            'latency_ms_p50': percentile(0.50),
+            'latency_ms_p99': percentile(0.99),
+            'started_at': self.started_at.isoformat(),
+        }
+
+
+class Bot:
+    """One config's strategies over its pairs, driven by routed ticks.
+
+    Ticks land in a bounded deque. An Event wakes the task once per burst,
+    and the task drains everything queued, so a busy feed costs one wake-up
+    per burst rather than one per tick.
+    """
+
+    def __init__(self, spec, executor=paper_execute, maxsize=BOT_QUEUE_SIZE):
+        self.spec = spec
+        self.executor = executor
+        self.signals = [(name, LIVE_SIGNALS[name],
+                         (name, spec.arb_profit_threshold, spec.ml_confidence_threshold))
+                        for name in spec.strategies if name in LIVE_SIGNALS]
+        self.positions = {}
+        self.inbox = deque(maxlen=maxsize)
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.stats = BotStats()
+        self.task = None
+
+    def deliver(self, event, state, received):
+        inbox = self.inbox
+        if len(inbox) == inbox.maxlen:
+            self.stats.dropped += 1
+        inbox.append((event, state, received))
+        if not self.wakeup.is_set():
+            self.wakeup.set()
+
+    def stop(self):
+        """Finish what is queued, then end the task"""
+        self.stopping = True
+        self.wakeup.set()
+
+    async def run(self):
+        inbox, wakeup, handle = self.inbox, self.wakeup, self.handle
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+            cpu = time.thread_time()
+            while inbox:
+                item = inbox.popleft()
+                try:
+                    handle(*item)
+                except Exception as e:
+                    logging.exception(f'Bot {self.spec.config_id} failed on {item[0]}')
+                    notify(self.spec.user_id, 'error', f'Bot "{self.spec.name}" error', str(e))
+            self.stats.cpu_seconds += time.thread_time() - cpu
+            if self.stopping:
+                return
+
+    def handle(self, event, state, enqueued):
+        stats = self.stats
+        stats.events += 1
+        decisions = state.decisions
+        # signals read the shared state, which may be newer than a queued event;
+        # fill at the price they were computed on
+        price = state.price
+        for name, signal, settings in self.signals:
+            decision = decisions.get(settings)
+            if decision is None:
+                decision = decisions[settings] = signal(state, self.spec)
+            if not decision:
+                continue
+            key = (name, event.symbol)
+            held = self.positions.get(key)
+            if decision > 0 and held is None:
+                quantity = ORDER_NOTIONAL / price
+                self.executor(self.spec, name, event, 'buy', quantity, price)
+                self.positions[key] = quantity
+                stats.orders += 1
+            elif decision < 0 and held is not None:
+                self.executor(self.spec, name, event, 'sell', held, price)
+                del self.positions[key]
+                stats.orders += 1
+        stats.latencies.append(time.perf_counter() - enqueued)
+
+
+class BotSupervisor:
+    """Runs every active bot config as a task on one event loop and one market data feed"""
+
+    def __init__(self, app=None, hub=None, executor=paper_execute, manage_feed=True,
+                 url_overrides=None, reload_interval=RELOAD_INTERVAL, indicators=None,
+                 inference=None):
+        self.app = app
+        self.hub = hub or MarketDataHub()
+        self.indicators = indicators or get_indicator_cache()
+        self.inference = inference
+        self.executor = executor
+        self.manage_feed = manage_feed
+        self.url_overrides = url_overrides
+        self.reload_interval = reload_interval
+
+        self.bots = {}
+        self.states = {}
+        self._routes = {}
+        # symbol -> number of routed bots running ml_prediction
+        self._ml_routes = {}
+        self._ingestion = None
+        self._feed_symbols = ()
+        self._subscription = None
+        self._dispatcher = None
+        self._last_reload = None
+        self.routed = 0
+
+    # -- bots ----------------------------------------------------------------
+
+    def start_bot(self, spec):
+        """Start (or restart with new settings) the task for a config; call on the loop"""
+        current = self.bots.get(spec.config_id)
+        if current is not None and current.spec == spec:
+            return current
+        if current is not None:
+            self._retire(current)
+        bot = Bot(spec, self.executor)
+        bot.task = asyncio.get_running_loop().create_task(bot.run(), name=f'bot-{spec.config_id}')
+        self.bots[spec.config_id] = bot
+        uses_ml = 'ml_prediction' in spec.strategies
+        if uses_ml and self.inference is None:
+            from ml_inference import get_inference_server
+            self.inference = get_inference_server()
+        for symbol in spec.pairs:
+            self._routes.setdefault(symbol, []).append(bot)
+            if symbol not in self.states:
+                self.states[symbol] = PairState(symbol, self.indicators)
+            if uses_ml:
+                self._ml_routes[symbol] = self._ml_routes.get(symbol, 0) + 1
+        logging.info(f'Started bot {spec.config_id} "{spec.name}" on {len(spec.pairs)} pairs')
+        return bot
+
+    async def stop_bot(self, config_id, timeout=5.0):
+        """Stop routing to a bot, let it finish queued ticks, then end its task"""
+        bot = self.bots.pop(config_id, None)
+        if bot is None:
+            return False
+        self._retire(bot)
+        try:
+            await asyncio.wait_for(bot.task, timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f'Bot {config_id} did not stop within {timeout}s; cancelled')
+        logging.info(f'Stopped bot {config_id} "{bot.spec.name}"')
+        return True
+
+    def _retire(self, bot):
+        """Stop routing ticks to a bot and let its task end after the queued ones"""
+        self._unroute(bot)
+        bot.stop()
+
+    def _unroute(self, bot):
+        uses_ml = 'ml_prediction' in bot.spec.strategies
+        for symbol in bot.spec.pairs:
+            if uses_ml and symbol in self._ml_routes:
+                self._ml_routes[symbol] -= 1
+                if not self._ml_routes[symbol]:
+                    del self._ml_routes[symbol]
+            routed = self._routes.get(symbol)
+            if routed is None:
+                continue
+            if bot in routed:
+                routed.remove(bot)
+            if not routed:
+                del self._routes[symbol]
+                self.states.pop(symbol, None)
+                # tick indicators stop receiving updates once nobody routes the symbol
+                self.indicators.discard(symbol, 'tick')
+
+    # -- feed ----------------------------------------------------------------
+
+    def _request_prediction(self, loop, state):
+        """One inference request per ml symbol per tick, however many bots read it"""
+        features = tick_features(state)
+        if features is None:
+            return
+
+        def done(prediction, error):
+            if error is None:
+                loop.call_soon_threadsafe(state.set_prediction, prediction)
+
+        self.inference.submit(features, done)
+
+    async def _dispatch(self):
+        routes, states, ml_routes = self._routes, self.states, self._ml_routes
+        loop = asyncio.get_running_loop()
+        async for event in self._subscription:
+            bots = routes.get(event.symbol)
+            if not bots:
+                continue
+            state = states[event.symbol]
+            state.update(event.price)
+            self.routed += 1
+            if event.symbol in ml_routes:
+                self._request_prediction(loop, state)
+            received = time.perf_counter()
+            for bot in bots:
+                bot.deliver(event, state, received)
+
+    async def refresh_feed(self):
+        """Subscribe the symbols newly routed and unsubscribe the ones no bot routes any more"""
+        symbols = tuple(sorted(self._routes))
+        if not self.manage_feed or symbols == self._feed_symbols:
+            return
+        self._feed_symbols = symbols
+        wanted = {exchange: list(symbols) for exchange in EXCHANGES}
+        if self._ingestion is None:
+            if symbols:
+                self._ingestion = IngestionService(wanted, hub=self.hub, url_overrides=self.url_overrides)
+                self._ingestion.start()
+        else:
+            await self._ingestion.update_symbols(wanted)
+
+    def start(self):
+        """Start the dispatcher on the running loop"""
+        self._subscription = self.hub.subscribe(kinds=(TradeEvent,), maxsize=100000,
+                                                policy='drop_oldest')
+        self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch(),
+                                                                  name='bot-dispatch')
+
+    async def stop(self):
+        for config_id in list(self.bots):
+            await self.stop_bot(config_id)
+        if self._ingestion is not None:
+            await self._ingestion.stop()
+            self._ingestion = None
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        if self._subscription is not None:
+            self.hub.unsubscribe(self._subscription)
+            self._subscription = None
+
+    # -- config sync ---------------------------------------------------------
+
+    def _load_changes(self):
+        """Configs changed since the last load, as (config_id, is_active, spec) rows, and the active ids.
+
+        Deleting a config leaves no updated_at to find, so the ids of every
+        active config are read too and bots missing from them are stopped.
+        """
+        from models import BotConfig
+
+        with self.app.app_context():
+            query = BotConfig.query
+            started = datetime.utcnow()
+            if self._last_reload is not None:
+                query = query.filter(BotConfig.updated_at >= self._last_reload - timedelta(seconds=5))
+            else:
+                query = query.filter_by(is_active=True)
+            changes = []
+            for config in query.all():
+                spec = BotSpec(config.id, config.user_id, config.name,
+                               tuple(sorted({p.strip().upper() for p in config.get_pairs() if p.strip()})),
+                               tuple(config.get_strategies()),
+                               config.arb_profit_threshold or 0.003,
+                               config.ml_confidence_threshold or 0.7)
+                changes.append((config.id, config.is_active, spec))
+            active = {config_id for (config_id,) in
+                      BotConfig.query.with_entities(BotConfig.id).filter_by(is_active=True)}
+        self._last_reload = started
+        return changes, active
+
+    async def sync(self):
+        """Start and stop bots to match BotConfig.is_active in the database"""
+        changes, active = await asyncio.get_running_loop().run_in_executor(None, self._load_changes)
+        for config_id, is_active, spec in changes:
+            if is_active:
+                self.start_bot(spec)
+            elif config_id in self.bots:
+                await self.stop_bot(config_id)
+        for config_id in [config_id for config_id in self.bots if config_id not in active]:
+            # deleted (or deactivated without an updated_at bump)
+            await self.stop_bot(config_id)
+        await self.refresh_feed()
+        return len(changes)
+
+    async def run(self):
+        self.start()
+        try:
+            while True:
+                try:
+                    await self.sync()
+                except Exception:
+                    logging.exception('Bot config sync failed')
+                await asyncio.sleep(self.reload_interval)
+        finally:
+            await self.stop()
+
+    # -- metrics -------------------------------------------------------------
+
+    def metrics(self):
+        return {
+            'bots': len(self.bots),
+            'symbols': len(self._routes),
+            'routed_events': self.routed,
+            'feed_dropped': self._subscription.dropped if self._subscription else 0,
+            'inference': self.inference.metrics() if self.inference else None,
+            'per_bot': {config_id: bot.stats.as_dict() for config_id, bot in self.bots.items()},
+        }
+
+
+async def main(app):
+    """The bots, the arbitrage scanner and the price publisher, on one loop and one market data feed.
+
+    SIGTERM (how Procfile process managers stop a process) and SIGINT cancel
+    the run. Bots are stopped and the trade ledger is drained before exit,
+    because atexit alone does not run when a process is killed by a signal.
+    """
+    from arbitrage_scanner import ArbitrageService
+    from portfolio_valuation import PricePublisher
+    from trade_ledger import get_ledger
+
+    loop = asyncio.get_running_loop()
+    current = asyncio.current_task()
+    signals = (signal.SIGTERM, signal.SIGINT)
+
+    def shutdown():
+        # a second signal must not interrupt the drain
+        for sig in signals:
+            loop.add_signal_handler(sig, logging.warning, 'Bot supervisor is already shutting down')
+        current.cancel()
+
+    for sig in signals:
+        loop.add_signal_handler(sig, shutdown)
+
+    supervisor = BotSupervisor(app)
+    arbitrage = ArbitrageService(app, supervisor.hub)
+    arbitrage.start()
+    prices = PricePublisher(app, supervisor.hub)
+    prices.start()
+    try:
+        await supervisor.run()
+    except asyncio.CancelledError:
+        logging.info('Bot supervisor shutting down')
+    finally:
+        # run() has stopped every bot on its way out; write what they recorded
+        await arbitrage.stop()
+        await prices.stop()
+        left = await loop.run_in_executor(None, get_ledger().close)
+        await loop.run_in_executor(None, get_notifier().stop)
+        logging.info(f'Bot supervisor stopped ({left} trades left unwritten)')
+
+
+if __name__ == '__main__':
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    # subscribe the email dispatcher and the dashboard read model to this process's trade ledger
+    get_notifier()
+    get_dashboard_cache()
+    asyncio.run(main(app))
@@ -0,0 +1,363 @@
+"""Triangular and multi-leg arbitrage detection on a log-price graph.
+
+Nodes are (exchange, asset). A market BASE/QUOTE with bid b and ask a on an
+exchange with fee f contributes two edges:
+
+    BASE  -> QUOTE  rate b * (1 - f)        (sell base)
+    QUOTE -> BASE   rate (1 - f) / a        (buy base)
+
+Optionally, the same asset on two exchanges is linked by a transfer edge. Edge
+weights are -log(rate), so a cycle whose rates multiply to more than 1 is a
+negative cycle.
+
+Shortest distances from a virtual source (0 to every node) are kept between
+ticks and repaired incrementally with SPFA: a cheaper edge only re-relaxes
+from its head, and a dearer edge that a node's shortest path used resets that
+node's shortest-path subtree before re-relaxing it. Each relaxation walks at
+most max_legs parents to see whether it would close a short cycle. Only the
+parts of the graph touched by a tick are visited, so there is no
+per-tick enumeration of triangles.
+
+Like the pairwise scanner, the graph can take one threshold per user
+setting: a cycle is emitted when it opens above the lowest, and again each
+time its profit widens past a higher one while it stays open.
+"""
+import math
+import logging
+from bisect import bisect_right
+from collections import deque
+from datetime import datetime
+
+from exchanges import TAKER_FEES
+from arbitrage_scanner import OpportunityRecorder
+
+EPSILON = 1e-12
+
+
+class CycleOpportunity:
+    """A profitable closed loop of conversions; profit_percent is in percent.
+
+    reported is the highest threshold already emitted while the cycle stayed open, or None.
+    """
+
+    __slots__ = ('legs', 'profit_percent', 'timestamp', 'reported')
+
+    def __init__(self, legs, profit_percent, timestamp, reported=None):
+        self.legs = legs
+        self.profit_percent = profit_percent
+        self.timestamp = timestamp
+        self.reported = reported
+
+    @property
+    def start_asset(self):
+        return self.legs[0]['from'][1]
+
+    @property
+    def exchanges(self):
+        return sorted({leg['exchange'] for leg in self.legs})
+
+    @property
+    def symbols(self):
+        return sorted({leg['symbol'] for leg in self.legs if leg['symbol']})
+
+    def __repr__(self):
+        path = ' -> '.join(f"{leg['from'][0]}:{leg['from'][1]}" for leg in self.legs)
+        return f'<CycleOpportunity {path} {self.profit_percent:.3f}%>'
+
+
+class ArbitrageGraph:
+    """Incrementally maintained negative-cycle detector over exchange/asset nodes"""
+
+    def __init__(self, max_legs=4, min_profit=0.0, fees=None, transfer_cost=None,
+                 relaxation_budget=200000, on_opportunity=None):
+        self.max_legs = max_legs
+        self.set_thresholds((min_profit,))
+        self.fees = dict(TAKER_FEES, **(fees or {}))
+        # None disables cross-exchange transfer edges; otherwise a fractional cost
+        self.transfer_cost = transfer_cost
+        self.relaxation_budget = relaxation_budget
+        self.on_opportunity = on_opportunity
+
+        self._node_index = {}
+        self.nodes = []
+        self._out = []
+        self._in = []
+        self._dist = []
+        self._parent = []
+        self._depth = []
+        self._children = []
+        self._edge_info = {}
+
+        # active cycles by canonical key, the thresholds each has reached, and the
+        # cycle keys each edge takes part in
+        self.active = {}
+        self._levels = {}
+        self._edge_cycles = {}
+
+    def set_thresholds(self, thresholds):
+        """Fractional profits whose upward crossing emits a cycle; empty emits nothing"""
+        self._thresholds = tuple(sorted(set(thresholds)))
+        self.min_profit = self._thresholds[0] if self._thresholds else math.inf
+
+    # -- graph maintenance --------------------------------------------------
+
+    def _node(self, exchange, asset):
+        key = (exchange, asset)
+        idx = self._node_index.get(key)
+        if idx is None:
+            idx = len(self.nodes)
+            self._node_index[key] = idx
+            self.nodes.append(key)
+            self._out.append({})
+            self._in.append({})
+            self._dist.append(0.0)
+            self._parent.append(-1)
+            self._depth.append(0)
+            self._children.append(set())
+            if self.transfer_cost is not None:
+                weight = -math.log(1.0 - self.transfer_cost)
+                for other, other_idx in list(self._node_index.items()):
+                    if other[1] == asset and other[0] != exchange:
+                        self._set_weight(idx, other_idx, weight, (other[0], None, 'transfer'))
+                        self._set_weight(other_idx, idx, weight, (exchange, None, 'transfer'))
+        return idx
+
+    def _set_weight(self, u, v, weight, info):
+        """Store an edge weight; returns the SPFA seeds this change requires"""
+        old = self._out[u].get(v)
+        self._out[u][v] = weight
+        self._in[v][u] = weight
+        self._edge_info[(u, v)] = info
+
+        if old is None or weight < old:
+            return [u]
+        if weight > old and self._parent[v] == u:
+            return self._reset_subtree(v)
+        return []
+
+    def _remove_edge(self, u, v):
+        if v not in self._out[u]:
+            return []
+        del self._out[u][v]
+        del self._in[v][u]
+        self._edge_info.pop((u, v), None)
+        if self._parent[v] == u:
+            return self._reset_subtree(v)
+        return []
+
+    def _reset_subtree(self, root):
+        """Forget distances derived through root; return predecessors to re-relax from"""
+        subtree, stack, seen = [], [root], {root}
+        while stack:
+            node = stack.pop()
+            subtree.append(node)
+            for child in self._children[node]:
+                # a cycle longer than max_legs can leave a loop in the parent graph
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+
+        for node in subtree:
+            parent = self._parent[node]
+            if parent >= 0:
+                self._children[parent].discard(node)
+            self._parent[node] = -1
+            self._dist[node] = 0.0
+            self._depth[node] = 0
+        seeds = set(subtree)
+        for node in subtree:
+            seeds.update(self._in[node])
+        return list(seeds)
+
+    def update_market(self, exchange, symbol, bid, ask, timestamp=None):
+        """Apply a top-of-book quote for BASE/QUOTE on an exchange; returns new opportunities"""
+        base, quote = symbol.split('/')
+        u, v = self._node(exchange, base), self._node(exchange, quote)
+        fee = self.fees.get(exchange, 0.0)
+
+        seeds = []
+        if bid > 0 and ask > 0:
+            seeds += self._set_weight(u, v, -math.log(bid * (1.0 - fee)), (exchange, symbol, 'sell'))
+            seeds += self._set_weight(v, u, -math.log((1.0 - fee) / ask), (exchange, symbol, 'buy'))
+        else:
+            seeds += self._remove_edge(u, v)
+            seeds += self._remove_edge(v, u)
+
+        widened = self._revalidate(((u, v), (v, u)), timestamp)
+        return widened + self._relax(seeds, timestamp)
+
+    # -- detection -----------------------------------------------------------
+
+    def _relax(self, seeds, timestamp):
+        dist, parent, depth, children, out = (self._dist, self._parent, self._depth,
+                                              self._children, self._out)
+        queue = deque(seeds)
+        queued = set(seeds)
+        budget = self.relaxation_budget
+        found = []
+        # cycles are only looked for within max_legs ancestors, so bounding tree depth keeps
+        # each repair local and stops a long negative cycle dragging distances down forever
+        depth_limit = 2 * self.max_legs
+
+        while queue and budget > 0:
+            u = queue.popleft()
+            queued.discard(u)
+            du = dist[u]
+            for v, weight in out[u].items():
+                candidate = du + weight
+                if candidate >= dist[v] - EPSILON:
+                    continue
+                budget -= 1
+
+                cycle = self._closes_cycle(u, v)
+                if cycle is not None:
+                    opportunity = self._register_cycle(cycle, timestamp)
+                    if opportunity is not None:
+                        found.append(opportunity)
+                    # never let the parent graph itself contain the cycle
+                    continue
+                if depth[u] + 1 > depth_limit:
+                    continue
+
+                old_parent = parent[v]
+                if old_parent >= 0:
+                    children[old_parent].discard(v)
+                parent[v] = u
+                children[u].add(v)
+                dist[v] = candidate
+                depth[v] = depth[u] + 1
+                if v not in queued:
+                    queued.add(v)
+                    queue.append(v)
+
+        if queue:
+            logging.debug(f'Cycle search stopped after {self.relaxation_budget} relaxations')
+        return found
+
+    def _closes_cycle(self, u, v):
+        """Nodes v -> ... -> u if v is within max_legs - 1 ancestors of u, else None"""
+        path = [u]
+        node = u
+        for _ in range(self.max_legs - 1):
+            if node == v:
+                path.reverse()
+                return path
+            node = self._parent[node]
+            if node < 0:
+                return None
+            path.append(node)
+        if node == v:
+            path.reverse()
+            return path
+        return None
+
+    @staticmethod
+    def _canonical(cycle):
+        start = cycle.index(min(cycle))
+        return tuple(cycle[start:] + cycle[:start])
+
+    def _cycle_edges(self, key):
+        return [(key[i], key[(i + 1) % len(key)]) for i in range(len(key))]
+
+    def _cycle_profit(self, key):
+        total = 0.0
+        for u, v in self._cycle_edges(key):
+            weight = self._out[u].get(v)
+            if weight is None:
+                return None
+            total += weight
+        return math.exp(-total) - 1.0
+
+    def _register_cycle(self, cycle, timestamp):
+        key = self._canonical(cycle)
+        if key in self.active:
+            return None
+        profit = self._cycle_profit(key)
+        if profit is None or profit <= self.min_profit:
+            return None
+
+        legs = []
+        for u, v in self._cycle_edges(key):
+            exchange, symbol, side = self._edge_info[(u, v)]
+            legs.append({
+                'from': list(self.nodes[u]),
+                'to': list(self.nodes[v]),
+                'exchange': exchange,
+                'symbol': symbol,
+                'side': side,
+                'rate': math.exp(-self._out[u][v]),
+            })
+        opportunity = CycleOpportunity(legs, profit * 100.0, timestamp or datetime.utcnow())
+        self.active[key] = opportunity
+        self._levels[key] = bisect_right(self._thresholds, profit)
+        for edge in self._cycle_edges(key):
+            self._edge_cycles.setdefault(edge, set()).add(key)
+
+        if self.on_opportunity is not None:
+            self.on_opportunity(opportunity)
+        return opportunity
+
+    def _revalidate(self, edges, timestamp=None):
+        """Drop active cycles through the changed edges once they stop being profitable.
+
+        Returns the cycles that stayed open and widened past a higher threshold.
+        """
+        widened = []
+        for edge in edges:
+            for key in list(self._edge_cycles.get(edge, ())):
+                profit = self._cycle_profit(key)
+                if profit is not None and profit > self.min_profit:
+                    current = self.active[key]
+                    level = bisect_right(self._thresholds, profit)
+                    reached = self._levels[key]
+                    self._levels[key] = level
+                    if level <= reached:
+                        current.profit_percent = profit * 100.0
+                        continue
+                    # a new object, so the one already emitted keeps the profit it was emitted at;
+                    # thresholds may have been reloaded since the level was set
+                    reported = self._thresholds[min(reached, len(self._thresholds)) - 1] if reached else None
+                    opportunity = CycleOpportunity(current.legs, profit * 100.0,
+                                                   timestamp or datetime.utcnow(), reported)
+                    self.active[key] = opportunity
+                    widened.append(opportunity)
+                    if self.on_opportunity is not None:
+                        self.on_opportunity(opportunity)
+                    continue
+                del self.active[key]
+                del self._levels[key]
+                for cycle_edge in self._cycle_edges(key):
+                    keys = self._edge_cycles.get(cycle_edge)
+                    if keys is not None:
+                        keys.discard(key)
+                        if not keys:
+                            del self._edge_cycles[cycle_edge]
+        return widened
+
+
+class CycleOpportunityRecorder(OpportunityRecorder):
+    """Writes cycle opportunities to CycleArbitrageOpportunity for interested users"""
+
+    def symbols_of(self, opportunity):
+        return opportunity.symbols
+
+    def build_model(self, opportunity, user_id):
+        from models import CycleArbitrageOpportunity
+
+        row = CycleArbitrageOpportunity(
+            start_asset=opportunity.start_asset,
+            exchanges=','.join(opportunity.exchanges),
+            leg_count=len(opportunity.legs),
+            profit_percent=opportunity.profit_percent,
+            timestamp=opportunity.timestamp,
+            user_id=user_id
+        )
+        row.set_legs(opportunity.legs)
+        return row
+
+    def to_dict(self, row):
+        return None
+
+    def describe(self, row):
+        return (f'{row.start_asset} cycle {row.profit_percent:.2f}%',
+                f'{row.leg_count} legs on {row.exchanges}')
@@ -0,0 +1,323 @@
+"""Per-user dashboard read model.
+
+dashboard() used to run three queries per view: bot configs, the last 10
+trades and the last 5 open opportunities. It also valued the portfolio,
+and the login manager added a User query. Now one cache entry per user
+holds all four, as plain dicts:
+
+    {'bot_configs': [...], 'recent_trades': [...], 'arbitrage_opps': [...], 'portfolio': {...}}
+
+so a view is one lookup.
+
+The entry is built once from indexed LIMIT queries. After that it is kept
+current on write instead of rebuilt:
+- the trade ledger listener prepends committed fills
+- the opportunity recorder prepends recorded opportunities
+- the live feed applies rows written by other processes
+- config routes drop the entry
+Entries also expire after DASHBOARD_CACHE_TTL seconds, which bounds
+staleness from writers this process never hears about. The cost of a view
+therefore does not depend on how many trades a user has.
+
+The store is an in-process LRU unless REDIS_URL is set and redis is
+installed. With redis, web workers and the bot and scanner daemons share
+one copy, so a fill recorded by the supervisor reaches every worker. The
+redis read-modify-write is last-writer-wins; the TTL bounds any lost
+update.
+
+UserCache keeps users' column values so the login manager can re-attach a
+User to the session without a query.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', 30))
+DASHBOARD_CACHE_SIZE = int(os.environ.get('DASHBOARD_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+RECENT_TRADES = 10
+OPEN_OPPORTUNITIES = 5
+
+
+class LRUCache:
+    """Thread-safe mapping with a size bound (least recently used evicted) and per-entry ttl"""
+
+    def __init__(self, capacity=DASHBOARD_CACHE_SIZE, ttl=DASHBOARD_CACHE_TTL, clock=time.monotonic):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.clock() >= entry[1]:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def update(self, key, change):
+        """Replace key's value with change(value) if present; keeps its expiry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (change(entry[0]), entry[1])
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisStore:
+    """The LRUCache interface over redis, with JSON values and SETEX expiry"""
+
+    shared = True
+
+    def __init__(self, url, ttl=DASHBOARD_CACHE_TTL, prefix='dashboard:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(f'{self.prefix}{key}')
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.setex(f'{self.prefix}{key}', int(self.ttl) or 1, json.dumps(value))
+
+    def update(self, key, change):
+        name = f'{self.prefix}{key}'
+        value = self.client.get(name)
+        if value is not None:
+            self.client.set(name, json.dumps(change(json.loads(value))), keepttl=True)
+
+    def pop(self, key):
+        self.client.delete(f'{self.prefix}{key}')
+
+    def clear(self):
+        for name in self.client.scan_iter(f'{self.prefix}*'):
+            self.client.delete(name)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(f'{self.prefix}*'))
+
+
+def _trade_key(trade):
+    return (trade['timestamp'], trade['symbol'], trade['side'], trade['quantity'], trade['price'])
+
+
+def _merge(existing, new, key, limit):
+    """Newest-first union of two newest-first lists, without duplicates, cut to limit"""
+    seen = set()
+    merged = []
+    for item in sorted(new + existing, key=lambda item: item['timestamp'] or '', reverse=True):
+        if key(item) in seen:
+            continue
+        seen.add(key(item))
+        merged.append(item)
+        if len(merged) == limit:
+            break
+    return merged
+
+
+def ledger_row_to_dict(row):
+    """history.trade_to_dict for a TradeLedger row dict (no id yet)"""
+    timestamp = row.get('timestamp')
+    return {
+        'id': row.get('id'),
+        'exchange': row.get('exchange'),
+        'symbol': row['symbol'],
+        'order_id': row.get('order_id'),
+        'side': row['side'],
+        'type': row.get('type'),
+        'quantity': row['quantity'],
+        'price': row['price'],
+        'cost': row.get('cost'),
+        'fee': row.get('fee'),
+        'status': row.get('status'),
+        'strategy': row.get('strategy'),
+        'profit_loss': row.get('profit_loss'),
+        'timestamp': timestamp.isoformat() if hasattr(timestamp, 'isoformat') else timestamp,
+    }
+
+
+class DashboardCache:
+    """Dashboard view data per user id, built once and then maintained by the write paths"""
+
+    def __init__(self, store=None, loader=None):
+        self.store = store or LRUCache()
+        self.shared = getattr(self.store, 'shared', False)
+        self.loader = loader or load_dashboard
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+
+    def _bump(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def get(self, user_id):
+        view = self.store.get(user_id)
+        if view is not None:
+            self.hits += 1
+            return view
+        self.misses += 1
+        with self._lock:
+            version = self._versions.get(user_id, 0)
+        view = self.loader(user_id)
+        with self._lock:
+            # a write while loading may be missing from view: serve it but do not keep it
+            if self._versions.get(user_id, 0) == version:
+                self.store.set(user_id, view)
+        return view
+
+    def invalidate(self, user_id):
+        self._bump(user_id)
+        self.store.pop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+        self.store.clear()
+
+    def add_trades(self, user_id, trades):
+        """Prepend trade dicts (history.trade_to_dict shape) to user_id's recent trades"""
+        self._bump(user_id)
+        self.store.update(user_id, lambda view: dict(
+            view, recent_trades=_merge(view['recent_trades'], trades, _trade_key, RECENT_TRADES)))
+        self.updates += 1
+
+    def add_opportunities(self, user_id, opportunities):
+        """Prepend unexecuted opportunity dicts to user_id's open opportunities"""
+        opportunities = [opp for opp in opportunities if not opp.get('executed')]
+        if not opportunities:
+            return
+        self._bump(user_id)
+        self.store.update(user_id, lambda view: dict(
+            view, arbitrage_opps=_merge(view['arbitrage_opps'], opportunities,
+                                        lambda opp: opp['id'], OPEN_OPPORTUNITIES)))
+        self.updates += 1
+
+    def on_trades(self, rows):
+        """TradeLedger listener: committed fills, grouped per user"""
+        by_user = {}
+        for row in rows:
+            by_user.setdefault(row['user_id'], []).append(ledger_row_to_dict(row))
+        for user_id, trades in by_user.items():
+            self.add_trades(user_id, trades)
+
+    def metrics(self):
+        return {
+            'backend': 'redis' if self.shared else 'memory',
+            'entries': len(self.store),
+            'hits': self.hits,
+            'misses': self.misses,
+            'updates': self.updates,
+        }
+
+
+def load_dashboard(user_id):
+    from history import trade_to_dict, opportunity_to_dict, config_to_dict
+    from models import BotConfig, Trade, ArbitrageOpportunity
+    from portfolio_valuation import get_valuation_engine
+
+    configs = BotConfig.query.filter_by(user_id=user_id).order_by(BotConfig.id).all()
+    trades = Trade.query.filter_by(user_id=user_id).order_by(Trade.timestamp.desc()).limit(RECENT_TRADES).all()
+    opportunities = ArbitrageOpportunity.query.filter_by(user_id=user_id, executed=False).order_by(
+        ArbitrageOpportunity.timestamp.desc()).limit(OPEN_OPPORTUNITIES).all()
+    return {
+        'bot_configs': [config_to_dict(config) for config in configs],
+        'recent_trades': [trade_to_dict(trade) for trade in trades],
+        'arbitrage_opps': [opportunity_to_dict(opp) for opp in opportunities],
+        'portfolio': get_valuation_engine().summary(user_id),
+    }
+
+
+class UserCache:
+    """Column values of recently loaded users, re-attached to the session without a query"""
+
+    def __init__(self, ttl=USER_CACHE_TTL, capacity=DASHBOARD_CACHE_SIZE):
+        self._entries = LRUCache(capacity, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, user_id):
+        from sqlalchemy.orm import make_transient_to_detached
+        from sqlalchemy.orm.util import identity_key
+        from app import db
+        from models import User
+
+        values = self._entries.get(user_id)
+        if values is None or identity_key(User, user_id) in db.session.identity_map:
+            self.misses += 1
+            user = db.session.get(User, user_id)
+            if user is not None:
+                self._entries.set(user_id, {c.key: getattr(user, c.key) for c in User.__table__.columns})
+            return user
+        self.hits += 1
+        user = User(**values)
+        # persistent with these values and no pending changes, as if just loaded
+        make_transient_to_detached(user)
+        db.session.add(user)
+        return user
+
+    def invalidate(self, user_id=None):
+        if user_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(user_id)
+
+
+_cache = None
+_user_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_dashboard_cache():
+    """Process-wide dashboard read model, subscribed to the trade ledger's committed fills"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            from trade_ledger import get_ledger
+            store = None
+            url = os.environ.get('REDIS_URL')
+            if url:
+                try:
+                    store = RedisStore(url)
+                except ImportError:
+                    logging.warning('REDIS_URL is set but redis is not installed; using the in-process cache')
+            _cache = DashboardCache(store)
+            get_ledger().add_listener(_cache.on_trades)
+        return _cache
+
+
+def get_user_cache():
+    global _user_cache
+    with _cache_lock:
+        if _user_cache is None:
+            _user_cache = UserCache()
+        return _user_cache
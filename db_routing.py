@@ -0,0 +1,192 @@
+"""Database engines: pool sizing, SQLite settings, replica reads and pool metrics.
+
+Three engines, each with its own pool:
+- the default bind, the primary, used by web requests and daemons
+- 'writer', a small separate pool on the primary that only the trade
+  ledger's batch inserts use, so a busy web tier cannot starve fills of
+  connections and fills cannot starve the web tier
+- 'replica', present only when DATABASE_REPLICA_URL is set. Reads inside
+  replica_reads() (and views decorated with read_replica) go there, while
+  flushes and everything else go to the primary. Only history views use it,
+  since they can tolerate replication lag.
+
+Pool sizes come from DB_POOL_SIZE, DB_MAX_OVERFLOW and DB_POOL_TIMEOUT,
+with DB_WRITER_* and DB_REPLICA_* overrides. With the SQLite fallback,
+every connection uses WAL (readers do not block the writer) and waits up
+to SQLITE_BUSY_TIMEOUT ms for a lock instead of failing.
+
+Each pool records how long checkouts take. pool_metrics() reports the
+counts, mean and max wait, a histogram and timeouts, next to the pool's
+size and current overflow.
+"""
+import os
+import time
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+POOL_DEFAULTS = {
+    'primary': (10, 20, 30.0),
+    'writer': (2, 0, 30.0),
+    'replica': (10, 20, 30.0),
+}
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+_replica = ContextVar('replica_reads', default=False)
+
+
+class PoolMetrics:
+    __slots__ = ('checkouts', 'timeouts', 'wait_total', 'wait_max', 'buckets', 'lock')
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, timed_out=False):
+        ms = seconds * 1000.0
+        with self.lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += ms
+            self.wait_max = max(self.wait_max, ms)
+            self.buckets[bisect.bisect_left(WAIT_BUCKETS_MS, ms)] += 1
+
+    def as_dict(self):
+        labels = [f'<={b}ms' for b in WAIT_BUCKETS_MS] + [f'>{WAIT_BUCKETS_MS[-1]}ms']
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_ms_mean': round(self.wait_total / self.checkouts, 3) if self.checkouts else None,
+                'wait_ms_max': round(self.wait_max, 3),
+                'wait_ms_histogram': dict(zip(labels, self.buckets)),
+            }
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that times every checkout, including waits for a free connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.observe(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.observe(time.perf_counter() - start)
+        return connection
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends reads inside replica_reads() to the replica bind"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _replica.get() and not self._flushing:
+            engine = self._db.engines.get('replica')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def replica_reads():
+    """Run the queries in this block on the replica, when one is configured"""
+    token = _replica.set(True)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def read_replica(view):
+    """Decorator for read-only views whose queries may lag the primary"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def normalize_url(url):
+    if url and url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def _in_memory(url):
+    return url.startswith('sqlite') and (':memory:' in url or url.rstrip('/') == 'sqlite:')
+
+
+def engine_options(url, role='primary'):
+    """Engine options for url: pool sizes from the environment, or none for in-memory SQLite"""
+    options = {'pool_recycle': 300, 'pool_pre_ping': True}
+    if _in_memory(url):
+        # one shared connection; sizing and WAL do not apply
+        return options
+    prefix = 'DB_' if role == 'primary' else f'DB_{role.upper()}_'
+    size, overflow, timeout = POOL_DEFAULTS[role]
+    options.update(
+        poolclass=MeteredQueuePool,
+        pool_size=int(os.environ.get(f'{prefix}POOL_SIZE', size)),
+        max_overflow=int(os.environ.get(f'{prefix}MAX_OVERFLOW', overflow)),
+        pool_timeout=float(os.environ.get(f'{prefix}POOL_TIMEOUT', timeout)),
+    )
+    if url.startswith('sqlite'):
+        options['connect_args'] = {'timeout': SQLITE_BUSY_TIMEOUT / 1000.0}
+    return options
+
+
+def database_binds(primary_url, replica_url=None):
+    """SQLALCHEMY_BINDS: the ledger writer pool on the primary, plus the replica if configured"""
+    binds = {}
+    if not _in_memory(primary_url):
+        # an in-memory database cannot be opened twice: the ledger then shares the primary pool
+        binds['writer'] = dict(engine_options(primary_url, 'writer'), url=primary_url)
+    if replica_url:
+        binds['replica'] = dict(engine_options(replica_url, 'replica'), url=replica_url)
+    return binds
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def configure_engines(app, db):
+    """Install the SQLite connection settings on the app's engines (after db.init_app)"""
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite' and isinstance(engine.pool, QueuePool):
+                event.listen(engine, 'connect', _sqlite_pragmas)
+
+
+def pool_metrics(db):
+    """Checkout metrics and occupancy per bind (primary, writer, replica)"""
+    metrics = {}
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        entry = {'status': pool.status()}
+        if isinstance(pool, QueuePool):
+            entry.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+        if isinstance(pool, MeteredQueuePool):
+            entry.update(pool.metrics.as_dict())
+        metrics[key or 'primary'] = entry
+    return metrics
@@ -0,0 +1,21 @@
+# Supported exchanges as (id, display name); ids match ccxt exchange ids
+EXCHANGE_CHOICES = [
+    ('binance', 'Binance'),
+    ('coinbase', 'Coinbase Pro'),
+    ('kraken', 'Kraken'),
+    ('huobi', 'Huobi'),
+    ('okx', 'OKX'),
+    ('kucoin', 'KuCoin')
+]
+
+EXCHANGES = tuple(exchange for exchange, _ in EXCHANGE_CHOICES)
+
+# Default taker fees as a fraction of notional
+TAKER_FEES = {
+    'binance': 0.001,
+    'coinbase': 0.006,
+    'kraken': 0.0026,
+    'huobi': 0.002,
+    'okx': 0.001,
+    'kucoin': 0.001,
+}
@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, SelectField, FloatField, IntegerField
-from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, NumberRange
+from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, NumberRange, Optional
 from models import User
+from exchanges import EXCHANGE_CHOICES
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
@@ -55,14 +56,7 @@ class ResetPasswordForm(FlaskForm):
     submit = SubmitField('Update Password')
 
 class ApiKeyForm(FlaskForm):
-    exchange = SelectField('Exchange', choices=[
-        ('binance', 'Binance'),
-        ('coinbase', 'Coinbase Pro'),
-        ('kraken', 'Kraken'),
-        ('huobi', 'Huobi'),
-        ('okx', 'OKX'),
-        ('kucoin', 'KuCoin')
-    ], validators=[DataRequired()])
+    exchange = SelectField('Exchange', choices=EXCHANGE_CHOICES, validators=[DataRequired()])
     api_key = StringField('API Key', validators=[DataRequired()])
     api_secret = PasswordField('API Secret', validators=[DataRequired()])
     submit = SubmitField('Add API Key')
@@ -95,7 +89,7 @@ class BotConfigForm(FlaskForm):
     submit = SubmitField('Save Configuration')
 
 class NotificationSettingsForm(FlaskForm):
-    notification_email = StringField('Notification Email', validators=[Email()])
+    notification_email = StringField('Notification Email', validators=[Optional(), Email()])
     email_notifications_enabled = BooleanField('Enable Email Notifications')
     notify_trades = BooleanField('Trade Notifications')
     notify_arbitrage = BooleanField('Arbitrage Opportunity Notifications')
@@ -105,14 +99,7 @@ class NotificationSettingsForm(FlaskForm):
     submit = SubmitField('Save Settings')
 
 class WithdrawalForm(FlaskForm):
-    exchange = SelectField('Exchange', choices=[
-        ('binance', 'Binance'),
-        ('coinbase', 'Coinbase Pro'),
-        ('kraken', 'Kraken'),
-        ('huobi', 'Huobi'),
-        ('okx', 'OKX'),
-        ('kucoin', 'KuCoin')
-    ], validators=[DataRequired()])
+    exchange = SelectField('Exchange', choices=EXCHANGE_CHOICES, validators=[DataRequired()])
     asset = StringField('Asset Symbol', validators=[DataRequired()], 
                        render_kw={"placeholder": "BTC, ETH, USDT"})
     amount = FloatField('Amount', validators=[DataRequired(), NumberRange(min=0.0001)])
@@ -149,3 +136,43 @@ class BacktestForm(FlaskForm):
         NumberRange(min=1, max=365)
     ], default=30)
     submit = SubmitField('Run Backtest')
+
+class ParameterSweepForm(BacktestForm):
+    mode = SelectField('Search Mode', choices=[
+        ('grid', 'Grid Search'),
+        ('random', 'Random Search')
+    ], default='grid')
+    n_samples = IntegerField('Random Samples', validators=[NumberRange(min=1, max=5000)], default=50)
+    arb_threshold_min = FloatField('Arbitrage Threshold Min (%)', 
+                                 validators=[NumberRange(min=0.1, max=10.0)], default=0.1)
+    arb_threshold_max = FloatField('Arbitrage Threshold Max (%)', 
+                                 validators=[NumberRange(min=0.1, max=10.0)], default=1.0)
+    arb_threshold_steps = IntegerField('Arbitrage Threshold Steps', 
+                                     validators=[NumberRange(min=1, max=50)], default=5)
+    ml_confidence_min = FloatField('ML Confidence Min', 
+                                 validators=[NumberRange(min=0.1, max=1.0)], default=0.5)
+    ml_confidence_max = FloatField('ML Confidence Max', 
+                                 validators=[NumberRange(min=0.1, max=1.0)], default=0.9)
+    ml_confidence_steps = IntegerField('ML Confidence Steps', 
+                                     validators=[NumberRange(min=1, max=50)], default=5)
+    rebalance_min = IntegerField('Rebalance Frequency Min (seconds)', 
+                               validators=[NumberRange(min=60, max=86400)], default=900)
+    rebalance_max = IntegerField('Rebalance Frequency Max (seconds)', 
+                               validators=[NumberRange(min=60, max=86400)], default=86400)
+    rebalance_steps = IntegerField('Rebalance Frequency Steps', 
+                                 validators=[NumberRange(min=1, max=50)], default=4)
+    submit = SubmitField('Run Parameter Sweep')
+
+    def get_ranges(self):
+        """Sweep ranges in BotConfig units (thresholds as fractions, not percent)"""
+        return {
+            'arb_profit_threshold': (self.arb_threshold_min.data / 100.0,
+                                     self.arb_threshold_max.data / 100.0,
+                                     self.arb_threshold_steps.data),
+            'ml_confidence_threshold': (self.ml_confidence_min.data,
+                                        self.ml_confidence_max.data,
+                                        self.ml_confidence_steps.data),
+            'rebalance_frequency': (self.rebalance_min.data,
+                                    self.rebalance_max.data,
+                                    self.rebalance_steps.data)
+        }
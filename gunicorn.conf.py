@@ -0,0 +1,50 @@
+"""gunicorn settings for wsgi:app, overridable from the environment.
+
+GUNICORN_WORKER_CLASS picks the worker type:
+- gthread (default): threads per process. Each open /api/stream (SSE) or
+  long-polled /api/bot_status?wait= request holds one thread, not a process.
+- sync: one request per process. Use it only when no browser keeps a
+  stream open, otherwise the streams take every worker.
+- gevent: greenlets, for many concurrent streams. Needs gevent installed.
+  Patching happens here, before the app is preloaded, so the locks and
+  conditions the app creates at import are cooperative.
+
+The app is preloaded in the master (PRELOAD_APP=False disables this), so
+workers fork with it already imported. post_fork drops the database
+connections inherited from the master. SIGHUP starts new workers and stops
+the old ones gracefully, but with preload it does not re-import code. To
+deploy new code without downtime, send SIGUSR2 (starts a new master), then
+SIGTERM the old master once the new workers are up.
+"""
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+preload_app = os.environ.get('PRELOAD_APP', 'True') == 'True'
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# recycle workers now and then so per-worker caches and fragmentation stay bounded
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+if worker_class == 'gevent' and preload_app:
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def post_fork(server, worker):
+    """Forget the master's pooled connections; each worker opens its own"""
+    from app import app, db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
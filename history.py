@@ -0,0 +1,103 @@
+"""Keyset-paginated history queries.
+
+Pages are ordered newest first by (timestamp, id). The cursor is the
+position of the last row served, and the next page starts strictly after
+it, so every page is an index range scan. There is no OFFSET, which would
+make the database walk and discard every earlier row.
+"""
+import json
+import base64
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(timestamp, row_id):
+    payload = json.dumps([timestamp.isoformat(), row_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) from a cursor string; raises ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def keyset_page(query, model, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Fetch one page of query newest-first; returns (rows, next_cursor or None)"""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            model.timestamp < timestamp,
+            and_(model.timestamp == timestamp, model.id < row_id)
+        ))
+
+    rows = query.order_by(model.timestamp.desc(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return rows, next_cursor
+
+
+def trade_to_dict(trade):
+    return {
+        'id': trade.id,
+        'exchange': trade.exchange,
+        'symbol': trade.symbol,
+        'order_id': trade.order_id,
+        'side': trade.side,
+        'type': trade.type,
+        'quantity': trade.quantity,
+        'price': trade.price,
+        'cost': trade.cost,
+        'fee': trade.fee,
+        'status': trade.status,
+        'strategy': trade.strategy,
+        'profit_loss': trade.profit_loss,
+        'timestamp': trade.timestamp.isoformat() if trade.timestamp else None,
+    }
+
+
+def opportunity_to_dict(opp):
+    return {
+        'id': opp.id,
+        'symbol': opp.symbol,
+        'exchange_1': opp.exchange_1,
+        'exchange_2': opp.exchange_2,
+        'price_1': opp.price_1,
+        'price_2': opp.price_2,
+        'profit_percent': opp.profit_percent,
+        'executed': opp.executed,
+        'timestamp': opp.timestamp.isoformat() if opp.timestamp else None,
+    }
+
+
+def config_to_dict(config):
+    return {
+        'id': config.id,
+        'name': config.name,
+        'is_active': config.is_active,
+        'strategies': config.get_strategies(),
+        'pairs': config.get_pairs(),
+    }
+
+
+def news_to_dict(item):
+    return {
+        'id': item.id,
+        'title': item.title,
+        'source': item.source,
+        'url': item.url,
+        'sentiment_score': item.sentiment_score,
+        'related_assets': item.get_related_assets(),
+        'timestamp': item.timestamp.isoformat() if item.timestamp else None,
+    }
@@ -0,0 +1,344 @@
+"""Shared streaming technical indicators.
+
+Every indicator updates in O(1) per bar. EMA, RSI and ATR use recursive or
+Wilder smoothing. SMA and the Bollinger/standard-deviation windows use a ring
+buffer with running sums. Nothing is recomputed over the whole history per
+candle.
+
+IndicatorCache holds one instance per (symbol, timeframe, indicator, params).
+Every strategy and bot that asks for the same key gets the same object, and
+update() feeds a bar once to all indicators of that symbol and timeframe. The
+least recently used entries are evicted beyond capacity. With a candle store,
+a new bar-timeframe indicator is warmed from the latest stored candles.
+A timeframe of 'tick' treats every trade as a bar, for the live bots.
+
+    cache = get_indicator_cache()
+    cache.update('BTC/USDT', '1m', close, high, low, timestamp)
+    rsi = cache.value('BTC/USDT', '1m', 'rsi', period=14)
+"""
+import math
+import threading
+from collections import OrderedDict
+
+
+class Indicator:
+    """Base class: update(close, high, low) in O(1); value is None until ready"""
+
+    warmup = 1
+
+    def __init__(self):
+        self.count = 0
+        self.timestamp = None
+
+    @property
+    def ready(self):
+        return self.count >= self.warmup
+
+    @property
+    def value(self):
+        return self._value() if self.ready else None
+
+    def update(self, close, high, low):
+        raise NotImplementedError
+
+
+class EMA(Indicator):
+    def __init__(self, span):
+        super().__init__()
+        self.alpha = 2.0 / (span + 1)
+        self.warmup = span
+        self.current = None
+
+    def update(self, close, high, low):
+        self.count += 1
+        current = self.current
+        self.current = close if current is None else current + self.alpha * (close - current)
+
+    def _value(self):
+        return self.current
+
+
+class _Window(Indicator):
+    """Ring buffer of the last window closes with running sum and sum of squares"""
+
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+        self.warmup = window
+        self._ring = [0.0] * window
+        self._pos = 0
+        self._sum = 0.0
+        self._sumsq = 0.0
+
+    def update(self, close, high, low):
+        ring, pos = self._ring, self._pos
+        if self.count >= self.window:
+            old = ring[pos]
+            self._sum -= old
+            self._sumsq -= old * old
+        ring[pos] = close
+        self._sum += close
+        self._sumsq += close * close
+        self._pos = (pos + 1) % self.window
+        self.count += 1
+        if self._pos == 0:
+            # re-sum once per lap so the running sums cannot drift
+            self._sum = math.fsum(ring)
+            self._sumsq = math.fsum(x * x for x in ring)
+
+    def _mean(self):
+        return self._sum / self.window
+
+    def _std(self):
+        mean = self._sum / self.window
+        return math.sqrt(max(self._sumsq / self.window - mean * mean, 0.0))
+
+
+class SMA(_Window):
+    def _value(self):
+        return self._mean()
+
+
+class RollingStd(_Window):
+    def _value(self):
+        return self._std()
+
+
+class Bollinger(_Window):
+    """(middle, upper, lower) bands at k population standard deviations"""
+
+    def __init__(self, window=20, k=2.0):
+        super().__init__(window)
+        self.k = k
+
+    def _value(self):
+        mean, std = self._mean(), self._std()
+        return mean, mean + self.k * std, mean - self.k * std
+
+
+class RSI(Indicator):
+    """Wilder's RSI"""
+
+    def __init__(self, period=14):
+        super().__init__()
+        self.period = period
+        self.warmup = period + 1
+        self._prev = None
+        self._gain = 0.0
+        self._loss = 0.0
+
+    def update(self, close, high, low):
+        self.count += 1
+        prev, self._prev = self._prev, close
+        if prev is None:
+            return
+        change = close - prev
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        n = self.count - 1
+        if n <= self.period:
+            # simple average over the first period changes, then Wilder smoothing
+            self._gain += (gain - self._gain) / n
+            self._loss += (loss - self._loss) / n
+        else:
+            self._gain += (gain - self._gain) / self.period
+            self._loss += (loss - self._loss) / self.period
+
+    def _value(self):
+        if self._loss == 0.0:
+            return 100.0 if self._gain > 0.0 else 50.0
+        return 100.0 - 100.0 / (1.0 + self._gain / self._loss)
+
+
+class ATR(Indicator):
+    """Wilder's average true range"""
+
+    def __init__(self, period=14):
+        super().__init__()
+        self.period = period
+        self.warmup = period
+        self._prev_close = None
+        self._atr = 0.0
+
+    def update(self, close, high, low):
+        self.count += 1
+        prev, self._prev_close = self._prev_close, close
+        true_range = high - low if prev is None else max(high - low, abs(high - prev), abs(low - prev))
+        n = min(self.count, self.period)
+        self._atr += (true_range - self._atr) / n
+
+    def _value(self):
+        return self._atr
+
+
+class MACD(Indicator):
+    """(macd, signal, histogram)"""
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        super().__init__()
+        self._fast, self._slow, self._signal = EMA(fast), EMA(slow), EMA(signal)
+        self.warmup = slow + signal
+
+    def update(self, close, high, low):
+        self.count += 1
+        self._fast.update(close, high, low)
+        self._slow.update(close, high, low)
+        self._signal.update(self._fast.current - self._slow.current, 0.0, 0.0)
+
+    def _value(self):
+        macd = self._fast.current - self._slow.current
+        return macd, self._signal.current, macd - self._signal.current
+
+
+class ReturnStats(Indicator):
+    """Exponentially weighted (mean, variance) of simple returns"""
+
+    def __init__(self, span=30):
+        super().__init__()
+        self.span = span
+        self.alpha = 2.0 / (span + 1)
+        self.warmup = span
+        self._prev = None
+        self.mean = 0.0
+        self.var = 0.0
+
+    def update(self, close, high, low):
+        self.count += 1
+        prev, self._prev = self._prev, close
+        if not prev:
+            return
+        alpha = self.alpha
+        delta = close / prev - 1.0 - self.mean
+        self.mean += alpha * delta
+        self.var = (1.0 - alpha) * (self.var + alpha * delta * delta)
+
+    def _value(self):
+        return self.mean, self.var
+
+
+INDICATORS = {
+    'ema': EMA,
+    'sma': SMA,
+    'std': RollingStd,
+    'bollinger': Bollinger,
+    'rsi': RSI,
+    'atr': ATR,
+    'macd': MACD,
+    'return_stats': ReturnStats,
+}
+
+
+class IndicatorCache:
+    """LRU of shared indicator instances keyed by (symbol, timeframe, name, params)"""
+
+    def __init__(self, capacity=10000, store=None, exchange=None):
+        self.capacity = capacity
+        self.store = store
+        self.exchange = exchange
+        self._entries = OrderedDict()
+        self._by_series = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.updates = 0
+
+    def get(self, symbol, timeframe, name, **params):
+        key = (symbol, timeframe, name, tuple(sorted(params.items())))
+        with self._lock:
+            indicator = self._entries.get(key)
+            if indicator is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return indicator
+            self.misses += 1
+            indicator = INDICATORS[name](**params)
+            if timeframe != 'tick' and self.store is not None:
+                self._warm(indicator, symbol, timeframe)
+            self._entries[key] = indicator
+            self._by_series.setdefault((symbol, timeframe), {})[key] = indicator
+            while len(self._entries) > self.capacity:
+                self._evict()
+            return indicator
+
+    def value(self, symbol, timeframe, name, **params):
+        return self.get(symbol, timeframe, name, **params).value
+
+    def _warm(self, indicator, symbol, timeframe):
+        """Replay enough stored candles for the indicator to be ready (and settled)"""
+        from backtester import DEFAULT_EXCHANGE
+
+        candles = self.store.latest(self.exchange or DEFAULT_EXCHANGE, symbol, timeframe,
+                                    indicator.warmup * 3)
+        for close, high, low in zip(candles['close'].tolist(), candles['high'].tolist(),
+                                    candles['low'].tolist()):
+            indicator.update(close, high, low)
+        if len(candles['timestamp']):
+            indicator.timestamp = int(candles['timestamp'][-1])
+
+    def _evict(self):
+        key, _ = self._entries.popitem(last=False)
+        series = self._by_series.get(key[:2])
+        if series is not None:
+            series.pop(key, None)
+            if not series:
+                del self._by_series[key[:2]]
+        self.evictions += 1
+
+    def update(self, symbol, timeframe, close, high=None, low=None, timestamp=None):
+        """Feed one closed bar (or tick) to every cached indicator on that series.
+
+        With a timestamp, bars an indicator has already seen (e.g. from warm-up
+        or another producer) are skipped, so several feeds may call this safely.
+        """
+        series = self._by_series.get((symbol, timeframe))
+        if not series:
+            return 0
+        high = close if high is None else high
+        low = close if low is None else low
+        with self._lock:
+            self.updates += 1
+            for indicator in series.values():
+                if timestamp is not None:
+                    if indicator.timestamp is not None and timestamp <= indicator.timestamp:
+                        continue
+                    indicator.timestamp = timestamp
+                indicator.update(close, high, low)
+        return len(series)
+
+    def discard(self, symbol, timeframe=None):
+        """Drop every indicator of a symbol (optionally one timeframe)"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == symbol and timeframe in (None, k[1])]:
+                del self._entries[key]
+                series = self._by_series.get(key[:2])
+                if series is not None:
+                    series.pop(key, None)
+                    if not series:
+                        del self._by_series[key[:2]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def metrics(self):
+        return {
+            'size': len(self._entries),
+            'series': len(self._by_series),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'updates': self.updates,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_indicator_cache():
+    """Process-wide cache, warmed from the candle store"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            from ohlcv_store import get_store
+            _cache = IndicatorCache(store=get_store())
+        return _cache
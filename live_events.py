@@ -0,0 +1,262 @@
+"""Live dashboard events over server-sent events.
+
+EventBroker is an in-process pub/sub keyed by user id. Each open
+/api/stream connection subscribes with a bounded queue. If a client falls
+too far behind, its queue is cleared and it gets a single 'resync' event,
+so it cannot hold unbounded memory.
+
+LiveFeed is the producer. One background thread, running only while
+someone is subscribed, tails the database for the subscribed users:
+- new Trade and ArbitrageOpportunity rows past id high-water marks
+- BotConfig rows whose updated_at moved
+- portfolio value changes from the valuation engine
+That is a few indexed queries per interval for all users together, instead
+of every open dashboard re-running dashboard() on a full page reload. It
+also catches rows written by other processes (bot supervisor, ledger).
+poke() makes the next poll happen now, e.g. right after a route commits.
+The trade and opportunity rows found are also applied to the process-local
+dashboard read model (dashboard_cache).
+
+Waiting uses threading.Condition only, so a stream parks one worker thread
+(or one greenlet under gevent) and wakes immediately when an event is
+published.
+
+Events: trade, opportunity, bot_status, bot_deleted (published by the
+delete route), portfolio, resync.
+"""
+import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+POLL_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 15.0
+QUEUE_SIZE = 256
+
+
+class Subscription:
+    __slots__ = ('user_id', 'events', 'cond', 'closed')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.events = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def get(self, timeout=None):
+        """Every queued event as (id, name, data), waiting up to timeout for the first"""
+        with self.cond:
+            if not self.events and not self.closed:
+                self.cond.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+            return events
+
+
+class EventBroker:
+    """Per-user fan-out of (id, name, data) events to subscriber queues"""
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.published = 0
+        self.resyncs = 0
+        self.on_subscribe = None
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        if self.on_subscribe is not None:
+            self.on_subscribe()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+        with subscription.cond:
+            subscription.closed = True
+            subscription.cond.notify_all()
+
+    def users(self):
+        with self._lock:
+            return set(self._subscribers)
+
+    def publish(self, user_id, name, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+            self._next_id += 1
+            event = (self._next_id, name, data)
+        for subscription in subscribers:
+            with subscription.cond:
+                if len(subscription.events) >= self.queue_size:
+                    subscription.events.clear()
+                    subscription.events.append((event[0], 'resync', {}))
+                    self.resyncs += 1
+                else:
+                    subscription.events.append(event)
+                subscription.cond.notify()
+        self.published += 1
+        return len(subscribers)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'users': len(self._subscribers),
+                'connections': sum(len(s) for s in self._subscribers.values()),
+                'published': self.published,
+                'resyncs': self.resyncs,
+            }
+
+
+def format_event(event_id, name, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+def stream(broker, user_id, heartbeat=HEARTBEAT_INTERVAL):
+    """SSE body for one connection; unsubscribes when the client goes away"""
+    subscription = broker.subscribe(user_id)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            events = subscription.get(heartbeat)
+            if subscription.closed:
+                return
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            yield ''.join(format_event(*event) for event in events)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+class LiveFeed:
+    """Tails Trade, ArbitrageOpportunity, BotConfig and portfolio values for subscribed users"""
+
+    def __init__(self, app, broker=None, interval=POLL_INTERVAL):
+        self.app = app
+        self.broker = broker or EventBroker()
+        self.broker.on_subscribe = self.poke
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._hwm = None
+        self._configs_since = None
+        self._config_state = {}
+        self._portfolio_state = {}
+        self.polls = 0
+
+    def poke(self):
+        self._wake.set()
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-feed', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            users = self.broker.users()
+            if not users:
+                # nobody listening: forget positions so a new subscriber starts from now
+                self._hwm = None
+                self._portfolio_state.clear()
+                continue
+            try:
+                with self.app.app_context():
+                    self.poll(users)
+            except Exception:
+                logging.exception('Live feed poll failed')
+
+    def _max_ids(self):
+        from app import db
+        from models import Trade, ArbitrageOpportunity
+
+        return {model: db.session.query(func.max(model.id)).scalar() or 0
+                for model in (Trade, ArbitrageOpportunity)}
+
+    def poll(self, users):
+        """Publish everything that changed for users since the previous poll"""
+        from history import trade_to_dict, opportunity_to_dict, config_to_dict
+        from models import Trade, ArbitrageOpportunity, BotConfig
+        from portfolio_valuation import get_valuation_engine
+        from status_cache import get_status_cache
+        from dashboard_cache import get_dashboard_cache
+
+        self.polls += 1
+        cache = get_dashboard_cache()
+        user_ids = list(users)
+        tops = self._max_ids()
+        if self._hwm is None:
+            self._hwm = tops
+            self._configs_since = datetime.utcnow()
+        else:
+            for model, name, to_dict in ((Trade, 'trade', trade_to_dict),
+                                         (ArbitrageOpportunity, 'opportunity', opportunity_to_dict)):
+                if tops[model] <= self._hwm[model]:
+                    continue
+                rows = model.query.filter(model.id > self._hwm[model], model.id <= tops[model],
+                                          model.user_id.in_(user_ids)).order_by(model.id).all()
+                by_user = {}
+                for row in rows:
+                    data = to_dict(row)
+                    by_user.setdefault(row.user_id, []).append(data)
+                    self.broker.publish(row.user_id, name, data)
+                if not cache.shared:
+                    # rows from other processes reach this process's dashboard entries only here
+                    add = cache.add_trades if model is Trade else cache.add_opportunities
+                    for user_id, items in by_user.items():
+                        add(user_id, items)
+                self._hwm[model] = tops[model]
+
+            started = datetime.utcnow()
+            # small overlap so configs committed during the previous poll are not missed
+            configs = BotConfig.query.filter(BotConfig.user_id.in_(user_ids),
+                                             BotConfig.updated_at >= self._configs_since - timedelta(seconds=5))
+            for config in configs:
+                data = config_to_dict(config)
+                if self._config_state.get(config.id) != data:
+                    self._config_state[config.id] = data
+                    get_status_cache().bump(config.user_id)
+                    cache.invalidate(config.user_id)
+                    self.broker.publish(config.user_id, 'bot_status', data)
+            self._configs_since = started
+
+        engine = get_valuation_engine()
+        for user_id in user_ids:
+            summary = engine.summary(user_id)
+            key = (round(summary['total_value'], 2), round(summary['daily_change'], 2))
+            if self._portfolio_state.get(user_id) != key:
+                self._portfolio_state[user_id] = key
+                self.broker.publish(user_id, 'portfolio', summary)
+
+    def metrics(self):
+        return dict(self.broker.metrics(), polls=self.polls)
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def get_live_feed():
+    global _feed
+    with _feed_lock:
+        if _feed is None:
+            from app import app
+            _feed = LiveFeed(app)
+        return _feed
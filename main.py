@@ -1,6 +1,7 @@
 import logging
 import os
 from app import app
+from migrations import upgrade
 from keep_alive import start_keep_alive_server
 from url_helper import print_access_instructions
 
@@ -14,5 +15,9 @@ if __name__ == "__main__":
     # Start the keep-alive server to prevent Replit from sleeping
     keep_alive_thread = start_keep_alive_server()
     
+    # The development server brings the schema up to date itself; production runs it as a release step
+    with app.app_context():
+        upgrade()
+    
     # Start the main application
     app.run(host="0.0.0.0", port=5000, debug=True)
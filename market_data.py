@@ -0,0 +1,849 @@
+"""Asyncio multi-exchange market data ingestion.
+
+One websocket connection per exchange streams trades and order book deltas.
+Exchange adapters translate each venue's wire format into two compact records,
+TradeEvent and BookEvent, which MarketDataHub fans out to in-process
+subscribers through bounded queues. A subscriber chooses its backpressure
+policy: 'block' makes the connection reader wait for it (and lets TCP push
+back on the exchange), 'drop_oldest' keeps the freshest data and counts what
+it sheds, and 'conflate' merges the book diffs a slow consumer has not read yet
+into one pending update per symbol. Connections are re-established with exponential backoff and
+resubscribed, and a StatusEvent marks every connect/disconnect so book
+consumers know to resynchronise. When the wanted symbols change, only the
+difference is subscribed or unsubscribed on the live connections.
+
+Binance and KuCoin stream depth only as diffs. For those, DepthSync holds a
+symbol's diffs back until its REST depth snapshot arrives. It publishes the
+snapshot, then the buffered diffs by update id, and takes a fresh snapshot
+whenever the update ids skip.
+
+Run as a daemon for the pairs of all active bot configurations:
+
+    python market_data.py
+"""
+import json
+import gzip
+import random
+import asyncio
+import logging
+import itertools
+import urllib.request
+from collections import deque, namedtuple
+from datetime import datetime
+
+import websockets
+
+from exchanges import EXCHANGES
+
+# Normalized records. Prices/amounts are floats, timestamps are epoch milliseconds,
+# book levels are tuples of (price, amount) with amount 0 meaning "remove level".
+TradeEvent = namedtuple('TradeEvent', 'exchange symbol timestamp price amount side')
+# first_sequence is the first update id a diff covers, for feeds that number updates in ranges.
+# raw is (bid texts, ask texts), the exchange's (price, amount) strings parallel to bids and asks,
+# kept for feeds whose checksum is computed over those strings.
+BookEvent = namedtuple('BookEvent', 'exchange symbol timestamp sequence bids asks snapshot checksum '
+                                    'first_sequence raw', defaults=(None, None))
+StatusEvent = namedtuple('StatusEvent', 'exchange status')
+
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+SNAPSHOT_TIMEOUT = 10
+# diffs held per symbol while its snapshot is fetched; older ones are dropped (a gap then resyncs)
+DEPTH_BUFFER_LIMIT = 10000
+
+
+def _levels(rows):
+    return tuple((float(row[0]), float(row[1])) for row in rows)
+
+
+def _texts(rows):
+    return tuple((str(row[0]), str(row[1])) for row in rows)
+
+
+def _iso_ms(value):
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+
+
+class ExchangeAdapter:
+    """Wire format of one exchange: where to connect, what to subscribe, how to parse"""
+
+    name = None
+    url = None
+    # REST depth snapshot for feeds that only stream diffs, formatted with market=
+    snapshot_url = None
+
+    def __init__(self, symbols, url=None):
+        if url:
+            self.url = url
+        self.set_symbols(symbols)
+
+    def set_symbols(self, symbols):
+        """Replace the subscribed symbols; messages for other symbols are ignored from now on"""
+        self.symbols = list(symbols)
+        self._unified = {self.market_id(s): s for s in self.symbols}
+
+    def market_id(self, symbol):
+        return symbol.replace('/', '')
+
+    def unified(self, market_id):
+        return self._unified.get(market_id)
+
+    async def connect_url(self):
+        return self.url
+
+    def subscribe_messages(self, symbols=None):
+        """Messages subscribing symbols (default: all of self.symbols) on a connection"""
+        return []
+
+    def unsubscribe_messages(self, symbols):
+        """Messages dropping symbols from a live connection, or None if the venue needs a reconnect"""
+        return None
+
+    def decode(self, raw):
+        return json.loads(raw)
+
+    def reply(self, message):
+        """Message to send back for keepalive pings embedded in the data stream"""
+        return None
+
+    def parse(self, message):
+        return []
+
+    def rest_market_id(self, symbol):
+        return self.market_id(symbol)
+
+    def fetch_snapshot(self, symbol):
+        """Blocking REST depth snapshot as a BookEvent; run it in an executor"""
+        url = self.snapshot_url.format(market=self.rest_market_id(symbol))
+        with urllib.request.urlopen(url, timeout=SNAPSHOT_TIMEOUT) as response:
+            return self.parse_snapshot(symbol, json.loads(response.read()))
+
+    def parse_snapshot(self, symbol, body):
+        raise NotImplementedError
+
+
+class LocalAdapter(ExchangeAdapter):
+    """Already-normalized JSON, for relays, replays and the local fake exchange"""
+
+    name = 'local'
+    url = 'ws://127.0.0.1:8765'
+
+    def market_id(self, symbol):
+        return symbol
+
+    def subscribe_messages(self, symbols=None):
+        return [{'op': 'subscribe', 'symbols': list(self.symbols if symbols is None else symbols)}]
+
+    def unsubscribe_messages(self, symbols):
+        return [{'op': 'unsubscribe', 'symbols': list(symbols)}]
+
+    def parse(self, message):
+        exchange = message.get('exchange', self.name)
+        if message.get('type') == 'trade':
+            return [TradeEvent(exchange, message['symbol'], int(message['timestamp']),
+                               float(message['price']), float(message['amount']), message['side'])]
+        if message.get('type') == 'book':
+            return [BookEvent(exchange, message['symbol'], int(message['timestamp']),
+                              message.get('sequence'), _levels(message.get('bids', ())),
+                              _levels(message.get('asks', ())), bool(message.get('snapshot')),
+                              message.get('checksum'))]
+        return []
+
+
+class BinanceAdapter(ExchangeAdapter):
+    name = 'binance'
+    url = 'wss://stream.binance.com:9443/stream'
+    snapshot_url = 'https://api.binance.com/api/v3/depth?symbol={market}&limit=1000'
+
+    def market_id(self, symbol):
+        return symbol.replace('/', '').lower()
+
+    def rest_market_id(self, symbol):
+        return symbol.replace('/', '').upper()
+
+    def parse_snapshot(self, symbol, body):
+        return BookEvent(self.name, symbol, None, body['lastUpdateId'], _levels(body['bids']),
+                         _levels(body['asks']), True, None)
+
+    def _streams(self, symbols):
+        return [stream for m in map(self.market_id, symbols) for stream in (f'{m}@trade', f'{m}@depth@100ms')]
+
+    async def connect_url(self):
+        return f"{self.url}?streams={'/'.join(self._streams(self.symbols))}"
+
+    def subscribe_messages(self, symbols=None):
+        # the connection URL already names the streams of self.symbols
+        if symbols is None:
+            return []
+        return [{'method': 'SUBSCRIBE', 'params': self._streams(symbols), 'id': 1}]
+
+    def unsubscribe_messages(self, symbols):
+        return [{'method': 'UNSUBSCRIBE', 'params': self._streams(symbols), 'id': 2}]
+
+    def parse(self, message):
+        data = message.get('data', message)
+        symbol = self.unified(str(data.get('s', '')).lower())
+        if symbol is None:
+            return []
+        if data.get('e') == 'trade':
+            return [TradeEvent(self.name, symbol, data['T'], float(data['p']), float(data['q']),
+                               'sell' if data['m'] else 'buy')]
+        if data.get('e') == 'depthUpdate':
+            return [BookEvent(self.name, symbol, data['E'], data['u'], _levels(data['b']),
+                              _levels(data['a']), False, None, data['U'])]
+        return []
+
+
+class CoinbaseAdapter(ExchangeAdapter):
+    name = 'coinbase'
+    url = 'wss://ws-feed.exchange.coinbase.com'
+
+    def market_id(self, symbol):
+        return symbol.replace('/', '-')
+
+    def _messages(self, kind, symbols):
+        return [{'type': kind, 'product_ids': [self.market_id(s) for s in symbols],
+                 'channels': ['matches', 'level2_batch']}]
+
+    def subscribe_messages(self, symbols=None):
+        return self._messages('subscribe', self.symbols if symbols is None else symbols)
+
+    def unsubscribe_messages(self, symbols):
+        return self._messages('unsubscribe', symbols)
+
+    def parse(self, message):
+        symbol = self.unified(message.get('product_id'))
+        if symbol is None:
+            return []
+        kind = message.get('type')
+        if kind in ('match', 'last_match'):
+            # the maker side is reported; the aggressor is the opposite
+            side = 'sell' if message['side'] == 'buy' else 'buy'
+            return [TradeEvent(self.name, symbol, _iso_ms(message['time']), float(message['price']),
+                               float(message['size']), side)]
+        if kind == 'snapshot':
+            return [BookEvent(self.name, symbol, None, None, _levels(message['bids']),
+                              _levels(message['asks']), True, None)]
+        if kind == 'l2update':
+            bids = tuple((float(p), float(s)) for side, p, s in message['changes'] if side == 'buy')
+            asks = tuple((float(p), float(s)) for side, p, s in message['changes'] if side == 'sell')
+            return [BookEvent(self.name, symbol, _iso_ms(message['time']), None, bids, asks,
+                              False, None)]
+        return []
+
+
+class KrakenAdapter(ExchangeAdapter):
+    name = 'kraken'
+    url = 'wss://ws.kraken.com'
+
+    def market_id(self, symbol):
+        return symbol.replace('BTC', 'XBT')
+
+    def _messages(self, event, symbols):
+        pairs = [self.market_id(s) for s in symbols]
+        return [{'event': event, 'pair': pairs, 'subscription': {'name': 'trade'}},
+                {'event': event, 'pair': pairs, 'subscription': {'name': 'book', 'depth': 25}}]
+
+    def subscribe_messages(self, symbols=None):
+        return self._messages('subscribe', self.symbols if symbols is None else symbols)
+
+    def unsubscribe_messages(self, symbols):
+        return self._messages('unsubscribe', symbols)
+
+    def parse(self, message):
+        if not isinstance(message, list) or len(message) < 4:
+            return []
+        symbol = self.unified(message[-1])
+        channel = message[-2]
+        if symbol is None:
+            return []
+        if channel == 'trade':
+            return [TradeEvent(self.name, symbol, int(float(t[2]) * 1000), float(t[0]), float(t[1]),
+                               'buy' if t[3] == 'b' else 'sell') for t in message[1]]
+        if channel.startswith('book'):
+            events = []
+            for payload in message[1:-2]:
+                snapshot = 'as' in payload or 'bs' in payload
+                bids = _levels(payload.get('bs', payload.get('b', ())))
+                asks = _levels(payload.get('as', payload.get('a', ())))
+                events.append(BookEvent(self.name, symbol, None, None, bids, asks, snapshot,
+                                        payload.get('c')))
+            return events
+        return []
+
+
+class HuobiAdapter(ExchangeAdapter):
+    name = 'huobi'
+    url = 'wss://api.huobi.pro/ws'
+
+    def market_id(self, symbol):
+        return symbol.replace('/', '').lower()
+
+    def _messages(self, op, symbols):
+        messages = []
+        for market in map(self.market_id, symbols):
+            messages.append({op: f'market.{market}.trade.detail', 'id': f't-{market}'})
+            messages.append({op: f'market.{market}.depth.step0', 'id': f'd-{market}'})
+        return messages
+
+    def subscribe_messages(self, symbols=None):
+        return self._messages('sub', self.symbols if symbols is None else symbols)
+
+    def unsubscribe_messages(self, symbols):
+        return self._messages('unsub', symbols)
+
+    def decode(self, raw):
+        if isinstance(raw, bytes):
+            raw = gzip.decompress(raw)
+        return json.loads(raw)
+
+    def reply(self, message):
+        if 'ping' in message:
+            return {'pong': message['ping']}
+        return None
+
+    def parse(self, message):
+        channel = message.get('ch', '')
+        parts = channel.split('.')
+        if len(parts) < 3:
+            return []
+        symbol = self.unified(parts[1])
+        tick = message.get('tick', {})
+        if symbol is None:
+            return []
+        if parts[2] == 'trade':
+            return [TradeEvent(self.name, symbol, t['ts'], float(t['price']), float(t['amount']),
+                               t['direction']) for t in tick.get('data', ())]
+        if parts[2] == 'depth':
+            # step0 depth pushes are full top-of-book snapshots
+            return [BookEvent(self.name, symbol, message.get('ts'), tick.get('version'),
+                              _levels(tick.get('bids', ())), _levels(tick.get('asks', ())), True, None)]
+        return []
+
+
+class OKXAdapter(ExchangeAdapter):
+    name = 'okx'
+    url = 'wss://ws.okx.com:8443/ws/v5/public'
+
+    def market_id(self, symbol):
+        return symbol.replace('/', '-')
+
+    def _messages(self, op, symbols):
+        args = []
+        for market in map(self.market_id, symbols):
+            args.append({'channel': 'trades', 'instId': market})
+            args.append({'channel': 'books', 'instId': market})
+        return [{'op': op, 'args': args}]
+
+    def subscribe_messages(self, symbols=None):
+        return self._messages('subscribe', self.symbols if symbols is None else symbols)
+
+    def unsubscribe_messages(self, symbols):
+        return self._messages('unsubscribe', symbols)
+
+    def parse(self, message):
+        arg = message.get('arg', {})
+        symbol = self.unified(arg.get('instId'))
+        if symbol is None or 'data' not in message:
+            return []
+        if arg.get('channel') == 'trades':
+            return [TradeEvent(self.name, symbol, int(t['ts']), float(t['px']), float(t['sz']),
+                               t['side']) for t in message['data']]
+        if arg.get('channel') == 'books':
+            snapshot = message.get('action') == 'snapshot'
+            return [BookEvent(self.name, symbol, int(d['ts']), d.get('seqId'), _levels(d['bids']),
+                              _levels(d['asks']), snapshot, d.get('checksum'),
+                              raw=(_texts(d['bids']), _texts(d['asks'])))
+                    for d in message['data']]
+        return []
+
+
+class KuCoinAdapter(ExchangeAdapter):
+    name = 'kucoin'
+    url = None
+    token_url = 'https://api.kucoin.com/api/v1/bullet-public'
+    snapshot_url = 'https://api.kucoin.com/api/v1/market/orderbook/level2_100?symbol={market}'
+
+    def market_id(self, symbol):
+        return symbol.replace('/', '-')
+
+    async def connect_url(self):
+        if self.url:
+            return self.url
+        # KuCoin hands out a per-connection endpoint and token over REST
+        loop = asyncio.get_running_loop()
+        request = urllib.request.Request(self.token_url, method='POST')
+        body = await loop.run_in_executor(None, lambda: urllib.request.urlopen(request, timeout=10).read())
+        data = json.loads(body)['data']
+        return f"{data['instanceServers'][0]['endpoint']}?token={data['token']}"
+
+    def _messages(self, kind, symbols):
+        markets = ','.join(self.market_id(s) for s in symbols)
+        return [{'id': 1, 'type': kind, 'topic': f'/market/match:{markets}', 'response': True},
+                {'id': 2, 'type': kind, 'topic': f'/market/level2:{markets}', 'response': True}]
+
+    def subscribe_messages(self, symbols=None):
+        return self._messages('subscribe', self.symbols if symbols is None else symbols)
+
+    def unsubscribe_messages(self, symbols):
+        return self._messages('unsubscribe', symbols)
+
+    def parse_snapshot(self, symbol, body):
+        data = body['data']
+        return BookEvent(self.name, symbol, data.get('time'), int(data['sequence']), _levels(data['bids']),
+                         _levels(data['asks']), True, None)
+
+    def parse(self, message):
+        if message.get('type') != 'message':
+            return []
+        data = message.get('data', {})
+        symbol = self.unified(data.get('symbol'))
+        if symbol is None:
+            return []
+        if message.get('subject') == 'trade.l3match':
+            return [TradeEvent(self.name, symbol, int(data['time']) // 1_000_000, float(data['price']),
+                               float(data['size']), data['side'])]
+        if message.get('subject') == 'trade.l2update':
+            changes = data.get('changes', {})
+            return [BookEvent(self.name, symbol, data.get('time'), int(data['sequenceEnd']),
+                              _levels(changes.get('bids', ())), _levels(changes.get('asks', ())),
+                              False, None, int(data['sequenceStart']))]
+        return []
+
+
+ADAPTERS = {
+    'local': LocalAdapter,
+    'binance': BinanceAdapter,
+    'coinbase': CoinbaseAdapter,
+    'kraken': KrakenAdapter,
+    'huobi': HuobiAdapter,
+    'okx': OKXAdapter,
+    'kucoin': KuCoinAdapter,
+}
+
+
+class Subscription:
+    """A bounded queue of events for one consumer"""
+
+    def __init__(self, symbols=None, kinds=None, maxsize=10000, policy='block'):
+        if policy not in ('block', 'drop_oldest'):
+            raise ValueError(f'Unknown backpressure policy: {policy}')
+        self.symbols = set(symbols) if symbols else None
+        self.kinds = tuple(kinds) if kinds else None
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def wants(self, event):
+        if self.kinds is not None and not isinstance(event, self.kinds):
+            return False
+        if self.symbols is not None and not isinstance(event, StatusEvent):
+            return event.symbol in self.symbols
+        return True
+
+    async def put(self, event):
+        if self.policy == 'block':
+            await self.queue.put(event)
+            return
+        while self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+
+def _merge_levels(older, older_texts, newer, newer_texts):
+    merged = {}
+    for levels, texts in ((older, older_texts), (newer, newer_texts)):
+        for i, (price, amount) in enumerate(levels):
+            merged[price] = (amount, texts[i] if texts is not None else None)
+    return merged
+
+
+def merge_book_events(pending, event):
+    """One BookEvent leaving a book as applying pending and then event would"""
+    if event.snapshot:
+        return event
+    raws = (pending.raw or (None, None), event.raw or (None, None))
+    bids = _merge_levels(pending.bids, raws[0][0], event.bids, raws[1][0])
+    asks = _merge_levels(pending.asks, raws[0][1], event.asks, raws[1][1])
+    raw = None
+    if pending.raw is not None and event.raw is not None:
+        raw = ([text for _, text in bids.values()], [text for _, text in asks.values()])
+    return pending._replace(timestamp=event.timestamp, sequence=event.sequence, checksum=event.checksum,
+                            bids=[(price, amount) for price, (amount, _) in bids.items()],
+                            asks=[(price, amount) for price, (amount, _) in asks.items()], raw=raw)
+
+
+class ConflatingSubscription(Subscription):
+    """Events for one consumer, with at most one pending BookEvent per (exchange, symbol).
+
+    A diff arriving while the symbol's previous update is still unread is merged
+    into it, so the feed never waits and the consumer still ends up with exact
+    books. Other events queue in order. A StatusEvent closes its exchange's
+    pending updates to merging, so later diffs are delivered after it. Past
+    maxsize pending entries the oldest is dropped, as with 'drop_oldest'.
+    """
+
+    def __init__(self, symbols=None, kinds=None, maxsize=10000):
+        self.symbols = set(symbols) if symbols else None
+        self.kinds = tuple(kinds) if kinds else None
+        self.policy = 'conflate'
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.conflated = 0
+        self._entries = deque()
+        self._open = {}
+        self._ready = asyncio.Event()
+
+    async def put(self, event):
+        if isinstance(event, BookEvent):
+            key = (event.exchange, event.symbol)
+            entry = self._open.get(key)
+            if entry is not None:
+                entry[1] = merge_book_events(entry[1], event)
+                self.conflated += 1
+                return
+            entry = self._open[key] = [key, event]
+        else:
+            entry = [None, event]
+            if isinstance(event, StatusEvent):
+                for key in [key for key in self._open if key[0] == event.exchange]:
+                    del self._open[key]
+        self._entries.append(entry)
+        if len(self._entries) > self.maxsize:
+            self._close(self._entries.popleft())
+            self.dropped += 1
+        self._ready.set()
+
+    def _close(self, entry):
+        if entry[0] is not None and self._open.get(entry[0]) is entry:
+            del self._open[entry[0]]
+
+    async def get(self):
+        while not self._entries:
+            self._ready.clear()
+            await self._ready.wait()
+        entry = self._entries.popleft()
+        self._close(entry)
+        return entry[1]
+
+    async def __anext__(self):
+        return await self.get()
+
+
+class MarketDataHub:
+    """In-process fan-out of normalized events to subscribers"""
+
+    def __init__(self):
+        self._subscriptions = []
+        self.published = 0
+
+    def subscribe(self, symbols=None, kinds=None, maxsize=10000, policy='block'):
+        if policy == 'conflate':
+            subscription = ConflatingSubscription(symbols, kinds, maxsize)
+        else:
+            subscription = Subscription(symbols, kinds, maxsize, policy)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    async def publish(self, event):
+        self.published += 1
+        for subscription in self._subscriptions:
+            if subscription.wants(event):
+                await subscription.put(event)
+
+
+class _DepthState:
+    __slots__ = ('last', 'buffer', 'syncing')
+
+    def __init__(self):
+        self.last = None
+        self.buffer = []
+        self.syncing = True
+
+
+class DepthSync:
+    """Snapshot-then-diffs ordering for one connection of a diff-only depth feed.
+
+    A symbol's diffs are buffered until its REST snapshot is published. Then
+    diffs the snapshot already covers (sequence <= its update id) are dropped
+    and the rest follow in order. The first diff applied must straddle the
+    snapshot's update id, and each later diff must start right after the
+    previous one ends; otherwise updates were lost, and the symbol is
+    buffered again while a new snapshot is fetched.
+    """
+
+    def __init__(self, adapter, publish, retry_delay=RECONNECT_MIN_DELAY):
+        self.adapter = adapter
+        self.publish = publish
+        self.retry_delay = retry_delay
+        self._states = {}
+        self._tasks = set()
+        self.snapshots = 0
+        self.resyncs = 0
+
+    async def on_event(self, event):
+        state = self._states.get(event.symbol)
+        if state is None:
+            state = self._states[event.symbol] = _DepthState()
+            self._resync(event.symbol)
+        if state.syncing:
+            if len(state.buffer) >= DEPTH_BUFFER_LIMIT:
+                del state.buffer[0]
+            state.buffer.append(event)
+        elif not await self._apply(state, event):
+            state.syncing = True
+            state.buffer = [event]
+            self._resync(event.symbol)
+
+    async def _apply(self, state, event):
+        """Publish a diff that continues the book; False if updates were lost before it"""
+        if event.sequence <= state.last:
+            return True
+        first = event.first_sequence if event.first_sequence is not None else event.sequence
+        if first > state.last + 1:
+            logging.warning(f'{self.adapter.name} {event.symbol} depth gap after {state.last}; resyncing')
+            self.resyncs += 1
+            return False
+        state.last = event.sequence
+        await self.publish(event)
+        return True
+
+    def _resync(self, symbol):
+        task = asyncio.get_running_loop().create_task(self._snapshot(symbol))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _snapshot(self, symbol):
+        loop = asyncio.get_running_loop()
+        delay = self.retry_delay
+        while True:
+            try:
+                snapshot = await loop.run_in_executor(None, self.adapter.fetch_snapshot, symbol)
+                break
+            except Exception as e:
+                logging.warning(f'{self.adapter.name} depth snapshot for {symbol} failed: {e}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+        state = self._states.get(symbol)
+        if state is None:
+            # the symbol was unsubscribed while its snapshot was fetched
+            return
+        self.snapshots += 1
+        await self.publish(snapshot)
+        state.last = snapshot.sequence
+        # diffs received while publishing join the buffer, so drain until it stays empty
+        while state.buffer:
+            buffered, state.buffer = state.buffer, []
+            for i, event in enumerate(buffered):
+                if not await self._apply(state, event):
+                    state.buffer = buffered[i:] + state.buffer
+                    self._resync(symbol)
+                    return
+        state.syncing = False
+
+    def forget(self, symbol):
+        """Stop tracking an unsubscribed symbol; it starts from a new snapshot if it returns"""
+        self._states.pop(symbol, None)
+
+    def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+
+class IngestionService:
+    """Keeps one websocket per exchange alive and publishes its events to the hub.
+
+    update_symbols() changes the subscribed symbols on the live connections,
+    sending subscribe/unsubscribe messages for the difference only. An
+    exchange that gains its first symbol gets a new connection, and one that
+    loses its last symbol is closed.
+    """
+
+    def __init__(self, symbols_by_exchange, hub=None, url_overrides=None):
+        self.hub = hub or MarketDataHub()
+        self.url_overrides = url_overrides or {}
+        self.adapters = [ADAPTERS[exchange](symbols, url=self.url_overrides.get(exchange))
+                         for exchange, symbols in symbols_by_exchange.items() if symbols]
+        self.reconnects = {adapter.name: 0 for adapter in self.adapters}
+        self.resubscribes = 0
+        # adapter name -> task, live websocket, DepthSync of the current connection
+        self._tasks = {}
+        self._sockets = {}
+        self._depth = {}
+        self._running = False
+
+    async def _stream(self, adapter):
+        url = await adapter.connect_url()
+        async with websockets.connect(url, ping_interval=20, ping_timeout=20,
+                                      max_size=2 ** 22) as ws:
+            for message in adapter.subscribe_messages():
+                await ws.send(json.dumps(message))
+            logging.info(f'Market data connected: {adapter.name} ({len(adapter.symbols)} symbols)')
+            await self.hub.publish(StatusEvent(adapter.name, 'connected'))
+
+            # diff-only depth feeds start from a REST snapshot on every connection
+            depth = DepthSync(adapter, self.hub.publish) if adapter.snapshot_url else None
+            self._sockets[adapter.name] = ws
+            if depth is not None:
+                self._depth[adapter.name] = depth
+            try:
+                async for raw in ws:
+                    message = adapter.decode(raw)
+                    reply = adapter.reply(message) if isinstance(message, dict) else None
+                    if reply is not None:
+                        await ws.send(json.dumps(reply))
+                        continue
+                    for event in adapter.parse(message):
+                        if depth is not None and isinstance(event, BookEvent):
+                            await depth.on_event(event)
+                        else:
+                            await self.hub.publish(event)
+            finally:
+                self._sockets.pop(adapter.name, None)
+                self._depth.pop(adapter.name, None)
+                if depth is not None:
+                    depth.close()
+
+    async def _run_adapter(self, adapter):
+        delay = RECONNECT_MIN_DELAY
+        while self._running:
+            try:
+                await self._stream(adapter)
+                delay = RECONNECT_MIN_DELAY
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f'Market data connection to {adapter.name} failed: {e}')
+            if not self._running:
+                break
+            await self.hub.publish(StatusEvent(adapter.name, 'disconnected'))
+            self.reconnects[adapter.name] += 1
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _start_adapter(self, adapter):
+        self._tasks[adapter.name] = asyncio.create_task(self._run_adapter(adapter),
+                                                        name=f'ingest-{adapter.name}')
+
+    def start(self):
+        """Start one connection task per exchange on the running loop"""
+        self._running = True
+        for adapter in self.adapters:
+            self._start_adapter(adapter)
+        return list(self._tasks.values())
+
+    async def stop(self):
+        self._running = False
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = {}
+
+    async def run(self):
+        self.start()
+        try:
+            await asyncio.gather(*self._tasks.values())
+        finally:
+            await self.stop()
+
+    async def update_symbols(self, symbols_by_exchange):
+        """Subscribe to the symbols added and unsubscribe the ones removed, per exchange"""
+        wanted = {exchange: list(symbols) for exchange, symbols in symbols_by_exchange.items() if symbols}
+        for adapter in list(self.adapters):
+            symbols = wanted.pop(adapter.name, None)
+            if symbols:
+                await self._resubscribe(adapter, symbols)
+            else:
+                await self._remove_adapter(adapter)
+        for exchange, symbols in wanted.items():
+            adapter = ADAPTERS[exchange](symbols, url=self.url_overrides.get(exchange))
+            self.adapters.append(adapter)
+            self.reconnects.setdefault(adapter.name, 0)
+            if self._running:
+                self._start_adapter(adapter)
+
+    async def _resubscribe(self, adapter, symbols):
+        target, current = set(symbols), set(adapter.symbols)
+        added = [s for s in symbols if s not in current]
+        removed = [s for s in adapter.symbols if s not in target]
+        if not added and not removed:
+            return
+        self.resubscribes += 1
+        ws = self._sockets.get(adapter.name)
+        unsubscribe = adapter.unsubscribe_messages(removed) if removed else []
+        adapter.set_symbols(symbols)
+        if ws is not None:
+            try:
+                if unsubscribe is None:
+                    # no unsubscribe on this venue: reconnect it alone with the new set
+                    await ws.close()
+                else:
+                    for message in unsubscribe + (adapter.subscribe_messages(added) if added else []):
+                        await ws.send(json.dumps(message))
+            except Exception as e:
+                # the reconnect subscribes the full new set
+                logging.warning(f'Market data resubscribe on {adapter.name} failed: {e}')
+        # otherwise the next connection subscribes the new set
+        depth = self._depth.get(adapter.name)
+        for symbol in removed:
+            if depth is not None:
+                depth.forget(symbol)
+            # an empty snapshot withdraws the symbol's book from book consumers
+            await self.hub.publish(BookEvent(adapter.name, symbol, None, None, (), (), True, None))
+        logging.info(f'Market data {adapter.name}: +{len(added)} -{len(removed)} symbols')
+
+    async def _remove_adapter(self, adapter):
+        self.adapters.remove(adapter)
+        task = self._tasks.pop(adapter.name, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await self.hub.publish(StatusEvent(adapter.name, 'disconnected'))
+
+
+async def serve_fake_exchange(messages, host='127.0.0.1', port=8765, interval=0.0, repeat=False):
+    """Local websocket server that streams canned LocalAdapter messages after a subscribe.
+
+    Returns the running server; close it with server.close(). Useful for exercising
+    the ingestion path, reconnects and backpressure without touching an exchange.
+    """
+    async def handler(ws):
+        await ws.recv()
+        source = itertools.cycle(messages) if repeat else messages
+        for message in source:
+            await ws.send(json.dumps(message))
+            if interval:
+                await asyncio.sleep(interval)
+
+    return await websockets.serve(handler, host, port)
+
+
+def symbols_from_configs():
+    """Unified pairs traded by all active bot configurations, subscribed on every exchange"""
+    from app import app
+    from models import BotConfig
+
+    with app.app_context():
+        pairs = BotConfig.active_pairs()
+    return {exchange: pairs for exchange in EXCHANGES}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(IngestionService(symbols_from_configs()).run())
@@ -0,0 +1,118 @@
+"""Idempotent schema upgrades.
+
+db.create_all() only creates missing tables, so columns and indexes added to
+existing models never reach databases created before them. upgrade() creates
+missing tables, then adds any missing nullable column and any missing index,
+and is safe to run on every deploy. It is not run on import of the app; run
+`python migrations.py` or `flask --app app upgrade-db`.
+"""
+import logging
+
+from sqlalchemy import inspect, text
+
+from app import db
+
+
+def create_missing_columns():
+    """ALTER TABLE ADD COLUMN for nullable model columns absent from the database"""
+    inspector = inspect(db.engine)
+    quote = db.engine.dialect.identifier_preparer.quote
+    added = []
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                connection.execute(text(f'ALTER TABLE {quote(table.name)} '
+                                        f'ADD COLUMN {quote(column.name)} {column_type}'))
+                added.append(f'{table.name}.{column.name}')
+    if added:
+        logging.info(f"Added columns: {', '.join(added)}")
+    return added
+
+
+def create_missing_indexes():
+    """Create indexes declared on the models but absent from the database"""
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+    if created:
+        logging.info(f"Created indexes: {', '.join(created)}")
+    return created
+
+
+def backfill_associations(batch_size=1000):
+    """Write pair/strategy/asset rows for rows stored before the association tables existed"""
+    from models import BotConfig, PortfolioSnapshot, NewsItem
+
+    targets = (
+        (BotConfig, BotConfig.pair_rows, BotConfig.pairs, ('[]',)),
+        (PortfolioSnapshot, PortfolioSnapshot.asset_rows, PortfolioSnapshot.assets, ('{}',)),
+        (NewsItem, NewsItem.asset_rows, NewsItem.related_assets, ('[]',)),
+    )
+    filled = {}
+    for model, rows, column, empty in targets:
+        last_id = 0
+        count = 0
+        while True:
+            batch = model.query.filter(model.id > last_id, ~rows.any(), column.isnot(None),
+                                       column != '', column.notin_(empty)) \
+                .order_by(model.id).limit(batch_size).all()
+            if not batch:
+                break
+            for obj in batch:
+                obj._sync_rows()
+            db.session.commit()
+            last_id = batch[-1].id
+            count += len(batch)
+        if count:
+            filled[model.__tablename__] = count
+    if filled:
+        logging.info(f'Backfilled association rows: {filled}')
+    return filled
+
+
+def prune_orphan_associations():
+    """Delete pair/strategy/asset rows whose parent is gone (left by deletes SQLite did not cascade)"""
+    from models import (BotConfig, BotConfigPair, BotConfigStrategy, PortfolioSnapshot,
+                        PortfolioSnapshotAsset, NewsItem, NewsItemAsset)
+
+    targets = (
+        (BotConfigPair, BotConfigPair.config_id, BotConfig),
+        (BotConfigStrategy, BotConfigStrategy.config_id, BotConfig),
+        (PortfolioSnapshotAsset, PortfolioSnapshotAsset.snapshot_id, PortfolioSnapshot),
+        (NewsItemAsset, NewsItemAsset.news_item_id, NewsItem),
+    )
+    pruned = {}
+    for model, column, parent in targets:
+        count = model.query.filter(column.notin_(db.select(parent.id))).delete(synchronize_session=False)
+        if count:
+            pruned[model.__tablename__] = count
+    db.session.commit()
+    if pruned:
+        logging.info(f'Pruned orphaned association rows: {pruned}')
+    return pruned
+
+
+def upgrade():
+    db.create_all()
+    create_missing_columns()
+    create_missing_indexes()
+    prune_orphan_associations()
+    backfill_associations()
+
+
+if __name__ == '__main__':
+    # python migrations.py: run once per deploy, before starting web workers and daemons
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        upgrade()
@@ -0,0 +1,286 @@
+"""Micro-batched price-direction inference for the ml_prediction strategy.
+
+Callers submit one feature vector with a callback. A single worker thread
+collects requests for up to `window` seconds after the first one arrives (or
+until max_batch are queued). It stacks them into one (batch, n_features)
+array and runs one forward pass, so framework overhead is paid per batch and
+not per symbol per bot. swap_model() replaces the model between batches, and
+in-flight requests finish on the model they started with. Batch sizes and
+request latencies are kept as fixed-bucket histograms.
+
+Models are loaded by extension from ML_MODEL_PATH: .npz (numpy logistic
+weights), .joblib/.pkl (scikit-learn, predict_proba) or .pt (TorchScript). With
+no model configured, MomentumModel reproduces the backtester's logistic
+momentum score.
+"""
+import os
+import math
+import time
+import bisect
+import logging
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import Future
+
+import numpy as np
+
+FEATURES = ('return_zscore', 'ema_5_20_gap', 'ema_3_12_gap', 'ema_60_deviation', 'rsi')
+
+Prediction = namedtuple('Prediction', 'probability confidence direction model_version')
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100, 250)
+
+
+def tick_features(state):
+    """Feature vector for a bot_supervisor PairState, or None while indicators warm up"""
+    stats = state.indicator('return_stats', span=30)
+    ema3, ema5, ema12 = (state.indicator('ema', span=s) for s in (3, 5, 12))
+    ema20, ema60 = state.indicator('ema', span=20), state.indicator('ema', span=60)
+    rsi = state.indicator('rsi', period=14)
+    if not (stats.ready and ema60.ready and rsi.ready) or stats.var <= 0.0:
+        return None
+    return (stats.mean / math.sqrt(stats.var) * math.sqrt(stats.span),
+            ema5.current / ema20.current - 1.0,
+            ema3.current / ema12.current - 1.0,
+            state.price / ema60.current - 1.0,
+            rsi.value / 100.0 - 0.5)
+
+
+class LogisticModel:
+    """p(up) = sigmoid(X @ weights + bias), evaluated for the whole batch at once"""
+
+    def __init__(self, weights, bias=0.0):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+
+    def predict_proba(self, features):
+        logits = np.clip(features @ self.weights + self.bias, -50.0, 50.0)
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['weights'], float(data['bias']) if 'bias' in data else 0.0)
+
+
+class MomentumModel(LogisticModel):
+    """Default model: the logistic risk-adjusted momentum score used by the backtester"""
+
+    def __init__(self):
+        super().__init__([1.0, 0.0, 0.0, 0.0, 0.0])
+
+
+class SklearnModel:
+    def __init__(self, estimator):
+        self.estimator = estimator
+
+    def predict_proba(self, features):
+        return self.estimator.predict_proba(features)[:, 1]
+
+
+class TorchModel:
+    """A module mapping (batch, n_features) float32 to one logit per row"""
+
+    def __init__(self, module):
+        import torch
+        self.torch = torch
+        self.module = module.eval()
+
+    def predict_proba(self, features):
+        torch = self.torch
+        with torch.inference_mode():
+            logits = self.module(torch.from_numpy(features.astype(np.float32)))
+        return torch.sigmoid(logits.reshape(-1)).numpy().astype(np.float64)
+
+
+def load_model(path=None):
+    path = path or os.environ.get('ML_MODEL_PATH')
+    if not path:
+        return MomentumModel()
+    if path.endswith('.npz'):
+        return LogisticModel.load(path)
+    if path.endswith(('.joblib', '.pkl')):
+        import joblib
+        return SklearnModel(joblib.load(path))
+    if path.endswith('.pt'):
+        import torch
+        return TorchModel(torch.jit.load(path))
+    raise ValueError(f'Unsupported model file: {path}')
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def as_dict(self):
+        labels = [f'<={b}' for b in self.bounds] + [f'>{self.bounds[-1]}']
+        return {
+            'buckets': dict(zip(labels, self.counts)),
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else None,
+        }
+
+
+class InferenceServer:
+    """Collects feature vectors from all bots and predicts them in micro-batches"""
+
+    def __init__(self, model=None, window=0.002, max_batch=256):
+        self.model = model or load_model()
+        self.model_version = 1
+        self.window = window
+        self.max_batch = max_batch
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+        self.batches = 0
+        self.predictions = 0
+        self.failures = 0
+        self.batch_sizes = Histogram(BATCH_BUCKETS)
+        self.latencies = Histogram(LATENCY_BUCKETS_MS)
+
+    def submit(self, features, callback):
+        """Queue one feature vector; callback(prediction, error) runs on the inference thread.
+
+        A plain callback instead of a Future per request: creating a
+        concurrent Future costs more than a forward pass of a small model.
+        """
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError('Inference server is stopped')
+            self._pending.append((features, callback, time.perf_counter()))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        if self._thread is None:
+            self._start()
+
+    def predict(self, features, timeout=None):
+        """Blocking single prediction"""
+        future = Future()
+
+        def done(prediction, error):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(prediction)
+
+        self.submit(features, done)
+        return future.result(timeout)
+
+    async def predict_async(self, features):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def done(prediction, error):
+            if error is not None:
+                loop.call_soon_threadsafe(future.set_exception, error)
+            else:
+                loop.call_soon_threadsafe(future.set_result, prediction)
+
+        self.submit(features, done)
+        return await future
+
+    def swap_model(self, model):
+        """Serve the next batch with a new model"""
+        with self._cond:
+            self.model = model
+            self.model_version += 1
+        logging.info(f'Inference model swapped to version {self.model_version}')
+        return self.model_version
+
+    def _start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ml-inference', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            if not self._pending:
+                return None, None, None
+            # hold the batch open for `window` after its first request
+            deadline = self._pending[0][2] + self.window
+            while len(self._pending) < self.max_batch and not self._stopped:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            n = min(len(self._pending), self.max_batch)
+            batch = [self._pending.popleft() for _ in range(n)]
+            return batch, self.model, self.model_version
+
+    def _run(self):
+        while True:
+            batch, model, version = self._take_batch()
+            if batch is None:
+                return
+            try:
+                features = np.array([item[0] for item in batch], dtype=np.float64)
+                probabilities = model.predict_proba(features).tolist()
+            except Exception as e:
+                self.failures += len(batch)
+                logging.exception('Inference batch failed')
+                for _, callback, _ in batch:
+                    try:
+                        callback(None, e)
+                    except Exception:
+                        logging.exception('Inference callback failed')
+                continue
+
+            done = time.perf_counter()
+            self.batches += 1
+            self.predictions += len(batch)
+            self.batch_sizes.observe(len(batch))
+            for (_, callback, submitted), p in zip(batch, probabilities):
+                self.latencies.observe((done - submitted) * 1000.0)
+                try:
+                    callback(Prediction(p, max(p, 1.0 - p), 1 if p >= 0.5 else -1, version), None)
+                except Exception:
+                    logging.exception('Inference callback failed')
+
+    def metrics(self):
+        return {
+            'model_version': self.model_version,
+            'pending': len(self._pending),
+            'batches': self.batches,
+            'predictions': self.predictions,
+            'failures': self.failures,
+            'avg_batch_size': round(self.predictions / self.batches, 2) if self.batches else 0,
+            'batch_size_histogram': self.batch_sizes.as_dict(),
+            'latency_ms_histogram': self.latencies.as_dict(),
+        }
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_inference_server():
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = InferenceServer(window=float(os.environ.get('ML_BATCH_WINDOW', 0.002)))
+        return _server
@@ -1,10 +1,24 @@
 from datetime import datetime
 import json
 from app import db
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 import random
 
+
+def _load_json(value, default):
+    try:
+        decoded = json.loads(value) if value else default
+    except (TypeError, ValueError):
+        return default
+    return decoded if isinstance(decoded, type(default)) else default
+
+
+def _unique(values):
+    return list(dict.fromkeys(v for v in values if v))
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -17,6 +31,8 @@ class User(UserMixin, db.Model):
     notify_ml = db.Column(db.Boolean, default=True)
     notify_errors = db.Column(db.Boolean, default=True)
     notify_bot_status = db.Column(db.Boolean, default=True)
+    # bumped on every save so other processes' preference caches drop the user
+    preferences_updated_at = db.Column(db.DateTime)
     failed_login_attempts = db.Column(db.Integer, default=0)
     last_failed_login = db.Column(db.DateTime)
     account_locked_until = db.Column(db.DateTime)
@@ -27,6 +43,10 @@ class User(UserMixin, db.Model):
     withdrawals = db.relationship('Withdrawal', backref='user', lazy=True)
     deposits = db.relationship('Deposit', backref='user', lazy=True)
     
+    __table_args__ = (
+        db.Index('ix_user_preferences_updated_at', 'preferences_updated_at'),
+    )
+    
     @staticmethod
     def validate_username(username):
         import re
@@ -110,30 +130,76 @@ class BotConfig(db.Model):
     portfolio_active = db.Column(db.Boolean, default=False)
     sentiment_active = db.Column(db.Boolean, default=False)
     rebalance_frequency = db.Column(db.Integer, default=86400)
+    last_rebalanced_at = db.Column(db.DateTime)
     arb_profit_threshold = db.Column(db.Float, default=0.003)
     ml_confidence_threshold = db.Column(db.Float, default=0.7)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # indexed copies of the JSON columns, kept in sync on flush and deleted with the
+    # config by the ORM (SQLite does not enforce ondelete without PRAGMA foreign_keys)
+    pair_rows = db.relationship('BotConfigPair', backref='config', lazy=True,
+                                cascade='all, delete-orphan')
+    strategy_rows = db.relationship('BotConfigStrategy', backref='config', lazy=True,
+                                    cascade='all, delete-orphan')
     
     def get_strategies(self):
-        try:
-            return json.loads(self.strategies) if self.strategies else []
-        except:
-            return []
+        return _load_json(self.strategies, [])
     
     def set_strategies(self, strategies_list):
         self.strategies = json.dumps(strategies_list)
     
     def get_pairs(self):
-        try:
-            return json.loads(self.pairs) if self.pairs else []
-        except:
-            return []
+        return _load_json(self.pairs, [])
     
     def set_pairs(self, pairs_list):
         self.pairs = json.dumps(pairs_list)
 
+    def _sync_rows(self):
+        existing = {row.symbol: row for row in self.pair_rows}
+        self.pair_rows = [existing.get(symbol) or BotConfigPair(symbol=symbol)
+                          for symbol in _unique(str(p).strip().upper() for p in self.get_pairs())]
+        existing = {row.strategy: row for row in self.strategy_rows}
+        self.strategy_rows = [existing.get(name) or BotConfigStrategy(strategy=name)
+                              for name in _unique(str(s).strip() for s in self.get_strategies())]
+
+    @classmethod
+    def trading(cls, symbol, active_only=True):
+        """Configs trading symbol, found through the bot_config_pair index"""
+        query = cls.query.join(BotConfigPair).filter(BotConfigPair.symbol == symbol.strip().upper())
+        if active_only:
+            query = query.filter(cls.is_active.is_(True))
+        return query
+
+    @classmethod
+    def using_strategy(cls, strategy, active_only=True):
+        query = cls.query.join(BotConfigStrategy).filter(BotConfigStrategy.strategy == strategy)
+        if active_only:
+            query = query.filter(cls.is_active.is_(True))
+        return query
+
+    @classmethod
+    def active_pairs(cls):
+        """Distinct symbols traded by active configs"""
+        rows = db.session.query(BotConfigPair.symbol).join(cls).filter(cls.is_active.is_(True)).distinct()
+        return sorted(symbol for (symbol,) in rows)
+
+class BotConfigPair(db.Model):
+    config_id = db.Column(db.Integer, db.ForeignKey('bot_config.id', ondelete='CASCADE'), primary_key=True)
+    symbol = db.Column(db.String(20), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_bot_config_pair_symbol_config', 'symbol', 'config_id'),
+    )
+
+class BotConfigStrategy(db.Model):
+    config_id = db.Column(db.Integer, db.ForeignKey('bot_config.id', ondelete='CASCADE'), primary_key=True)
+    strategy = db.Column(db.String(50), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_bot_config_strategy_strategy_config', 'strategy', 'config_id'),
+    )
+
 class Trade(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     exchange = db.Column(db.String(50), nullable=False)
@@ -150,6 +216,10 @@ class Trade(db.Model):
     profit_loss = db.Column(db.Float)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_trade_user_timestamp', 'user_id', 'timestamp'),
+    )
 
 class ArbitrageOpportunity(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -162,6 +232,32 @@ class ArbitrageOpportunity(db.Model):
     executed = db.Column(db.Boolean, default=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_arbitrage_opportunity_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_arbitrage_opportunity_user_executed_timestamp', 'user_id', 'executed', 'timestamp'),
+    )
+
+class CycleArbitrageOpportunity(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    start_asset = db.Column(db.String(20), nullable=False)
+    exchanges = db.Column(db.String(200), nullable=False)
+    legs = db.Column(db.Text, nullable=False)
+    leg_count = db.Column(db.Integer, nullable=False)
+    profit_percent = db.Column(db.Float, nullable=False)
+    executed = db.Column(db.Boolean, default=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_cycle_arbitrage_opportunity_user_executed_timestamp', 'user_id', 'executed', 'timestamp'),
+    )
+    
+    def get_legs(self):
+        return _load_json(self.legs, [])
+    
+    def set_legs(self, legs_list):
+        self.legs = json.dumps(legs_list)
 
 class PortfolioSnapshot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -172,44 +268,95 @@ class PortfolioSnapshot(db.Model):
     sharpe_ratio = db.Column(db.Float)
     volatility = db.Column(db.Float)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    asset_rows = db.relationship('PortfolioSnapshotAsset', backref='snapshot', lazy=True,
+                                 cascade='all, delete-orphan')
     
     def get_assets(self):
-        try:
-            return json.loads(self.assets) if self.assets else {}
-        except:
-            return {}
+        return _load_json(self.assets, {})
     
     def set_assets(self, assets_dict):
         self.assets = json.dumps(assets_dict)
     
     def get_weights(self):
-        try:
-            return json.loads(self.weights) if self.weights else {}
-        except:
-            return {}
+        return _load_json(self.weights, {})
     
     def set_weights(self, weights_dict):
         self.weights = json.dumps(weights_dict)
 
+    def _sync_rows(self):
+        quantities, weights = self.get_assets(), self.get_weights()
+        existing = {row.asset: row for row in self.asset_rows}
+        rows = []
+        for asset in _unique(list(quantities) + list(weights)):
+            row = existing.get(asset) or PortfolioSnapshotAsset(asset=asset)
+            row.quantity = quantities.get(asset)
+            row.weight = weights.get(asset)
+            rows.append(row)
+        self.asset_rows = rows
+
+    @classmethod
+    def holding(cls, asset):
+        """Snapshots holding or targeting asset, found through the portfolio_snapshot_asset index"""
+        return cls.query.join(PortfolioSnapshotAsset).filter(PortfolioSnapshotAsset.asset == asset.upper())
+
+class PortfolioSnapshotAsset(db.Model):
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('portfolio_snapshot.id', ondelete='CASCADE'),
+                            primary_key=True)
+    asset = db.Column(db.String(20), primary_key=True)
+    quantity = db.Column(db.Float)
+    weight = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_portfolio_snapshot_asset_asset_snapshot', 'asset', 'snapshot_id'),
+    )
+
+class AssetPrice(db.Model):
+    """Latest USD mark per asset from the live feed, written by portfolio_valuation.PricePublisher"""
+    asset = db.Column(db.String(20), primary_key=True)
+    price = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_asset_price_updated_at', 'updated_at'),
+    )
+
 class NewsItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
     source = db.Column(db.String(100), nullable=False)
     url = db.Column(db.String(500), nullable=False)
+    url_hash = db.Column(db.String(40), unique=True, index=True)
     sentiment_score = db.Column(db.Float)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     related_assets = db.Column(db.String(200))
+    asset_rows = db.relationship('NewsItemAsset', backref='news_item', lazy=True,
+                                 cascade='all, delete-orphan')
     
     def get_related_assets(self):
-        try:
-            return json.loads(self.related_assets) if self.related_assets else []
-        except:
-            return []
+        return _load_json(self.related_assets, [])
     
     def set_related_assets(self, assets_list):
         self.related_assets = json.dumps(assets_list)
 
+    def _sync_rows(self):
+        existing = {row.asset: row for row in self.asset_rows}
+        self.asset_rows = [existing.get(asset) or NewsItemAsset(asset=asset)
+                           for asset in _unique(str(a).upper() for a in self.get_related_assets())]
+
+    @classmethod
+    def mentioning(cls, asset):
+        """News tagged with asset, found through the news_item_asset index"""
+        return cls.query.join(NewsItemAsset).filter(NewsItemAsset.asset == asset.upper())
+
+class NewsItemAsset(db.Model):
+    news_item_id = db.Column(db.Integer, db.ForeignKey('news_item.id', ondelete='CASCADE'), primary_key=True)
+    asset = db.Column(db.String(20), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_news_item_asset_asset_item', 'asset', 'news_item_id'),
+    )
+
 class Deposit(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     exchange = db.Column(db.String(50), nullable=False)
@@ -255,6 +402,39 @@ class BacktestResult(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+class SweepJob(db.Model):
+    """A queued parameter sweep; run by parameter_sweep's job runner, not in the request"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    strategy = db.Column(db.String(50), nullable=False)
+    pairs = db.Column(db.String(200), nullable=False)
+    days_back = db.Column(db.Integer, nullable=False)
+    initial_capital = db.Column(db.Float, nullable=False)
+    mode = db.Column(db.String(10), nullable=False)
+    n_samples = db.Column(db.Integer)
+    ranges = db.Column(db.Text, nullable=False)
+    total_runs = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, completed, failed
+    best = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # a running job whose runner stops renewing this is claimed again
+    lease_expires_at = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, default=0)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_sweep_job_status_id', 'status', 'id'),
+    )
+    
+    def get_ranges(self):
+        return _load_json(self.ranges, {})
+    
+    def get_best(self):
+        return _load_json(self.best, {})
+
 class WithdrawalOTP(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -281,3 +461,27 @@ class WithdrawalOTP(db.Model):
                 not self.verified and 
                 self.attempts < 3 and 
                 self.otp_code == code)
+
+
+# JSON column -> indexed rows, for each model that has both
+_SYNCED_COLUMNS = {
+    BotConfig: ('pairs', 'strategies'),
+    PortfolioSnapshot: ('assets', 'weights'),
+    NewsItem: ('related_assets',),
+}
+
+
+@event.listens_for(Session, 'before_flush')
+def _sync_association_rows(session, flush_context, instances):
+    """Rewrite the association rows of objects whose JSON columns are new or changed.
+
+    Bulk INSERT/UPDATE statements bypass this; their callers (and
+    migrations.backfill_associations) write the rows themselves.
+    """
+    for obj in list(session.new) + list(session.dirty):
+        columns = _SYNCED_COLUMNS.get(type(obj))
+        if columns is None:
+            continue
+        state = inspect(obj)
+        if state.pending or any(state.attrs[c].history.has_changes() for c in columns):
+            obj._sync_rows()
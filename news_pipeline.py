@@ -0,0 +1,462 @@
+"""Streaming news ingestion and sentiment scoring.
+
+Articles flow through a chain of generators. A source (a feed directory of
+.json/.jsonl files, or an HTTP endpoint returning JSON) is normalized, then
+grouped into batches. Each batch is deduplicated on the SHA-1 of its
+normalized URL: first within the batch, then against recently seen hashes,
+then with one IN query against NewsItem.url_hash. Duplicates are dropped
+before scoring, so the model only sees new articles. Related assets are
+found with an Aho-Corasick automaton built once from tickers and asset names,
+so the cost of matching grows with the length of the text and not with the
+number of assets. A batch is scored in one call to the sentiment model and
+written with one multi-row INSERT, plus one for its news_item_asset rows.
+
+The scorer is the transformers sentiment model named by NEWS_SENTIMENT_MODEL
+(pinned with NEWS_SENTIMENT_REVISION), run on CPU. When transformers is not
+installed, a finance word lexicon is used instead.
+
+    python news_pipeline.py feeds/            # watch a directory
+    python news_pipeline.py https://host/news # poll an HTTP source
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+SENTIMENT_MODEL = os.environ.get('NEWS_SENTIMENT_MODEL', 'ProsusAI/finbert')
+SENTIMENT_REVISION = os.environ.get('NEWS_SENTIMENT_REVISION', 'main')
+POLL_INTERVAL = float(os.environ.get('NEWS_POLL_INTERVAL', 30))
+
+# names and aliases match in any case; tickers only in upper case, so 'link' or 'dot' do not
+ASSET_NAMES = {
+    'BTC': ('bitcoin',),
+    'ETH': ('ethereum', 'ether'),
+    'BNB': ('binance coin',),
+    'SOL': ('solana',),
+    'XRP': ('ripple',),
+    'ADA': ('cardano',),
+    'DOGE': ('dogecoin',),
+    'DOT': ('polkadot',),
+    'AVAX': ('avalanche',),
+    'MATIC': ('polygon',),
+    'LINK': ('chainlink',),
+    'LTC': ('litecoin',),
+    'ATOM': ('cosmos',),
+    'TRX': ('tron',),
+    'USDT': ('tether',),
+    'USDC': ('usd coin',),
+}
+
+TRACKING_PARAMS = ('utm_', 'ref', 'fbclid', 'gclid')
+
+
+# -- sources -----------------------------------------------------------------
+
+def read_feed_directory(path, follow=False, poll_interval=POLL_INTERVAL):
+    """Yield articles from .json (object or list) and .jsonl files, oldest file first.
+
+    With follow=True the directory is polled for new files forever. A file is
+    read once per process. Its URLs are deduplicated downstream, so re-reading
+    it after a restart is harmless.
+    """
+    done = set()
+    while True:
+        names = [n for n in os.listdir(path) if n.endswith(('.json', '.jsonl')) and n not in done]
+        names.sort(key=lambda n: os.path.getmtime(os.path.join(path, n)))
+        for name in names:
+            done.add(name)
+            try:
+                with open(os.path.join(path, name), encoding='utf-8') as f:
+                    if name.endswith('.jsonl'):
+                        for line in f:
+                            if line.strip():
+                                yield json.loads(line)
+                    else:
+                        yield from _articles(json.load(f))
+            except (OSError, ValueError) as e:
+                logging.warning(f'Skipping news feed file {name}: {e}')
+        if not follow:
+            return
+        time.sleep(poll_interval)
+
+
+def fetch_http_feed(url, follow=False, poll_interval=POLL_INTERVAL, timeout=10):
+    """Yield articles from an HTTP endpoint returning a JSON list (or {"articles": [...]})"""
+    from urllib.request import urlopen
+
+    while True:
+        try:
+            with urlopen(url, timeout=timeout) as response:
+                yield from _articles(json.load(response))
+        except (OSError, ValueError) as e:
+            logging.warning(f'News feed {url} failed: {e}')
+        if not follow:
+            return
+        time.sleep(poll_interval)
+
+
+def _articles(data):
+    if isinstance(data, dict):
+        data = data.get('articles', [data])
+    return (article for article in data if isinstance(article, dict))
+
+
+# -- normalization and dedupe ------------------------------------------------
+
+def normalize_url(url):
+    """Lower-case scheme and host, drop fragments, tracking parameters and trailing slashes"""
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query)
+                             if not k.lower().startswith(TRACKING_PARAMS)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), query, ''))
+
+
+def url_hash(url):
+    return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+def _timestamp(value):
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value / 1000.0 if value > 1e11 else value)
+    if isinstance(value, str) and value:
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if parsed.tzinfo is not None:
+            parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+        return parsed
+    return None
+
+
+def normalize(articles):
+    """Map raw feed dicts to NewsItem columns plus url_hash; articles without a URL or title are dropped"""
+    for article in articles:
+        url = article.get('url') or article.get('link')
+        title = (article.get('title') or '').strip()
+        if not url or not title:
+            continue
+        yield {
+            'title': title[:200],
+            'content': (article.get('content') or article.get('description') or article.get('summary') or '').strip(),
+            'source': (article.get('source') or urlsplit(url).netloc or 'unknown')[:100],
+            'url': url[:500],
+            'url_hash': url_hash(url),
+            'timestamp': _timestamp(article.get('published_at') or article.get('timestamp')) or datetime.utcnow(),
+        }
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# -- asset matching ----------------------------------------------------------
+
+class AhoCorasick:
+    """Multi-pattern matcher: one pass over the text finds every occurrence of every pattern"""
+
+    def __init__(self, patterns):
+        # patterns: {pattern string: value}
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for pattern, value in patterns.items():
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] += ((len(pattern), value),)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def finditer(self, text):
+        """Yield (start, end, value) for every match"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for length, value in out[state]:
+                    yield i - length + 1, i + 1, value
+
+
+class AssetMatcher:
+    """Finds the assets an article mentions, by name (any case) or ticker (upper case)"""
+
+    def __init__(self, names=None, tickers=()):
+        names = ASSET_NAMES if names is None else names
+        tickers = set(tickers) | set(names)
+        self._names = AhoCorasick({alias.lower(): asset for asset, aliases in names.items()
+                                   for alias in aliases})
+        self._tickers = AhoCorasick({ticker.upper(): ticker.upper() for ticker in tickers})
+
+    @staticmethod
+    def _bounded(text, start, end):
+        return ((start == 0 or not text[start - 1].isalnum())
+                and (end == len(text) or not text[end].isalnum()))
+
+    def match(self, text):
+        """Assets mentioned in text, in order of first mention"""
+        found = {}
+        lowered = text.lower()
+        for start, end, asset in self._names.finditer(lowered):
+            if self._bounded(lowered, start, end):
+                found.setdefault(asset, start)
+        for start, end, asset in self._tickers.finditer(text):
+            if self._bounded(text, start, end) and start < found.get(asset, len(text)):
+                found[asset] = start
+        return sorted(found, key=found.get)
+
+    @classmethod
+    def from_bot_pairs(cls):
+        """Default names plus every base and quote asset traded by a bot config"""
+        from models import BotConfig
+
+        tickers = set()
+        for config in BotConfig.query.all():
+            for pair in config.get_pairs():
+                tickers.update(part.strip().upper() for part in pair.split('/') if part.strip())
+        return cls(tickers=tickers)
+
+
+# -- scoring -----------------------------------------------------------------
+
+class TransformerScorer:
+    """CPU batched transformers classifier; score = p(positive) - p(negative)"""
+
+    def __init__(self, model=SENTIMENT_MODEL, revision=SENTIMENT_REVISION, batch_size=32, max_length=512):
+        from transformers import pipeline
+
+        self.name = f'{model}@{revision}'
+        self.batch_size = batch_size
+        self._pipeline = pipeline('sentiment-analysis', model=model, revision=revision, device=-1,
+                                  top_k=None, truncation=True, max_length=max_length)
+
+    def score(self, texts):
+        results = self._pipeline(list(texts), batch_size=self.batch_size)
+        scores = []
+        for labels in results:
+            probabilities = {item['label'].lower(): item['score'] for item in labels}
+            scores.append(probabilities.get('positive', 0.0) - probabilities.get('negative', 0.0))
+        return scores
+
+
+class LexiconScorer:
+    """Fallback without transformers: (positive - negative) / (hits + 1) over a finance lexicon"""
+
+    name = 'lexicon'
+    POSITIVE = frozenset((
+        'gain', 'gains', 'surge', 'surges', 'soar', 'soars', 'rally', 'rallies', 'bullish', 'rise',
+        'rises', 'jump', 'jumps', 'record', 'high', 'growth', 'adoption', 'approve', 'approved',
+        'approval', 'partnership', 'upgrade', 'launch', 'launches', 'profit', 'beat', 'beats',
+        'breakout', 'recover', 'recovers', 'recovery', 'strong', 'inflows', 'outperform', 'support',
+    ))
+    NEGATIVE = frozenset((
+        'loss', 'losses', 'drop', 'drops', 'plunge', 'plunges', 'crash', 'crashes', 'bearish', 'fall',
+        'falls', 'slump', 'slumps', 'low', 'hack', 'hacked', 'exploit', 'fraud', 'lawsuit', 'sues',
+        'ban', 'bans', 'reject', 'rejected', 'selloff', 'sell-off', 'liquidation', 'liquidations',
+        'outflows', 'weak', 'decline', 'declines', 'risk', 'warning', 'bankruptcy', 'investigation',
+    ))
+    _words = re.compile(r"[a-z][a-z'-]*")
+
+    def score(self, texts):
+        scores = []
+        for text in texts:
+            positive = negative = 0
+            for word in self._words.findall(text.lower()):
+                if word in self.POSITIVE:
+                    positive += 1
+                elif word in self.NEGATIVE:
+                    negative += 1
+            scores.append((positive - negative) / (positive + negative + 1))
+        return scores
+
+
+def load_scorer():
+    try:
+        return TransformerScorer()
+    except ImportError:
+        logging.warning('transformers is not installed; scoring news with the lexicon fallback')
+    except Exception:
+        # e.g. the model cannot be downloaded or its revision does not exist
+        logging.exception(f'Could not load {SENTIMENT_MODEL}@{SENTIMENT_REVISION}; '
+                          'scoring news with the lexicon fallback')
+    return LexiconScorer()
+
+
+def _related_assets_json(assets, limit=200):
+    """JSON list of assets, dropping whole entries from the end until it fits the column"""
+    assets = list(assets)
+    text = json.dumps(assets)
+    while len(text) > limit:
+        assets.pop()
+        text = json.dumps(assets)
+    return text
+
+
+# -- pipeline ----------------------------------------------------------------
+
+class NewsPipeline:
+    """Dedupes, tags, scores and stores batches of articles"""
+
+    def __init__(self, app, scorer=None, matcher=None, batch_size=32, seen_capacity=100000,
+                 max_chars=2000):
+        self.app = app
+        self.scorer = scorer
+        self.matcher = matcher
+        self.batch_size = batch_size
+        self.seen_capacity = seen_capacity
+        self.max_chars = max_chars
+        self._seen = OrderedDict()
+
+        self.received = 0
+        self.duplicates = 0
+        self.scored = 0
+        self.inserted = 0
+        self.score_seconds = 0.0
+        self.elapsed = 0.0
+
+    def _remember(self, digest):
+        self._seen[digest] = None
+        if len(self._seen) > self.seen_capacity:
+            self._seen.popitem(last=False)
+
+    def _dedupe(self, batch):
+        """New articles of the batch: unseen in the batch, in memory and in the database"""
+        from models import NewsItem
+
+        fresh = {}
+        for article in batch:
+            digest = article['url_hash']
+            if digest in fresh or digest in self._seen:
+                continue
+            fresh[digest] = article
+        if fresh:
+            stored = NewsItem.query.with_entities(NewsItem.url_hash) \
+                .filter(NewsItem.url_hash.in_(list(fresh))).all()
+            for (digest,) in stored:
+                self._remember(digest)
+                del fresh[digest]
+        self.duplicates += len(batch) - len(fresh)
+        return list(fresh.values())
+
+    def _insert(self, rows, assets):
+        """Insert rows and their news_item_asset rows; assets maps url_hash to asset list"""
+        from app import db
+        from models import NewsItem, NewsItemAsset
+
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            insert = None
+        if insert is not None:
+            # another ingester may have stored the same URL since the dedupe query
+            statement = insert(NewsItem).on_conflict_do_nothing(index_elements=['url_hash'])
+        else:
+            statement = db.insert(NewsItem)
+        # RETURNING yields only the rows actually inserted, with their new ids
+        inserted = db.session.execute(statement.returning(NewsItem.id, NewsItem.url_hash), rows).all()
+        links = [{'news_item_id': item_id, 'asset': asset}
+                 for item_id, digest in inserted for asset in assets[digest]]
+        if links:
+            db.session.execute(db.insert(NewsItemAsset), links)
+        db.session.commit()
+        return len(inserted)
+
+    def process(self, articles):
+        """Generator: consume raw articles and yield each batch of rows after it is stored"""
+        if self.scorer is None:
+            self.scorer = load_scorer()
+        with self.app.app_context():
+            if self.matcher is None:
+                self.matcher = AssetMatcher.from_bot_pairs()
+            for batch in batched(normalize(articles), self.batch_size):
+                started = time.perf_counter()
+                self.received += len(batch)
+                rows = self._dedupe(batch)
+                if rows:
+                    texts = [f"{row['title']}. {row['content']}"[:self.max_chars] for row in rows]
+                    score_started = time.perf_counter()
+                    scores = self.scorer.score(texts)
+                    self.score_seconds += time.perf_counter() - score_started
+                    assets = {}
+                    for row, text, score in zip(rows, texts, scores):
+                        matched = assets[row['url_hash']] = self.matcher.match(text)
+                        row['sentiment_score'] = round(float(score), 4)
+                        row['related_assets'] = _related_assets_json(matched)
+                    inserted = self._insert(rows, assets)
+                    for row in rows:
+                        self._remember(row['url_hash'])
+                    self.scored += len(rows)
+                    self.inserted += inserted
+                self.elapsed += time.perf_counter() - started
+                yield rows
+
+    def run(self, articles):
+        for rows in self.process(articles):
+            if rows:
+                logging.info(f'Stored {len(rows)} news items ({self.duplicates} duplicates skipped so far)')
+        return self.metrics()
+
+    def metrics(self):
+        return {
+            'scorer': getattr(self.scorer, 'name', type(self.scorer).__name__),
+            'received': self.received,
+            'duplicates': self.duplicates,
+            'scored': self.scored,
+            'inserted': self.inserted,
+            'articles_per_s': round(self.received / self.elapsed, 1) if self.elapsed else None,
+            'scored_per_s': round(self.scored / self.score_seconds, 1) if self.score_seconds else None,
+        }
+
+
+def open_source(location, follow=False):
+    if location.startswith(('http://', 'https://')):
+        return fetch_http_feed(location, follow=follow)
+    return read_feed_directory(location, follow=follow)
+
+
+if __name__ == '__main__':
+    # python news_pipeline.py <feed directory | http(s) url>
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    location = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('NEWS_FEED')
+    if not location:
+        print('usage: python news_pipeline.py <feed directory | http(s) url>')
+        sys.exit(1)
+    NewsPipeline(app).run(open_source(location, follow=True))
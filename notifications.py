@@ -0,0 +1,516 @@
+"""Batched, rate-limited email notifications.
+
+notify() only appends the event to a per-(user, category) digest and
+returns. It never touches SMTP and never queries the database, so
+callers like the trade ledger listener or the arbitrage recorder are not
+slowed down. A digest stays open for its category's window (one minute
+for trade fills), so 200 fills in a minute become one email. Errors use a
+short window so they still arrive promptly.
+
+A scheduler thread closes digests when their window ends. It looks up the
+preferences of all affected users in one query, through a TTL cache.
+save_notification_settings stamps User.preferences_updated_at, and every
+cache (in any process) polls for stamped users every few seconds and drops
+them, so a change applies to the next digest. Digests for users who opted out
+are dropped. Each recipient has a token bucket, RATE_LIMIT emails per hour
+with bursts of RATE_BURST. When a recipient is over the limit, the digest
+is pushed back and keeps collecting events until a token is free. Emails
+are sent by a small worker pool over persistent SMTP connections, which
+are reconnected when the server drops them. Failed sends are retried with
+backoff.
+
+The MAIL_* settings in app.py select the server. For a local sink, run
+
+    python -m aiosmtpd -n -l localhost:1025   (or any SMTP debugging server)
+
+with MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=False.
+"""
+import os
+import time
+import heapq
+import logging
+import smtplib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from sqlalchemy import func
+
+CATEGORIES = {
+    'trade': 'notify_trades',
+    'arbitrage': 'notify_arbitrage',
+    'ml': 'notify_ml',
+    'error': 'notify_errors',
+    'bot_status': 'notify_bot_status',
+}
+LABELS = {
+    'trade': 'trade fills',
+    'arbitrage': 'arbitrage opportunities',
+    'ml': 'ML predictions',
+    'error': 'bot errors',
+    'bot_status': 'bot status changes',
+}
+# seconds a digest collects events before it is sent
+DIGEST_WINDOWS = {'trade': 60.0, 'arbitrage': 60.0, 'ml': 300.0, 'error': 5.0, 'bot_status': 10.0}
+
+RATE_LIMIT = float(os.environ.get('NOTIFY_RATE_LIMIT', 20))   # emails per recipient per hour
+RATE_BURST = 5
+PREFERENCE_TTL = 300.0
+# seconds between polls for users whose preferences changed in another process
+PREFERENCE_CHECK_INTERVAL = 5.0
+MAX_DIGEST_LINES = 50
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 30.0
+
+Preferences = namedtuple('Preferences', 'address enabled categories')
+
+
+class PreferenceCache:
+    """Notification preferences per user id, loaded in batches and kept for ttl seconds.
+
+    Every check_interval seconds the users whose preferences_updated_at moved
+    past the last one seen are dropped, wherever they were saved.
+    """
+
+    def __init__(self, app, ttl=PREFERENCE_TTL, clock=time.monotonic,
+                 check_interval=PREFERENCE_CHECK_INTERVAL):
+        self.app = app
+        self.ttl = ttl
+        self.clock = clock
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._checked = None
+        self._changed_seen = None
+        # user id -> preferences_updated_at already acted on, within the overlap
+        self._stamps = {}
+        self.hits = 0
+        self.loads = 0
+
+    def _drop_changed(self, now):
+        """Drop users whose preferences were saved since the last check, by any process"""
+        from models import User
+
+        self._checked = now
+        with self.app.app_context():
+            if self._changed_seen is None:
+                self._changed_seen = User.query.with_entities(
+                    func.max(User.preferences_updated_at)).scalar() or datetime.utcnow()
+                return
+            # the overlap covers saves committed slightly out of timestamp order
+            rows = User.query.with_entities(User.id, User.preferences_updated_at).filter(
+                User.preferences_updated_at >= self._changed_seen - timedelta(seconds=5)).all()
+        with self._lock:
+            for user_id, updated_at in rows:
+                if self._stamps.get(user_id) != updated_at:
+                    self._stamps[user_id] = updated_at
+                    self._entries.pop(user_id, None)
+                self._changed_seen = max(self._changed_seen, updated_at)
+            cutoff = self._changed_seen - timedelta(seconds=5)
+            self._stamps = {u: t for u, t in self._stamps.items() if t >= cutoff}
+
+    def get_many(self, user_ids):
+        """{user_id: Preferences or None}, querying only the ids missing, expired or changed"""
+        now = self.clock()
+        if self._checked is None or now - self._checked >= self.check_interval:
+            self._drop_changed(now)
+        found, missing = {}, []
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry is not None and now < entry[1]:
+                    found[user_id] = entry[0]
+                    self.hits += 1
+                else:
+                    missing.append(user_id)
+        if missing:
+            loaded = self._load(missing)
+            with self._lock:
+                for user_id in missing:
+                    self._entries[user_id] = (loaded.get(user_id), now + self.ttl)
+            found.update((user_id, loaded.get(user_id)) for user_id in missing)
+        return found
+
+    def _load(self, user_ids):
+        from models import User
+
+        columns = [getattr(User, column) for column in CATEGORIES.values()]
+        with self.app.app_context():
+            rows = User.query.with_entities(
+                User.id, User.email, User.notification_email, User.email_notifications_enabled, *columns
+            ).filter(User.id.in_(user_ids)).all()
+        self.loads += 1
+        preferences = {}
+        for user_id, email, notification_email, enabled, *flags in rows:
+            categories = frozenset(c for c, flag in zip(CATEGORIES, flags) if flag)
+            preferences[user_id] = Preferences(notification_email or email, bool(enabled), categories)
+        return preferences
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+class RateLimiter:
+    """Token bucket per key: `rate` tokens per hour, at most `burst` saved up"""
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST):
+        self.per_second = rate / 3600.0
+        self.burst = float(burst)
+        self._buckets = {}
+
+    def take(self, key, now):
+        """0.0 if a token was taken, else the seconds until one is available"""
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.per_second)
+        if tokens >= 1.0:
+            self._buckets[key] = (tokens - 1.0, now)
+            return 0.0
+        self._buckets[key] = (tokens, now)
+        return (1.0 - tokens) / self.per_second if self.per_second > 0 else float('inf')
+
+
+class SMTPPool:
+    """Up to `size` persistent SMTP connections, opened on demand and reused across sends"""
+
+    def __init__(self, config, size=1, factory=smtplib.SMTP, timeout=30):
+        self.host = config.get('MAIL_SERVER') or 'localhost'
+        self.port = int(config.get('MAIL_PORT') or 25)
+        self.use_tls = bool(config.get('MAIL_USE_TLS'))
+        self.use_ssl = bool(config.get('MAIL_USE_SSL'))
+        self.username = config.get('MAIL_USERNAME')
+        self.password = config.get('MAIL_PASSWORD')
+        self.factory = smtplib.SMTP_SSL if self.use_ssl and factory is smtplib.SMTP else factory
+        self.timeout = timeout
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.connects = 0
+
+    def _open(self):
+        connection = self.factory(self.host, self.port, timeout=self.timeout)
+        if self.use_tls and not self.use_ssl:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        self.connects += 1
+        return connection
+
+    def send(self, message):
+        with self._slots:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            try:
+                try:
+                    if connection is None:
+                        connection = self._open()
+                    connection.send_message(message)
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    # the server closed an idle connection: reconnect once
+                    self._discard(connection)
+                    connection = self._open()
+                    connection.send_message(message)
+            except Exception:
+                self._discard(connection)
+                raise
+            with self._lock:
+                self._idle.append(connection)
+
+    def _discard(self, connection):
+        if connection is None:
+            return
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            try:
+                connection.quit()
+            except Exception:
+                self._discard(connection)
+
+
+class Digest:
+    __slots__ = ('user_id', 'category', 'lines', 'count', 'opened_at', 'attempts')
+
+    def __init__(self, user_id, category, opened_at):
+        self.user_id = user_id
+        self.category = category
+        self.lines = []
+        self.count = 0
+        self.opened_at = opened_at
+        self.attempts = 0
+
+    def add(self, subject, body):
+        self.count += 1
+        if len(self.lines) < MAX_DIGEST_LINES:
+            self.lines.append((subject, body))
+
+    def merge(self, other):
+        """Fold a newer digest for the same user and category into this one"""
+        self.count += other.count
+        room = MAX_DIGEST_LINES - len(self.lines)
+        if room > 0:
+            self.lines.extend(other.lines[:room])
+
+
+class NotificationDispatcher:
+    """Collects events into per-user digests and emails them from a worker pool"""
+
+    def __init__(self, app, smtp=None, workers=1, windows=None, rate_limit=RATE_LIMIT, burst=RATE_BURST,
+                 preferences=None, clock=time.monotonic):
+        self.app = app
+        self.sender = app.config.get('MAIL_DEFAULT_SENDER')
+        self.smtp = smtp or SMTPPool(app.config, size=workers)
+        self.windows = dict(DIGEST_WINDOWS, **(windows or {}))
+        self.limiter = RateLimiter(rate_limit, burst)
+        self.preferences = preferences or PreferenceCache(app, clock=clock)
+        self.clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='notify')
+        self._open = {}
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._inflight = 0
+
+        self.events = 0
+        self.sent = 0
+        self.suppressed = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+    # -- producers -----------------------------------------------------------
+
+    def notify(self, user_id, category, subject, body=''):
+        """Add one event to user_id's open digest for category; never blocks on I/O"""
+        if category not in CATEGORIES:
+            raise ValueError(f'Unknown notification category: {category}')
+        key = (user_id, category)
+        with self._cond:
+            if self._stopped:
+                return False
+            self.events += 1
+            digest = self._open.get(key)
+            if digest is None:
+                now = self.clock()
+                digest = self._open[key] = Digest(user_id, category, now)
+                heapq.heappush(self._heap, (now + self.windows[category], key))
+                self._cond.notify()
+            digest.add(subject, body)
+        if self._thread is None:
+            self._start()
+        return True
+
+    def on_trades(self, rows):
+        """TradeLedger listener: one trade event per committed fill (paper fills excluded)"""
+        from trade_ledger import PAPER_STATUS
+
+        for row in rows:
+            if row.get('status') == PAPER_STATUS:
+                continue
+            subject = f"{row['side'].upper()} {row['quantity']:g} {row['symbol']} @ {row['price']:g}"
+            self.notify(row['user_id'], 'trade', subject,
+                        f"{row.get('strategy') or 'manual'} on {row.get('exchange')}")
+
+    def send_now(self, address, subject, body):
+        """Send a single email synchronously, bypassing digests and rate limits"""
+        self.smtp.send(self._message(address, subject, body))
+        self.sent += 1
+
+    # -- scheduler -----------------------------------------------------------
+
+    def _start(self):
+        with self._cond:
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run, name='notification-scheduler', daemon=True)
+                self._thread.start()
+
+    def _take_due(self, block=True):
+        """Pop every digest whose window has ended, waiting for the first one if block"""
+        with self._cond:
+            while True:
+                now = self.clock()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, key = heapq.heappop(self._heap)
+                    digest = self._open.pop(key, None)
+                    if digest is not None:
+                        due.append(digest)
+                if due or not block or self._stopped:
+                    self._inflight += len(due)
+                    return due
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _run(self):
+        while True:
+            due = self._take_due()
+            if not due and self._stopped:
+                return
+            self._dispatch(due)
+
+    def _dispatch(self, digests):
+        """Suppress, rate-limit or send each due digest; on failure the rest are retried later"""
+        handled = 0
+        try:
+            preferences = self.preferences.get_many({digest.user_id for digest in digests})
+            now = self.clock()
+            for digest in digests:
+                self._route(digest, preferences.get(digest.user_id), now)
+                handled += 1
+        except Exception:
+            logging.exception('Notification dispatch failed')
+            # the handled ones were already sent, suppressed or rescheduled
+            retry = self.clock() + RETRY_BACKOFF
+            for digest in digests[handled:]:
+                self._reschedule(digest, retry)
+
+    def _route(self, digest, prefs, now):
+        if prefs is None or not prefs.enabled or not prefs.address or digest.category not in prefs.categories:
+            self.suppressed += digest.count
+            self._done()
+            return
+        wait = self.limiter.take(prefs.address, now)
+        if wait > 0:
+            self.rate_limited += 1
+            self._reschedule(digest, now + wait)
+            return
+        self._executor.submit(self._send, digest, prefs.address)
+
+    def _reschedule(self, digest, due):
+        """Put digest back as the open digest for its key, absorbing any newer events"""
+        key = (digest.user_id, digest.category)
+        with self._cond:
+            newer = self._open.get(key)
+            if newer is not None:
+                digest.merge(newer)
+            else:
+                heapq.heappush(self._heap, (due, key))
+            self._open[key] = digest
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def _done(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def _send(self, digest, address):
+        subject, body = self._render(digest)
+        try:
+            self.smtp.send(self._message(address, subject, body))
+        except Exception as e:
+            digest.attempts += 1
+            if digest.attempts >= MAX_ATTEMPTS:
+                self.failures += 1
+                logging.error(f'Dropping {digest.category} digest for user {digest.user_id} '
+                              f'after {digest.attempts} attempts: {e}')
+                self._done()
+            else:
+                logging.warning(f'Notification to user {digest.user_id} failed, retrying: {e}')
+                self._reschedule(digest, self.clock() + RETRY_BACKOFF * 2 ** (digest.attempts - 1))
+            return
+        self.sent += 1
+        self._done()
+
+    # -- rendering -----------------------------------------------------------
+
+    def _render(self, digest):
+        if digest.count == 1:
+            subject, body = digest.lines[0]
+            return f'Crypto Trading Bot: {subject}', body or subject
+        subject = f'Crypto Trading Bot: {digest.count} {LABELS[digest.category]}'
+        lines = [f'- {subject}: {body}' if body else f'- {subject}' for subject, body in digest.lines]
+        if digest.count > len(digest.lines):
+            lines.append(f'... and {digest.count - len(digest.lines)} more')
+        return subject, '\n'.join(lines)
+
+    def _message(self, address, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = address
+        message['Subject'] = subject
+        message.set_content(body)
+        return message
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def flush(self, timeout=30.0):
+        """Close every open digest now and wait until they are sent or dropped"""
+        with self._cond:
+            now = self.clock()
+            self._heap = [(now, key) for _, key in self._heap]
+            heapq.heapify(self._heap)
+            self._cond.notify_all()
+        if self._thread is None:
+            self._start()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._open or self._inflight) and not self._heap_blocked():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 0.1))
+        return True
+
+    def _heap_blocked(self):
+        """True when everything still open is waiting on a rate limit or retry backoff"""
+        return not self._inflight and bool(self._heap) and self._heap[0][0] > self.clock()
+
+    def stop(self, timeout=30.0):
+        self.flush(timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+        self.smtp.close()
+
+    def metrics(self):
+        with self._cond:
+            open_digests = len(self._open)
+        return {
+            'events': self.events,
+            'open_digests': open_digests,
+            'sent': self.sent,
+            'suppressed_events': self.suppressed,
+            'rate_limited': self.rate_limited,
+            'failures': self.failures,
+            'smtp_connects': getattr(self.smtp, 'connects', None),
+            'preference_loads': self.preferences.loads,
+        }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_notifier():
+    """Process-wide dispatcher, subscribed to the trade ledger's committed fills"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            from app import app
+            from trade_ledger import get_ledger
+            _dispatcher = NotificationDispatcher(app, workers=int(os.environ.get('NOTIFY_WORKERS', 1)))
+            get_ledger().add_listener(_dispatcher.on_trades)
+        return _dispatcher
+
+
+def notify(user_id, category, subject, body=''):
+    """Queue an event on the process-wide dispatcher; failures are logged, never raised"""
+    try:
+        return get_notifier().notify(user_id, category, subject, body)
+    except Exception:
+        logging.exception('Could not queue notification')
+        return False
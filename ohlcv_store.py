@@ -0,0 +1,272 @@
+"""Local columnar OHLCV store.
+
+Each (exchange, symbol, timeframe) series lives in its own directory as a set of
+append-only segments. A segment holds one fixed-width little-endian file per
+column (int64 timestamps in ms, float64 prices/volume), so a column range is a
+zero-copy slice of a memory map. A sparse index of every INDEX_STRIDE-th
+timestamp narrows range lookups to a single block before the final binary
+search.
+
+    store = get_store()
+    store.import_csv('binance', 'BTC/USDT', '1m', 'BTC_USDT_1m.csv')
+    candles = store.read('binance', 'BTC/USDT', '1m', start_ms, end_ms)
+    candles['close']  # numpy view, no copy
+"""
+import os
+import sys
+import logging
+import threading
+
+import numpy as np
+
+OHLCV_STORE_DIR = os.environ.get('OHLCV_STORE_DIR', os.path.join('market_data', 'store'))
+
+COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+DTYPES = {
+    'timestamp': np.dtype('<i8'),
+    'open': np.dtype('<f8'),
+    'high': np.dtype('<f8'),
+    'low': np.dtype('<f8'),
+    'close': np.dtype('<f8'),
+    'volume': np.dtype('<f8'),
+}
+
+# 2**20 rows is roughly two years of 1m candles, so a typical read maps one segment
+SEGMENT_ROWS = 1 << 20
+INDEX_STRIDE = 4096
+
+
+def _series_key(exchange, symbol, timeframe):
+    return (exchange.lower(), symbol.upper(), timeframe)
+
+
+def _locate(row):
+    """Map a global row number to (segment number, offset)"""
+    return row // SEGMENT_ROWS, row % SEGMENT_ROWS
+
+
+class SeriesView:
+    """Immutable snapshot of a series' mapped segments; reads never see a refresh in progress"""
+
+    def __init__(self, segments=()):
+        self.segments = tuple(segments)
+        self.n_rows = sum(len(seg['timestamp']) for seg in self.segments)
+        # full segments are a multiple of INDEX_STRIDE, so entry i always marks row i * INDEX_STRIDE
+        self.index = np.concatenate([seg['timestamp'][::INDEX_STRIDE] for seg in self.segments]) \
+            if self.segments else np.empty(0, dtype=np.int64)
+
+    @property
+    def last_timestamp(self):
+        if not self.segments:
+            return None
+        return int(self.segments[-1]['timestamp'][-1])
+
+    def search(self, timestamp):
+        """First row with timestamp >= the given one, via the sparse index then one block"""
+        if self.n_rows == 0:
+            return 0
+        block = int(np.searchsorted(self.index, timestamp, side='right')) - 1
+        if block < 0:
+            return 0
+        lo = block * INDEX_STRIDE
+        hi = min(lo + INDEX_STRIDE, self.n_rows)
+        seg, offset = _locate(lo)
+        span = self.segments[seg]['timestamp'][offset:offset + (hi - lo)]
+        return lo + int(np.searchsorted(span, timestamp, side='left'))
+
+    def slice(self, start_row, end_row):
+        """Columns for [start_row, end_row); a view when the range sits in one segment"""
+        if end_row <= start_row:
+            return {name: np.empty(0, dtype=DTYPES[name]) for name in COLUMNS}
+
+        first_seg, first_off = _locate(start_row)
+        last_seg, last_off = _locate(end_row - 1)
+        if first_seg == last_seg:
+            seg = self.segments[first_seg]
+            return {name: seg[name][first_off:last_off + 1] for name in COLUMNS}
+
+        parts = {name: [] for name in COLUMNS}
+        for number in range(first_seg, last_seg + 1):
+            lo = first_off if number == first_seg else 0
+            hi = last_off + 1 if number == last_seg else SEGMENT_ROWS
+            for name in COLUMNS:
+                parts[name].append(self.segments[number][name][lo:hi])
+        return {name: np.concatenate(parts[name]) for name in COLUMNS}
+
+
+class Series:
+    """Memory-mapped segments of one series, published as a SeriesView"""
+
+    def __init__(self, path):
+        self.path = path
+        self.view = SeriesView()
+        self.refresh()
+
+    @property
+    def n_rows(self):
+        return self.view.n_rows
+
+    @property
+    def last_timestamp(self):
+        return self.view.last_timestamp
+
+    def _segment_dir(self, number):
+        return os.path.join(self.path, f'seg_{number:05d}')
+
+    def refresh(self):
+        """(Re)map all segments; rows beyond the shortest column are a torn write and ignored.
+
+        The new view is built aside and swapped in with one assignment, so a
+        reader holding the previous view keeps a complete snapshot.
+        """
+        segments = []
+        number = 0
+        while os.path.isdir(self._segment_dir(number)):
+            seg_dir = self._segment_dir(number)
+            rows = min(os.path.getsize(os.path.join(seg_dir, name)) // DTYPES[name].itemsize
+                       if os.path.exists(os.path.join(seg_dir, name)) else 0
+                       for name in COLUMNS)
+            if rows == 0:
+                break
+            columns = {name: np.memmap(os.path.join(seg_dir, name), dtype=DTYPES[name],
+                                       mode='r', shape=(rows,))
+                       for name in COLUMNS}
+            segments.append(columns)
+            number += 1
+        self.view = SeriesView(segments)
+
+    def is_stale(self):
+        """True if another writer has appended since the last refresh (one stat call)"""
+        segments = self.view.segments
+        number = max(len(segments) - 1, 0)
+        path = os.path.join(self._segment_dir(number), 'timestamp')
+        if not os.path.exists(path):
+            return False
+        mapped = len(segments[number]['timestamp']) if segments else 0
+        if mapped == SEGMENT_ROWS:
+            return os.path.isdir(self._segment_dir(number + 1))
+        return os.path.getsize(path) // DTYPES['timestamp'].itemsize != mapped
+
+    def append(self, columns):
+        """Append rows (already sorted and newer than last_timestamp) across segments"""
+        n = len(columns['timestamp'])
+        n_rows = self.n_rows
+        written = 0
+        while written < n:
+            number, offset = _locate(n_rows + written)
+            seg_dir = self._segment_dir(number)
+            os.makedirs(seg_dir, exist_ok=True)
+            take = min(n - written, SEGMENT_ROWS - offset)
+            for name in COLUMNS:
+                with open(os.path.join(seg_dir, name), 'ab') as f:
+                    f.write(np.ascontiguousarray(columns[name][written:written + take],
+                                                 dtype=DTYPES[name]).tobytes())
+            written += take
+        self.refresh()
+
+
+class OHLCVStore:
+    """On-disk candle store keyed by (exchange, symbol, timeframe)"""
+
+    def __init__(self, root=None):
+        self.root = root or OHLCV_STORE_DIR
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        exchange, symbol, timeframe = key
+        return os.path.join(self.root, exchange, symbol.replace('/', '_'), timeframe)
+
+    def _get_series(self, key):
+        series = self._series.get(key)
+        if series is None:
+            series = Series(self._path(key))
+            self._series[key] = series
+        elif series.is_stale():
+            series.refresh()
+        return series
+
+    def append(self, exchange, symbol, timeframe, rows):
+        """Append ccxt-style [timestamp, open, high, low, close, volume] rows.
+
+        Rows are sorted and deduplicated, and anything at or before the last stored
+        candle is dropped so overlapping dumps can be fed repeatedly. Returns the
+        number of rows written.
+        """
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.size == 0:
+            return 0
+        rows = rows.reshape(-1, len(COLUMNS))
+        timestamps = rows[:, 0].astype(np.int64)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, rows = timestamps[order], rows[order]
+        keep = np.ones(len(timestamps), dtype=bool)
+        keep[1:] = timestamps[1:] != timestamps[:-1]
+
+        key = _series_key(exchange, symbol, timeframe)
+        with self._lock:
+            series = self._get_series(key)
+            last = series.last_timestamp
+            if last is not None:
+                keep &= timestamps > last
+            if not keep.any():
+                return 0
+            columns = {'timestamp': timestamps[keep]}
+            for i, name in enumerate(COLUMNS[1:], start=1):
+                columns[name] = rows[keep, i]
+            series.append(columns)
+            return int(keep.sum())
+
+    def import_csv(self, exchange, symbol, timeframe, path, chunk_rows=SEGMENT_ROWS):
+        """Feed a CSV dump (timestamp in ms, open, high, low, close, volume; header optional)"""
+        with open(path) as f:
+            first = f.readline()
+        skip = 0 if first[:1].isdigit() else 1
+        raw = np.loadtxt(path, delimiter=',', skiprows=skip, usecols=range(len(COLUMNS)), ndmin=2)
+        written = 0
+        for start in range(0, len(raw), chunk_rows):
+            written += self.append(exchange, symbol, timeframe, raw[start:start + chunk_rows])
+        logging.info(f'Imported {written} candles for {exchange} {symbol} {timeframe} from {path}')
+        return written
+
+    def read(self, exchange, symbol, timeframe, start_ms=None, end_ms=None):
+        """Columns for candles with start_ms <= timestamp < end_ms as read-only numpy arrays"""
+        key = _series_key(exchange, symbol, timeframe)
+        with self._lock:
+            view = self._get_series(key).view
+        start_row = view.search(start_ms) if start_ms is not None else 0
+        end_row = view.search(end_ms) if end_ms is not None else view.n_rows
+        return view.slice(start_row, end_row)
+
+    def latest(self, exchange, symbol, timeframe, n):
+        """The most recent n candles, for live strategies warming up indicators"""
+        key = _series_key(exchange, symbol, timeframe)
+        with self._lock:
+            view = self._get_series(key).view
+        return view.slice(max(0, view.n_rows - n), view.n_rows)
+
+    def count(self, exchange, symbol, timeframe):
+        with self._lock:
+            return self._get_series(_series_key(exchange, symbol, timeframe)).n_rows
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide store shared by the backtester and live strategies"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = OHLCVStore()
+        return _store
+
+
+if __name__ == '__main__':
+    # python ohlcv_store.py <exchange> <symbol> <timeframe> <file.csv>
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 5:
+        print('usage: python ohlcv_store.py <exchange> <symbol> <timeframe> <file.csv>')
+        sys.exit(1)
+    get_store().import_csv(*sys.argv[1:5])
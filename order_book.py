@@ -0,0 +1,267 @@
+"""L2 order book for the HFT and scalping strategies.
+
+Each side keeps a dict of price -> amount and a sorted list of price keys
+ordered so that the best level is at the end of the list. Most book
+activity happens near the touch, so inserting or removing a level usually
+moves only a few elements. Finding a level is a bisect, updating an existing
+level is a dict write, the best bid/ask is keys[-1], and a top-N snapshot
+slices the last N keys. Nothing is re-sorted per update.
+
+Bids are keyed by price and asks by -price, so both sides share the same
+"largest key is best" layout.
+
+Checksums are computed over the exchange's own price and size strings when
+the feed provides them (BookEvent.raw). Reformatting a float does not give
+the same text back ('41006.8' vs '41006.800000000003').
+"""
+import zlib
+from bisect import bisect_left
+from decimal import Decimal
+
+import numpy as np
+
+
+class _BookSide:
+    __slots__ = ('sign', 'keys', 'levels', 'text')
+
+    def __init__(self, sign):
+        self.sign = sign
+        self.keys = []
+        self.levels = {}
+        # price -> (price text, amount text) as the exchange sent them
+        self.text = {}
+
+    def clear(self):
+        self.keys = []
+        self.levels = {}
+        self.text = {}
+
+    def set(self, price, amount, text=None):
+        levels = self.levels
+        if amount > 0.0:
+            if price not in levels:
+                key = self.sign * price
+                keys = self.keys
+                # fast path: a new best level is appended without a memmove
+                if not keys or key > keys[-1]:
+                    keys.append(key)
+                else:
+                    keys.insert(bisect_left(keys, key), key)
+            levels[price] = amount
+            if text is not None:
+                self.text[price] = text
+            elif self.text:
+                # the amount changed without its text: fall back to formatting it
+                self.text.pop(price, None)
+        elif price in levels:
+            del levels[price]
+            if self.text:
+                self.text.pop(price, None)
+            keys = self.keys
+            key = self.sign * price
+            if keys[-1] == key:
+                keys.pop()
+            else:
+                del keys[bisect_left(keys, key)]
+
+    def best(self):
+        if not self.keys:
+            return None
+        price = self.sign * self.keys[-1]
+        return price, self.levels[price]
+
+    def top(self, n):
+        sign, levels = self.sign, self.levels
+        return [(sign * key, levels[sign * key]) for key in reversed(self.keys[-n:])]
+
+    def top_text(self, n):
+        """Top n levels as (price text, amount text), the exchange's strings where known"""
+        text = self.text
+        return [text.get(price) or (_fmt(price), _fmt(amount)) for price, amount in self.top(n)]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def _fmt(value):
+    """Shortest plain decimal text that round-trips the float ('415', '41006.8', '0.0003')"""
+    text = format(Decimal(repr(float(value))), 'f')
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return text or '0'
+
+
+def _set_levels(side, levels, texts):
+    if texts is None:
+        for price, amount in levels:
+            side.set(price, amount)
+    else:
+        for (price, amount), text in zip(levels, texts):
+            side.set(price, amount, text)
+
+
+class OrderBook:
+    """Level-2 book with sequence-gap and checksum detection.
+
+    After a gap, checksum mismatch or disconnect the book is marked
+    needs_snapshot and further deltas are rejected until apply_snapshot().
+    """
+
+    def __init__(self, exchange, symbol, checksum_depth=25):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.checksum_depth = checksum_depth
+        self.bids = _BookSide(1.0)
+        self.asks = _BookSide(-1.0)
+        self.sequence = None
+        self.timestamp = None
+        self.needs_snapshot = True
+        self.gaps = 0
+        self.checksum_failures = 0
+
+    def apply_snapshot(self, bids, asks, sequence=None, timestamp=None, raw=None):
+        """Replace the book; raw is (bid texts, ask texts) parallel to bids and asks, if known"""
+        self.bids.clear()
+        self.asks.clear()
+        _set_levels(self.bids, bids, raw[0] if raw else None)
+        _set_levels(self.asks, asks, raw[1] if raw else None)
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.needs_snapshot = False
+
+    def apply_delta(self, bids, asks, sequence=None, prev_sequence=None, timestamp=None, raw=None):
+        """Apply level updates (amount 0 removes a level); returns False if the book is out of sync.
+
+        prev_sequence, when the exchange provides it, must equal the last applied
+        sequence. Otherwise a sequence must be strictly increasing, and exactly
+        last + 1 for feeds with contiguous numbering.
+        """
+        if self.needs_snapshot:
+            return False
+        if sequence is not None and self.sequence is not None:
+            if prev_sequence is not None:
+                in_order = prev_sequence == self.sequence
+            else:
+                in_order = sequence > self.sequence
+            if not in_order:
+                if sequence <= self.sequence and prev_sequence is None:
+                    # a replayed/stale delta is harmless; skip it
+                    return True
+                self.invalidate()
+                self.gaps += 1
+                return False
+
+        if raw is None:
+            bid_side, ask_side = self.bids, self.asks
+            for price, amount in bids:
+                bid_side.set(price, amount)
+            for price, amount in asks:
+                ask_side.set(price, amount)
+        else:
+            _set_levels(self.bids, bids, raw[0])
+            _set_levels(self.asks, asks, raw[1])
+        if sequence is not None:
+            self.sequence = sequence
+        if timestamp is not None:
+            self.timestamp = timestamp
+        return True
+
+    def invalidate(self):
+        self.needs_snapshot = True
+
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def mid_price(self):
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return (bid[0] + ask[0]) / 2.0
+
+    def spread(self):
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return ask[0] - bid[0]
+
+    def depth(self, n=10):
+        """Top n (price, amount) levels per side, best first"""
+        return self.bids.top(n), self.asks.top(n)
+
+    def depth_array(self, n=10):
+        """Top n levels as two float64 arrays of shape (<=n, 2)"""
+        bids, asks = self.depth(n)
+        return (np.array(bids, dtype=np.float64).reshape(-1, 2),
+                np.array(asks, dtype=np.float64).reshape(-1, 2))
+
+    def checksum(self, depth=None):
+        """CRC32 (signed) over interleaved top levels, 'bidPx:bidSz:askPx:askSz:...'"""
+        depth = depth or self.checksum_depth
+        bids, asks = self.bids.top_text(depth), self.asks.top_text(depth)
+        parts = []
+        for i in range(max(len(bids), len(asks))):
+            if i < len(bids):
+                parts.append(':'.join(bids[i]))
+            if i < len(asks):
+                parts.append(':'.join(asks[i]))
+        crc = zlib.crc32(':'.join(parts).encode())
+        return crc - (1 << 32) if crc >= (1 << 31) else crc
+
+    def verify_checksum(self, expected):
+        if expected is None:
+            return True
+        if self.checksum() == int(expected):
+            return True
+        self.checksum_failures += 1
+        self.invalidate()
+        return False
+
+    def matches_snapshot(self, bids, asks, depth=None):
+        """Compare our top levels against a freshly fetched exchange snapshot"""
+        depth = depth or min(len(bids), len(asks), self.checksum_depth)
+        ours_bids, ours_asks = self.depth(depth)
+        theirs_bids = sorted(((float(p), float(a)) for p, a in bids if float(a) > 0), reverse=True)[:depth]
+        theirs_asks = sorted((float(p), float(a)) for p, a in asks if float(a) > 0)[:depth]
+        return ours_bids == theirs_bids and ours_asks == theirs_asks
+
+
+class OrderBookManager:
+    """Maintains books per (exchange, symbol) from market_data BookEvent/StatusEvent records.
+
+    arbitrage_scanner.ArbitrageService keeps one on the bot supervisor's hub.
+    """
+
+    def __init__(self, checksum_exchanges=('okx',)):
+        self.books = {}
+        self.checksum_exchanges = set(checksum_exchanges)
+
+    def get(self, exchange, symbol):
+        key = (exchange, symbol)
+        book = self.books.get(key)
+        if book is None:
+            book = self.books[key] = OrderBook(exchange, symbol)
+        return book
+
+    def on_event(self, event):
+        """Apply one event; returns the affected book, or None for events it ignores"""
+        if hasattr(event, 'status'):
+            if event.status != 'connected':
+                for (exchange, _), book in self.books.items():
+                    if exchange == event.exchange:
+                        book.invalidate()
+            return None
+        if not hasattr(event, 'bids'):
+            return None
+
+        book = self.get(event.exchange, event.symbol)
+        if event.snapshot:
+            book.apply_snapshot(event.bids, event.asks, event.sequence, event.timestamp, raw=event.raw)
+        elif not book.apply_delta(event.bids, event.asks, event.sequence, timestamp=event.timestamp,
+                                  raw=event.raw):
+            return book
+        if event.exchange in self.checksum_exchanges:
+            book.verify_checksum(event.checksum)
+        return book
@@ -0,0 +1,392 @@
+"""Parameter sweeps: many backtests of one strategy over a grid or random sample of knobs.
+
+Sweeps are too long for a web request. The /backtesting/sweep view only
+validates the grid and queues a SweepJob; a job runner claims queued jobs
+and runs them on a process pool. The runner is `python parameter_sweep.py`
+in production (Procfile `sweeps`) or a thread in the web process when
+RUN_BACKGROUND_JOBS is on. Pool workers are spawned, not forked, so a
+threaded parent is never copied mid-lock.
+
+A claimed job holds a lease that its runner renews while it works. If the
+runner dies, the lease runs out and another runner claims the job again,
+up to SWEEP_MAX_ATTEMPTS times before it is marked failed.
+"""
+import os
+import json
+import time
+import logging
+import itertools
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtester import MarketData, DEFAULT_PARAMETERS, load_ohlcv, run_backtest
+
+# BotConfig knobs that can be swept
+SWEEP_PARAMETERS = ('arb_profit_threshold', 'ml_confidence_threshold', 'rebalance_frequency')
+
+# the knobs each strategy reads; sweeping the others would only repeat identical runs
+STRATEGY_PARAMETERS = {
+    'hft': ('arb_profit_threshold',),
+    'scalping': ('arb_profit_threshold',),
+    'arbitrage': ('arb_profit_threshold',),
+    'ml_prediction': ('ml_confidence_threshold',),
+    'portfolio_optimization': ('rebalance_frequency',),
+}
+
+MAX_SWEEP_RUNS = int(os.environ.get('SWEEP_MAX_RUNS', 1000))
+SWEEP_POLL_INTERVAL = float(os.environ.get('SWEEP_POLL_INTERVAL', 5))
+SWEEP_LEASE_SECONDS = float(os.environ.get('SWEEP_LEASE_SECONDS', 120))
+SWEEP_MAX_ATTEMPTS = 3
+
+INSERT_BATCH_SIZE = 500
+
+# Per-worker state, populated once by _init_worker
+_worker_data = None
+_worker_segments = None
+
+
+def grid_search(ranges, names=SWEEP_PARAMETERS):
+    """Cartesian product of {name: (low, high, steps)} ranges as a list of parameter dicts"""
+    axes = []
+    for name in names:
+        low, high, steps = ranges[name]
+        values = np.linspace(low, high, max(1, int(steps)))
+        if name == 'rebalance_frequency':
+            values = np.unique(values.round().astype(int))
+        axes.append([v.item() for v in values])
+    return [dict(zip(names, combo)) for combo in itertools.product(*axes)]
+
+
+def random_search(ranges, n_samples, seed=None, names=SWEEP_PARAMETERS):
+    """Uniformly sample n_samples parameter dicts from {name: (low, high, ...)} ranges"""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name in names:
+        low, high = ranges[name][0], ranges[name][1]
+        if name == 'rebalance_frequency':
+            columns[name] = rng.integers(int(low), int(high) + 1, size=n_samples)
+        else:
+            columns[name] = rng.uniform(low, high, size=n_samples)
+    return [{name: columns[name][i].item() for name in names}
+            for i in range(n_samples)]
+
+
+def plan_sweep(strategy, ranges, mode='grid', n_samples=50, seed=None):
+    """Parameter sets over the knobs strategy reads; ValueError past MAX_SWEEP_RUNS"""
+    names = STRATEGY_PARAMETERS.get(strategy, SWEEP_PARAMETERS)
+    if mode == 'grid':
+        parameter_sets = grid_search(ranges, names)
+    elif mode == 'random':
+        parameter_sets = random_search(ranges, n_samples, seed=seed, names=names)
+    else:
+        raise ValueError(f'Unknown sweep mode: {mode}')
+    if len(parameter_sets) > MAX_SWEEP_RUNS:
+        raise ValueError(f'Sweep of {len(parameter_sets)} backtests exceeds the limit of {MAX_SWEEP_RUNS}')
+    return parameter_sets
+
+
+class SharedMarketData:
+    """Copies MarketData into shared memory once so pool workers can map it without pickling"""
+
+    def __init__(self, data):
+        self.pairs = data.pairs
+        self.timeframe = data.timeframe
+        self.shape = data.close.shape
+
+        self._ohlcv = shared_memory.SharedMemory(create=True, size=5 * data.close.nbytes)
+        self._timestamps = shared_memory.SharedMemory(create=True, size=data.timestamps.nbytes)
+
+        ohlcv = np.ndarray((5,) + self.shape, dtype=np.float64, buffer=self._ohlcv.buf)
+        for i, column in enumerate((data.open, data.high, data.low, data.close, data.volume)):
+            ohlcv[i] = column
+        timestamps = np.ndarray(self.shape[:1], dtype=np.int64, buffer=self._timestamps.buf)
+        timestamps[:] = data.timestamps
+
+    def descriptor(self):
+        """Small picklable handle passed to each worker once"""
+        return (self._ohlcv.name, self._timestamps.name, self.shape, self.pairs, self.timeframe)
+
+    def release(self):
+        self._ohlcv.close()
+        self._ohlcv.unlink()
+        self._timestamps.close()
+        self._timestamps.unlink()
+
+
+def attach_market_data(descriptor):
+    """Map a SharedMarketData descriptor back to zero-copy MarketData views"""
+    ohlcv_name, timestamps_name, shape, pairs, timeframe = descriptor
+    ohlcv_shm = shared_memory.SharedMemory(name=ohlcv_name)
+    timestamps_shm = shared_memory.SharedMemory(name=timestamps_name)
+
+    ohlcv = np.ndarray((5,) + tuple(shape), dtype=np.float64, buffer=ohlcv_shm.buf)
+    timestamps = np.ndarray(tuple(shape)[:1], dtype=np.int64, buffer=timestamps_shm.buf)
+    data = MarketData(pairs, timestamps, ohlcv[0], ohlcv[1], ohlcv[2], ohlcv[3], ohlcv[4],
+                      timeframe=timeframe)
+    return data, (ohlcv_shm, timestamps_shm)
+
+
+def _init_worker(descriptor):
+    global _worker_data, _worker_segments
+    _worker_data, _worker_segments = attach_market_data(descriptor)
+
+
+def _run_job(job):
+    strategy, initial_capital, params = job
+    summary = run_backtest(_worker_data, strategy, initial_capital, params)
+    # the equity curve stays in the worker; only the scalars travel back
+    summary.pop('equity')
+    return summary
+
+
+def run_sweep(data, strategy, initial_capital, parameter_sets, base_parameters=None, max_workers=None):
+    """Backtest every parameter set across a process pool sharing one copy of the data"""
+    base = dict(DEFAULT_PARAMETERS)
+    base.update(base_parameters or {})
+    jobs = []
+    for params in parameter_sets:
+        merged = dict(base)
+        merged.update(params)
+        jobs.append((strategy, initial_capital, merged))
+    if not jobs:
+        return []
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (max_workers * 4))
+
+    shared = SharedMarketData(data)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(shared.descriptor(),),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            return list(executor.map(_run_job, jobs, chunksize=chunksize))
+    finally:
+        shared.release()
+
+
+def save_results(name, summaries, user_id):
+    """Bulk insert sweep summaries into BacktestResult in batches"""
+    from app import db
+    from models import BacktestResult
+
+    rows = [{
+        'name': f'{name} #{i + 1}',
+        'strategy': summary['strategy'],
+        'pairs': json.dumps(summary['pairs']),
+        'start_date': summary['start_date'],
+        'end_date': summary['end_date'],
+        'initial_capital': summary['initial_capital'],
+        'final_capital': summary['final_capital'],
+        'total_return': summary['total_return'],
+        'sharpe_ratio': summary['sharpe_ratio'],
+        'max_drawdown': summary['max_drawdown'],
+        'win_rate': summary['win_rate'],
+        'parameters': json.dumps(summary['parameters']),
+        'user_id': user_id,
+    } for i, summary in enumerate(summaries)]
+
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(db.insert(BacktestResult), rows[start:start + INSERT_BATCH_SIZE])
+    db.session.commit()
+    return len(rows)
+
+
+def run_and_save_sweep(name, strategy, pairs, days_back, initial_capital, user_id,
+                       ranges, mode='grid', n_samples=50, seed=None):
+    """Load data once, sweep the BotConfig knobs and persist every result; returns the best"""
+    parameter_sets = plan_sweep(strategy, ranges, mode, n_samples, seed=seed)
+
+    data = load_ohlcv(pairs, days_back, timeframe=DEFAULT_PARAMETERS['timeframe'])
+    summaries = run_sweep(data, strategy, initial_capital, parameter_sets)
+    save_results(name, summaries, user_id)
+    logging.info(f"Parameter sweep '{name}' finished: {len(summaries)} backtests")
+
+    return max(summaries, key=lambda s: s['sharpe_ratio'])
+
+
+def submit_sweep(name, strategy, pairs, days_back, initial_capital, user_id,
+                 ranges, mode='grid', n_samples=50):
+    """Validate the sweep and queue it as a SweepJob; returns the job"""
+    from app import app, db
+    from models import SweepJob
+
+    parameter_sets = plan_sweep(strategy, ranges, mode, n_samples)
+    job = SweepJob(name=name, strategy=strategy, pairs=pairs, days_back=days_back,
+                   initial_capital=initial_capital, mode=mode, n_samples=n_samples,
+                   ranges=json.dumps(ranges), total_runs=len(parameter_sets), user_id=user_id)
+    db.session.add(job)
+    db.session.commit()
+    if app.config.get('RUN_BACKGROUND_JOBS', True):
+        get_sweep_runner().wake()
+    return job
+
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'name': job.name,
+        'strategy': job.strategy,
+        'mode': job.mode,
+        'total_runs': job.total_runs,
+        'status': job.status,
+        'best': job.get_best() or None,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def claim_next_job():
+    """Lease the oldest queued (or abandoned running) job and return it, or None; safe with several runners"""
+    from app import db
+    from models import SweepJob
+
+    while True:
+        now = datetime.utcnow()
+        # running jobs from before leases existed have none and count as abandoned
+        claimable = db.or_(SweepJob.status == 'queued',
+                           db.and_(SweepJob.status == 'running',
+                                   db.or_(SweepJob.lease_expires_at.is_(None),
+                                          SweepJob.lease_expires_at < now)))
+        job_id = db.session.query(SweepJob.id).filter(claimable) \
+            .order_by(SweepJob.id).limit(1).scalar()
+        if job_id is None:
+            return None
+        claimed = db.session.execute(
+            db.update(SweepJob).where(SweepJob.id == job_id, claimable)
+            .values(status='running', started_at=now,
+                    lease_expires_at=now + timedelta(seconds=SWEEP_LEASE_SECONDS),
+                    attempts=db.func.coalesce(SweepJob.attempts, 0) + 1)).rowcount
+        db.session.commit()
+        if not claimed:
+            continue
+        job = db.session.get(SweepJob, job_id)
+        if job.attempts > SWEEP_MAX_ATTEMPTS:
+            logging.error(f'Parameter sweep job {job.id} abandoned {job.attempts - 1} times; giving up')
+            job.status = 'failed'
+            job.error = f'Runner stopped during the sweep {job.attempts - 1} times'
+            job.finished_at = now
+            db.session.commit()
+            continue
+        if job.attempts > 1:
+            logging.warning(f'Parameter sweep job {job.id} reclaimed after its lease expired')
+        return job
+
+
+def _renew_lease(app, job_id, stopped):
+    """Push the job's lease forward every third of its length until stopped is set"""
+    from app import db
+    from models import SweepJob
+
+    while not stopped.wait(SWEEP_LEASE_SECONDS / 3):
+        try:
+            with app.app_context():
+                db.session.execute(
+                    db.update(SweepJob).where(SweepJob.id == job_id, SweepJob.status == 'running')
+                    .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=SWEEP_LEASE_SECONDS)))
+                db.session.commit()
+        except Exception:
+            logging.exception(f'Renewing the lease of sweep job {job_id} failed')
+
+
+def run_job(job):
+    """Run a claimed job, renewing its lease meanwhile, and record its outcome on the row"""
+    from app import app, db
+
+    stopped = threading.Event()
+    heartbeat = threading.Thread(target=_renew_lease, args=(app, job.id, stopped),
+                                 name=f'sweep-lease-{job.id}', daemon=True)
+    heartbeat.start()
+    try:
+        best = run_and_save_sweep(job.name, job.strategy, job.pairs, job.days_back,
+                                  job.initial_capital, job.user_id, job.get_ranges(),
+                                  mode=job.mode, n_samples=job.n_samples or 50)
+        job.status = 'completed'
+        job.best = json.dumps({key: best[key] for key in
+                               ('total_return', 'sharpe_ratio', 'max_drawdown', 'win_rate', 'parameters')})
+    except Exception as e:
+        logging.exception(f'Parameter sweep job {job.id} failed')
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(e)
+    finally:
+        stopped.set()
+        heartbeat.join()
+    job.finished_at = datetime.utcnow()
+    job.lease_expires_at = None
+    db.session.commit()
+
+
+def run_pending():
+    """Run queued jobs until none are left; returns how many ran"""
+    count = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
+
+
+class SweepRunner:
+    """Thread that runs queued sweeps one at a time, woken on submit or every poll_interval"""
+
+    def __init__(self, app, poll_interval=SWEEP_POLL_INTERVAL):
+        self.app = app
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sweep-runner', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                with self.app.app_context():
+                    run_pending()
+            except Exception:
+                logging.exception('Sweep runner failed')
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_sweep_runner():
+    """In-process runner for deployments without the sweeps daemon"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            from app import app
+            _runner = SweepRunner(app)
+        return _runner
+
+
+if __name__ == '__main__':
+    # python parameter_sweep.py: the sweep job runner as its own process
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    while True:
+        try:
+            with app.app_context():
+                run_pending()
+        except Exception:
+            logging.exception('Sweep runner failed')
+        time.sleep(SWEEP_POLL_INTERVAL)
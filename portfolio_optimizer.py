@@ -0,0 +1,383 @@
+"""Mean-variance portfolio optimization for portfolio_active bot configs.
+
+There is one covariance matrix for the union of every user's pairs (the
+universe). It is kept by RollingCovariance, which adds new return rows and
+subtracts the rows that fall out of the window, so a rebalance only costs the
+bars added since the last one. Each user's asset set is a mask over the
+universe. The users' sub-matrices are gathered into one padded (users, k, k)
+stack, k being the largest set, and solved by a single batched
+np.linalg.solve. Long-only portfolios drop assets with negative weight and
+re-solve on the remaining ones, at most k passes.
+"""
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from backtester import (DEFAULT_EXCHANGE, TIMEFRAME_SECONDS, SECONDS_PER_YEAR,
+                        parse_pairs, align_ohlcv)
+
+OBJECTIVES = ('max_sharpe', 'min_variance')
+
+DEFAULT_TIMEFRAME = '1h'
+DEFAULT_WINDOW = 720
+
+
+class RollingCovariance:
+    """Sample mean and covariance over the last window return rows.
+
+    Keeps the running sum and cross-product matrix, so adding k rows costs
+    O(k * n^2) however long the window is. These sums are rebuilt from the
+    ring buffer every window rows to stop floating-point drift.
+    """
+
+    def __init__(self, n_assets, window):
+        self.n_assets = n_assets
+        self.window = window
+        self._buffer = np.zeros((window, n_assets))
+        self._pos = 0
+        self.count = 0
+        self._sum = np.zeros(n_assets)
+        self._cross = np.zeros((n_assets, n_assets))
+        self._since_rebuild = 0
+
+    def _rebuild(self):
+        rows = self.rows()
+        self._sum = rows.sum(axis=0)
+        self._cross = rows.T @ rows
+        self._since_rebuild = 0
+
+    def update(self, returns):
+        """Add return rows of shape (k, n_assets), oldest first"""
+        returns = np.asarray(returns, dtype=np.float64).reshape(-1, self.n_assets)
+        k = returns.shape[0]
+        if k == 0:
+            return
+        if k >= self.window:
+            self._buffer[:] = returns[-self.window:]
+            self._pos = 0
+            self.count = self.window
+            self._rebuild()
+            return
+
+        n_out = max(0, self.count + k - self.window)
+        if n_out:
+            oldest = (self._pos - self.count + np.arange(n_out)) % self.window
+            outgoing = self._buffer[oldest]
+            self._sum -= outgoing.sum(axis=0)
+            self._cross -= outgoing.T @ outgoing
+        slots = (self._pos + np.arange(k)) % self.window
+        self._buffer[slots] = returns
+        self._sum += returns.sum(axis=0)
+        self._cross += returns.T @ returns
+        self._pos = (self._pos + k) % self.window
+        self.count = min(self.window, self.count + k)
+
+        self._since_rebuild += k
+        if self._since_rebuild >= self.window:
+            self._rebuild()
+
+    def rows(self):
+        """Buffered return rows, oldest first"""
+        if self.count < self.window:
+            return self._buffer[:self.count]
+        return np.roll(self._buffer, -self._pos, axis=0)
+
+    def mean(self):
+        return self._sum / max(self.count, 1)
+
+    def covariance(self):
+        if self.count < 2:
+            return np.zeros((self.n_assets, self.n_assets))
+        mean = self.mean()
+        return (self._cross - self.count * np.outer(mean, mean)) / (self.count - 1)
+
+
+def shrink(cov, shrinkage):
+    """Blend a covariance (or a stack of them) toward its scaled identity"""
+    if not shrinkage:
+        return cov
+    n = cov.shape[-1]
+    target = np.trace(cov, axis1=-2, axis2=-1)[..., None, None] / n * np.eye(n)
+    return (1.0 - shrinkage) * cov + shrinkage * target
+
+
+def _masked_solve(cov, rhs, active):
+    """Solve cov[active, active] x = rhs[active] for every row of a batch at once"""
+    n = cov.shape[-1]
+    both = active[:, :, None] & active[:, None, :]
+    system = np.where(both, cov, 0.0)
+    diagonal = np.arange(n)
+    system[:, diagonal, diagonal] += ~active
+    x = np.linalg.solve(system, np.where(active, rhs, 0.0)[..., None])[..., 0]
+    return np.where(active, x, 0.0)
+
+
+def optimize_weights(mu, cov, active=None, objective='max_sharpe', long_only=True,
+                     previous=None, max_turnover=None):
+    """Optimal weights for a batch of portfolios.
+
+    mu is (B, n) expected returns per bar and cov is (n, n) or (B, n, n).
+    active is a (B, n) mask of the assets each portfolio may hold; each
+    portfolio is solved over only its own assets. Weights sum to 1. With max_turnover, the move away from the
+    previous weights is shortened so that sum |w - previous| <= max_turnover.
+    """
+    mu = np.atleast_2d(np.asarray(mu, dtype=np.float64))
+    batch, n = mu.shape
+    cov = np.broadcast_to(np.asarray(cov, dtype=np.float64), (batch, n, n))
+    universe = np.ones((batch, n), dtype=bool) if active is None else np.asarray(active, dtype=bool)
+    if objective not in OBJECTIVES:
+        raise ValueError(f'Unknown objective {objective!r}')
+
+    # gather each portfolio's assets to the front of a (B, k, k) system, k = largest set
+    counts = universe.sum(axis=1)
+    k = max(int(counts.max()), 1)
+    order = np.argsort(~universe, axis=1, kind='stable')[:, :k]
+    rows = np.arange(batch)[:, None]
+    sub_mu = mu[rows, order]
+    sub_cov = cov[rows[:, :, None], order[:, :, None], order[:, None, :]]
+
+    # max Sharpe: w ~ cov^-1 mu (tangency); min variance: w ~ cov^-1 1
+    rhs = sub_mu if objective == 'max_sharpe' else np.ones_like(sub_mu)
+    active = np.arange(k) < counts[:, None]
+    raw = _masked_solve(sub_cov, rhs, active)
+    pending = np.arange(batch)
+    for _ in range(k if long_only else 0):
+        dropped = active[pending] & (raw[pending] <= 0.0)
+        pending = pending[dropped.any(axis=1)]
+        if not len(pending):
+            break
+        active[pending] &= ~dropped[dropped.any(axis=1)]
+        raw[pending] = _masked_solve(sub_cov[pending], rhs[pending], active[pending])
+
+    total = raw.sum(axis=1)
+    valid = (total > 0.0) & active.any(axis=1)
+    weights = np.zeros((batch, n))
+    weights[rows, order] = np.where(active, raw, 0.0) / np.where(valid, total, 1.0)[:, None]
+    weights[~valid] = 0.0
+    if not valid.all():
+        # no asset with positive expected excess return: fall back to minimum variance
+        if objective == 'max_sharpe':
+            weights[~valid] = optimize_weights(mu[~valid], cov[~valid], universe[~valid],
+                                               'min_variance', long_only)
+        else:
+            counts = universe[~valid].sum(axis=1, keepdims=True)
+            weights[~valid] = universe[~valid] / np.maximum(counts, 1)
+
+    if max_turnover is not None and previous is not None:
+        previous = np.broadcast_to(np.asarray(previous, dtype=np.float64), weights.shape)
+        turnover = np.abs(weights - previous).sum(axis=1)
+        step = np.ones(batch)
+        has_position = previous.sum(axis=1) > 0.0
+        over = has_position & (turnover > max_turnover)
+        step[over] = max_turnover / turnover[over]
+        weights = previous + step[:, None] * (weights - previous)
+    return weights
+
+
+def portfolio_statistics(weights, mu, cov, bar_seconds):
+    """Annualized (expected_return, volatility, sharpe) arrays for a batch of weights"""
+    weights = np.atleast_2d(weights)
+    periods = SECONDS_PER_YEAR / bar_seconds
+    expected = (weights * np.atleast_2d(mu)).sum(axis=1) * periods
+    cov = np.broadcast_to(cov, (weights.shape[0],) + cov.shape[-2:])
+    variance = np.einsum('bi,bij,bj->b', weights, cov, weights)
+    volatility = np.sqrt(np.maximum(variance, 0.0) * periods)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(volatility > 0.0, expected / volatility, 0.0)
+    return expected, volatility, sharpe
+
+
+def base_asset(pair):
+    return pair.split('/')[0]
+
+
+class PortfolioOptimizer:
+    """Universe-wide rolling statistics from the candle store plus batch optimization"""
+
+    def __init__(self, exchange=None, timeframe=DEFAULT_TIMEFRAME, window=DEFAULT_WINDOW,
+                 objective='max_sharpe', long_only=True, max_turnover=None, shrinkage=0.1,
+                 store=None):
+        self.exchange = exchange or DEFAULT_EXCHANGE
+        self.timeframe = timeframe
+        self.window = window
+        self.objective = objective
+        self.long_only = long_only
+        self.max_turnover = max_turnover
+        self.shrinkage = shrinkage
+        self.store = store
+        self.universe = []
+        self.stats = None
+        self._last_timestamp = None
+        self._last_close = None
+        # guards the rolling statistics; solving and saving work on copies outside it
+        self._lock = threading.Lock()
+
+    def _store(self):
+        if self.store is None:
+            from ohlcv_store import get_store
+            self.store = get_store()
+        return self.store
+
+    def _load(self, pairs, start_ms=None):
+        store = self._store()
+        if start_ms is None:
+            frames = [store.latest(self.exchange, pair, self.timeframe, self.window + 1)
+                      for pair in pairs]
+        else:
+            frames = [store.read(self.exchange, pair, self.timeframe, start_ms=start_ms)
+                      for pair in pairs]
+        if any(len(frame['timestamp']) == 0 for frame in frames):
+            return None
+        try:
+            return align_ohlcv(pairs, frames, timeframe=self.timeframe)
+        except ValueError:
+            return None
+
+    def _load_available(self, pairs):
+        """Latest window bars for the pairs that have candles; pairs without any are dropped"""
+        store = self._store()
+        kept, frames = [], []
+        for pair in pairs:
+            frame = store.latest(self.exchange, pair, self.timeframe, self.window + 1)
+            if len(frame['timestamp']) >= 2:
+                kept.append(pair)
+                frames.append(frame)
+            else:
+                logging.warning(f'No {self.timeframe} candles for {pair}; left out of the portfolio universe')
+        if not kept:
+            return None
+        try:
+            return align_ohlcv(kept, frames, timeframe=self.timeframe)
+        except ValueError:
+            return None
+
+    def sync(self, pairs):
+        """Bring the rolling statistics up to date for the universe of pairs.
+
+        The universe is exactly the pairs given, less those with no candles.
+        A universe change (or a previously dropped pair) rebuilds from the
+        last window bars. Otherwise only the candles newer than the last
+        synced one are read and applied. State is only replaced after a
+        successful load, so a failed rebuild leaves the previous one usable.
+        """
+        pairs = sorted(set(parse_pairs(pairs)))
+        if pairs != self.universe or self.stats is None:
+            data = self._load_available(pairs)
+            if data is None:
+                raise ValueError('Not enough overlapping candles for the portfolio universe')
+            close = data.close
+            stats = RollingCovariance(len(data.pairs), self.window)
+            stats.update(close[1:] / close[:-1] - 1.0)
+            self.universe = list(data.pairs)
+            self.stats = stats
+            n_bars = data.n_bars
+        else:
+            data = self._load(pairs, start_ms=self._last_timestamp + 1)
+            if data is None:
+                return 0
+            close = np.vstack([self._last_close, data.close])
+            self.stats.update(close[1:] / close[:-1] - 1.0)
+            n_bars = data.n_bars
+        self._last_timestamp = int(data.timestamps[-1])
+        self._last_close = data.close[-1].copy()
+        return n_bars
+
+    def statistics(self, pairs=None):
+        """(universe, mean, shrunk covariance) as copies, after syncing to pairs if given.
+
+        Only this step takes the optimizer's lock, so concurrent rebalances
+        share the incremental statistics and solve and save in parallel.
+        """
+        with self._lock:
+            if pairs is not None:
+                self.sync(pairs)
+            return (list(self.universe), self.stats.mean(),
+                    shrink(self.stats.covariance(), self.shrinkage))
+
+    def optimize(self, pair_sets, previous=None, statistics=None):
+        """Weights over the universe for each set of pairs, solved as one batch"""
+        universe, mean, cov = statistics or self.statistics()
+        index = {pair: i for i, pair in enumerate(universe)}
+        active = np.zeros((len(pair_sets), len(universe)), dtype=bool)
+        for row, pairs in enumerate(pair_sets):
+            active[row, [index[pair] for pair in parse_pairs(pairs) if pair in index]] = True
+
+        mu = np.broadcast_to(mean, active.shape)
+        weights = optimize_weights(mu, cov, active, self.objective, self.long_only,
+                                   previous, self.max_turnover)
+        expected, volatility, sharpe = portfolio_statistics(
+            weights, mean, cov, TIMEFRAME_SECONDS[self.timeframe])
+        return weights, expected, volatility, sharpe
+
+    def rebalance(self, configs, universe=None):
+        """Optimize every user's portfolio_active configs in one pass and save snapshots.
+
+        A user's pairs are the union over their active configs. universe is
+        the pairs of every current portfolio config (default: those of
+        configs); pairs without candles are left out, and users left with
+        none are skipped. Weights are
+        stored by base asset, the same keys the valuation engine uses for
+        current holdings, so the latest snapshot of either kind is the
+        previous allocation for the turnover limit.
+        """
+        from app import db
+        from models import PortfolioSnapshot
+        from portfolio_valuation import get_valuation_engine
+
+        pairs_by_user = {}
+        for config in configs:
+            pairs_by_user.setdefault(config.user_id, set()).update(parse_pairs(config.get_pairs()))
+        if not pairs_by_user:
+            return []
+
+        statistics = self.statistics(set().union(*pairs_by_user.values()) if universe is None
+                                     else set(universe) | set().union(*pairs_by_user.values()))
+        universe = statistics[0]
+        available = set(universe)
+        user_ids = [user_id for user_id, pairs in pairs_by_user.items() if pairs & available]
+        if len(user_ids) < len(pairs_by_user):
+            logging.warning(f'Skipped {len(pairs_by_user) - len(user_ids)} portfolios with no candles')
+        if not user_ids:
+            return []
+        pair_sets = [sorted(pairs_by_user[user_id] & available) for user_id in user_ids]
+
+        previous = np.zeros((len(user_ids), len(universe)))
+        if self.max_turnover is not None:
+            for row, user_id in enumerate(user_ids):
+                last = PortfolioSnapshot.query.filter_by(user_id=user_id).order_by(
+                    PortfolioSnapshot.timestamp.desc()).first()
+                if last is not None:
+                    held = last.get_weights()
+                    for col, pair in enumerate(universe):
+                        previous[row, col] = held.get(base_asset(pair), 0.0)
+
+        weights, expected, volatility, sharpe = self.optimize(pair_sets, previous, statistics)
+
+        engine = get_valuation_engine()
+        now = datetime.utcnow()
+        snapshots = []
+        for row, user_id in enumerate(user_ids):
+            summary = engine.summary(user_id)
+            target = {}
+            for col in np.flatnonzero(weights[row] > 1e-9):
+                asset = base_asset(universe[col])
+                target[asset] = target.get(asset, 0.0) + float(weights[row, col])
+            snapshot = PortfolioSnapshot(total_value_usd=summary['total_value'],
+                                         sharpe_ratio=float(sharpe[row]),
+                                         volatility=float(volatility[row]),
+                                         timestamp=now, user_id=user_id)
+            snapshot.set_assets({p['symbol']: p['quantity'] for p in summary['positions']})
+            snapshot.set_weights(target)
+            snapshots.append(snapshot)
+
+        db.session.add_all(snapshots)
+        db.session.commit()
+        logging.info(f'Rebalanced {len(snapshots)} portfolios over {len(universe)} pairs')
+        return snapshots
+
+
+def active_portfolio_configs():
+    from models import BotConfig
+    return BotConfig.query.filter_by(is_active=True, portfolio_active=True).all()
@@ -0,0 +1,560 @@
+"""Incremental per-user portfolio valuation.
+
+A user's holdings are aggregated from Trade, Deposit and Withdrawal rows
+once, with GROUP BY, the first time the user is seen. After that, only
+rows with ids above a high-water mark are applied, so the cost is the number
+of new rows and not the history. Transfers still in flight when they pass
+the mark are kept in a pending set and re-read on each catch-up until they
+complete or fail. A price tick changes the value of every user holding the
+asset by qty * (new - old), with no re-summing.
+
+Marks come from the live feed: PricePublisher runs on the bot supervisor's
+market data hub and writes the latest stablecoin-quoted price per asset to
+AssetPrice, and every process's engine reads the changed rows on catch-up.
+
+Queries run outside the state lock, so a catch-up or a first load never
+blocks summaries of users that are already loaded. summary() returns a
+cached dict and rebuilds it only after the user's holdings or marks change.
+snapshot_all() writes PortfolioSnapshot rows and is run periodically by
+start_snapshots().
+"""
+import os
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+STABLECOINS = ('USDT', 'USDC', 'USD', 'BUSD', 'DAI', 'TUSD')
+COUNTED_TRADE_STATUSES = ('filled', 'closed', 'completed')
+COUNTED_TRANSFER_STATUSES = ('completed', 'confirmed')
+# transfers in these states will never be counted and are not watched
+FAILED_TRANSFER_STATUSES = ('failed', 'cancelled', 'canceled', 'rejected', 'expired')
+
+# trades written by other processes are picked up at most this often per summary()
+CATCH_UP_INTERVAL = 2.0
+SNAPSHOT_INTERVAL = int(os.environ.get('PORTFOLIO_SNAPSHOT_INTERVAL', 300))
+PRICE_PUBLISH_INTERVAL = float(os.environ.get('PRICE_PUBLISH_INTERVAL', 2.0))
+
+
+def split_symbol(symbol):
+    base, _, quote = symbol.partition('/')
+    return base.upper(), quote.upper()
+
+
+def _watched(status):
+    return status not in COUNTED_TRANSFER_STATUSES and status not in FAILED_TRANSFER_STATUSES
+
+
+def stablecoin_mark(event):
+    """(asset, USD price) from a market_data TradeEvent quoted in a stablecoin, else None"""
+    symbol = getattr(event, 'symbol', None)
+    price = getattr(event, 'price', None)
+    if symbol is None or price is None:
+        return None
+    base, quote = split_symbol(symbol)
+    if quote not in STABLECOINS or base in STABLECOINS:
+        return None
+    return base, price
+
+
+class _UserPortfolio:
+    __slots__ = ('holdings', 'value', 'history', 'summary')
+
+    def __init__(self):
+        self.holdings = {}
+        self.value = 0.0
+        # (timestamp, value) samples taken at snapshot time, for the 24h change
+        self.history = deque()
+        self.summary = None
+
+
+class ValuationEngine:
+    """Positions and mark-to-market values for every loaded user.
+
+    _lock guards the in-memory state and is only held while applying rows
+    or building a summary. _query_lock serializes catch-ups and user loads,
+    which read the database and must agree on the high-water marks.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.RLock()
+        self._query_lock = threading.Lock()
+        self._users = {}
+        self._holders = {}
+        self.prices = {asset: 1.0 for asset in STABLECOINS}
+        self._price_history = {}
+        self._prices_seen = None
+        self._trade_hwm = 0
+        self._deposit_hwm = 0
+        self._withdrawal_hwm = 0
+        # transfer id -> user id for rows at or below the marks that may still be counted
+        self._pending = {'deposit': {}, 'withdrawal': {}}
+        self._last_catch_up = None
+        self._catch_up_requested = False
+        self._snapshot_timer = None
+
+    # -- holdings ------------------------------------------------------------
+
+    def _adjust(self, user_id, asset, delta):
+        portfolio = self._users.get(user_id)
+        if portfolio is None or not delta:
+            return
+        holdings = portfolio.holdings
+        qty = holdings.get(asset, 0.0) + delta
+        if abs(qty) < 1e-12:
+            holdings.pop(asset, None)
+            holders = self._holders.get(asset)
+            if holders is not None:
+                holders.discard(user_id)
+        else:
+            holdings[asset] = qty
+            self._holders.setdefault(asset, set()).add(user_id)
+        portfolio.value += delta * self.prices.get(asset, 0.0)
+        portfolio.summary = None
+
+    def apply_trade(self, user_id, symbol, side, quantity, cost, fee=None):
+        base, quote = split_symbol(symbol)
+        fee = fee or 0.0
+        if side == 'buy':
+            self._adjust(user_id, base, quantity)
+            self._adjust(user_id, quote, -(cost + fee))
+        else:
+            self._adjust(user_id, base, -quantity)
+            self._adjust(user_id, quote, cost - fee)
+
+    def apply_deposit(self, user_id, asset, amount):
+        self._adjust(user_id, asset.upper(), amount)
+
+    def apply_withdrawal(self, user_id, asset, amount, fee=None):
+        self._adjust(user_id, asset.upper(), -(amount + (fee or 0.0)))
+
+    def _apply_transfer(self, name, row):
+        if name == 'deposit':
+            self.apply_deposit(row.user_id, row.asset, row.amount)
+        else:
+            self.apply_withdrawal(row.user_id, row.asset, row.amount, row.fee)
+
+    # -- prices --------------------------------------------------------------
+
+    def set_price(self, asset, price):
+        """Mark an asset to a new USD price, updating holders' values by the delta"""
+        with self._lock:
+            old = self.prices.get(asset, 0.0)
+            if price == old:
+                return
+            self.prices[asset] = price
+            delta = price - old
+            for user_id in self._holders.get(asset, ()):
+                portfolio = self._users[user_id]
+                portfolio.value += portfolio.holdings[asset] * delta
+                portfolio.summary = None
+
+    def _read_prices(self):
+        """AssetPrice rows published since the last read, as (asset, price)"""
+        from models import AssetPrice
+
+        query = AssetPrice.query
+        if self._prices_seen is not None:
+            query = query.filter(AssetPrice.updated_at > self._prices_seen)
+        rows = query.all()
+        if rows:
+            self._prices_seen = max(row.updated_at for row in rows)
+        return [(row.asset, row.price) for row in rows]
+
+    def _latest_price(self, asset):
+        """Initial mark for an asset: the published price, else its last stablecoin-quoted trade"""
+        from app import db
+        from models import Trade, AssetPrice
+
+        mark = db.session.get(AssetPrice, asset)
+        if mark is not None:
+            return mark.price
+        trade = Trade.query.filter(
+            Trade.symbol.in_([f'{asset}/{quote}' for quote in STABLECOINS])
+        ).order_by(Trade.id.desc()).first()
+        return trade.price if trade is not None else None
+
+    def _seed_prices(self, assets):
+        """Marks for assets that have none yet; queried without the state lock"""
+        return {asset: self._latest_price(asset) for asset in set(assets) if asset not in self.prices}
+
+    def _apply_seeds(self, seeds):
+        for asset, price in seeds.items():
+            if price is not None and asset not in self.prices:
+                self.set_price(asset, price)
+
+    # -- loading and catch-up ------------------------------------------------
+
+    def _load_user(self, user_id):
+        """Aggregate one user's full history with GROUP BY queries (once per user, under _query_lock)"""
+        from models import Trade, Deposit, Withdrawal, PortfolioSnapshot
+
+        trades = Trade.query.with_entities(
+            Trade.symbol, Trade.side, func.sum(Trade.quantity), func.sum(Trade.cost),
+            func.sum(func.coalesce(Trade.fee, 0.0))
+        ).filter(
+            Trade.user_id == user_id, Trade.id <= self._trade_hwm,
+            Trade.status.in_(COUNTED_TRADE_STATUSES)
+        ).group_by(Trade.symbol, Trade.side).all()
+
+        transfers = {}
+        for name, model, hwm in (('deposit', Deposit, self._deposit_hwm),
+                                 ('withdrawal', Withdrawal, self._withdrawal_hwm)):
+            columns = [model.asset, func.sum(model.amount), func.sum(func.coalesce(model.fee, 0.0))]
+            query = model.query.with_entities(*columns).filter(
+                model.user_id == user_id, model.id <= hwm,
+                model.status.in_(COUNTED_TRANSFER_STATUSES))
+            # pending rows are applied by catch-up when it sees them complete
+            pending = [row_id for row_id, owner in self._pending[name].items() if owner == user_id]
+            if pending:
+                query = query.filter(model.id.notin_(pending))
+            transfers[name] = query.group_by(model.asset).all()
+
+        # earlier processes' snapshots give the 24h reference after a restart
+        since = datetime.utcnow() - timedelta(hours=25)
+        samples = PortfolioSnapshot.query.with_entities(
+            PortfolioSnapshot.timestamp, PortfolioSnapshot.total_value_usd
+        ).filter(
+            PortfolioSnapshot.user_id == user_id, PortfolioSnapshot.timestamp >= since
+        ).order_by(PortfolioSnapshot.timestamp).all()
+
+        assets = [a for symbol, *_ in trades for a in split_symbol(symbol)]
+        assets += [row[0].upper() for rows in transfers.values() for row in rows]
+        seeds = self._seed_prices(assets)
+
+        with self._lock:
+            self._apply_seeds(seeds)
+            portfolio = self._users[user_id] = _UserPortfolio()
+            for symbol, side, quantity, cost, fee in trades:
+                self.apply_trade(user_id, symbol, side, quantity or 0.0, cost or 0.0, fee)
+            for asset, amount, _ in transfers['deposit']:
+                self.apply_deposit(user_id, asset, amount or 0.0)
+            for asset, amount, fee in transfers['withdrawal']:
+                self.apply_withdrawal(user_id, asset, amount or 0.0, fee)
+            portfolio.value = sum(q * self.prices.get(a, 0.0) for a, q in portfolio.holdings.items())
+            portfolio.history.extend((timestamp, value) for timestamp, value in samples)
+        return portfolio
+
+    def _max_id(self, model):
+        from app import db
+        return db.session.query(func.max(model.id)).scalar() or 0
+
+    def catch_up(self, blocking=True):
+        """Apply rows added since the last call (by any process) to loaded users.
+
+        Returns False without waiting when blocking is false and another
+        thread is already catching up.
+        """
+        if not self._query_lock.acquire(blocking=blocking):
+            return False
+        try:
+            self._catch_up()
+        finally:
+            self._query_lock.release()
+        return True
+
+    def _catch_up(self):
+        from models import Trade, Deposit, Withdrawal
+
+        models = (('deposit', Deposit), ('withdrawal', Withdrawal))
+        if self._last_catch_up is None:
+            # first call: fix the high-water marks users are loaded up to,
+            # and remember the transfers below them that are still in flight
+            self._trade_hwm = self._max_id(Trade)
+            for name, model in models:
+                hwm = self._max_id(model)
+                setattr(self, f'_{name}_hwm', hwm)
+                self._pending[name] = dict(model.query.with_entities(model.id, model.user_id).filter(
+                    model.id <= hwm,
+                    model.status.notin_(COUNTED_TRANSFER_STATUSES + FAILED_TRANSFER_STATUSES)).all())
+            prices = self._read_prices()
+            with self._lock:
+                for asset, price in prices:
+                    self.set_price(asset, price)
+        else:
+            trades = Trade.query.filter(Trade.id > self._trade_hwm).order_by(Trade.id).all()
+            transfers = {}
+            for name, model in models:
+                new = model.query.filter(
+                    model.id > getattr(self, f'_{name}_hwm')).order_by(model.id).all()
+                pending = list(self._pending[name])
+                watched = model.query.filter(model.id.in_(pending)).all() if pending else []
+                transfers[name] = (new, watched)
+            prices = self._read_prices()
+            seeds = self._seed_prices(split_symbol(trade.symbol)[0] for trade in trades
+                                      if trade.status in COUNTED_TRADE_STATUSES)
+
+            with self._lock:
+                for asset, price in prices:
+                    self.set_price(asset, price)
+                self._apply_seeds(seeds)
+                for trade in trades:
+                    self._trade_hwm = trade.id
+                    if trade.status in COUNTED_TRADE_STATUSES:
+                        self.apply_trade(trade.user_id, trade.symbol, trade.side,
+                                         trade.quantity, trade.cost, trade.fee)
+                for name, (new, watched) in transfers.items():
+                    pending = self._pending[name]
+                    still_pending = {}
+                    for row in watched:
+                        if row.status in COUNTED_TRANSFER_STATUSES:
+                            self._apply_transfer(name, row)
+                        elif _watched(row.status):
+                            still_pending[row.id] = row.user_id
+                    for row in new:
+                        setattr(self, f'_{name}_hwm', row.id)
+                        if row.status in COUNTED_TRANSFER_STATUSES:
+                            self._apply_transfer(name, row)
+                        elif _watched(row.status):
+                            still_pending[row.id] = row.user_id
+                    # deleted rows drop out along with settled ones
+                    pending.clear()
+                    pending.update(still_pending)
+        self._last_catch_up = datetime.utcnow()
+        self._catch_up_requested = False
+
+    def on_trades(self, rows):
+        """TradeLedger listener: new rows are picked up on the next catch-up"""
+        self._catch_up_requested = True
+
+    # -- reads ---------------------------------------------------------------
+
+    def _value_24h_ago(self, portfolio, now):
+        cutoff = now - timedelta(hours=24)
+        reference = None
+        for timestamp, value in portfolio.history:
+            if timestamp > cutoff:
+                break
+            reference = value
+        if reference is None and portfolio.history:
+            reference = portfolio.history[0][1]
+        return reference
+
+    def _price_change(self, asset, now):
+        samples = self._price_history.get(asset)
+        price = self.prices.get(asset)
+        if not samples or not price:
+            return 0.0
+        cutoff = now - timedelta(hours=24)
+        reference = samples[0][1]
+        for timestamp, value in samples:
+            if timestamp > cutoff:
+                break
+            reference = value
+        return (price / reference - 1.0) * 100.0 if reference else 0.0
+
+    def summary(self, user_id):
+        """Dashboard summary for a user, served from cache unless something changed"""
+        now = datetime.utcnow()
+        if (self._last_catch_up is None or self._catch_up_requested or
+                (now - self._last_catch_up).total_seconds() >= CATCH_UP_INTERVAL):
+            # only the first catch-up must be waited for; later ones another thread
+            # is already running will be seen on a following call
+            self.catch_up(blocking=self._last_catch_up is None)
+        portfolio = self._users.get(user_id)
+        if portfolio is None:
+            with self._query_lock:
+                portfolio = self._users.get(user_id) or self._load_user(user_id)
+
+        with self._lock:
+            if portfolio.summary is not None:
+                return portfolio.summary
+            value = portfolio.value
+            reference = self._value_24h_ago(portfolio, now)
+            daily_change = value - reference if reference is not None else 0.0
+            positions = sorted(
+                ({'symbol': asset,
+                  'quantity': qty,
+                  'value': qty * self.prices.get(asset, 0.0),
+                  'change': self._price_change(asset, now)}
+                 for asset, qty in portfolio.holdings.items()),
+                key=lambda p: p['value'], reverse=True)
+            portfolio.summary = {
+                'total_value': value,
+                'daily_change': daily_change,
+                'daily_change_percent': (daily_change / reference * 100.0) if reference else 0.0,
+                'positions': positions,
+            }
+            return portfolio.summary
+
+    # -- snapshots -----------------------------------------------------------
+
+    def snapshot_all(self):
+        """Write a PortfolioSnapshot for every loaded user with holdings"""
+        from app import db
+        from models import PortfolioSnapshot
+
+        self.catch_up()
+        with self._lock:
+            now = datetime.utcnow()
+            cutoff = now - timedelta(hours=25)
+            for asset, price in self.prices.items():
+                samples = self._price_history.setdefault(asset, deque())
+                samples.append((now, price))
+                while samples and samples[0][0] < cutoff:
+                    samples.popleft()
+
+            rows = []
+            for user_id, portfolio in self._users.items():
+                portfolio.history.append((now, portfolio.value))
+                while portfolio.history and portfolio.history[0][0] < cutoff:
+                    portfolio.history.popleft()
+                portfolio.summary = None
+                if not portfolio.holdings:
+                    continue
+                values = {a: q * self.prices.get(a, 0.0) for a, q in portfolio.holdings.items()}
+                total = portfolio.value
+                snapshot = PortfolioSnapshot(total_value_usd=total, timestamp=now, user_id=user_id)
+                snapshot.set_assets(dict(portfolio.holdings))
+                snapshot.set_weights({a: (v / total if total else 0.0) for a, v in values.items()})
+                rows.append(snapshot)
+
+        if rows:
+            db.session.add_all(rows)
+            db.session.commit()
+        return len(rows)
+
+    def start_snapshots(self, interval=SNAPSHOT_INTERVAL):
+        """Write snapshots every interval seconds on a daemon timer"""
+        def run():
+            try:
+                with self.app.app_context():
+                    self.snapshot_all()
+            except Exception:
+                logging.exception('Portfolio snapshot failed')
+            self.start_snapshots(interval)
+
+        self._snapshot_timer = threading.Timer(interval, run)
+        self._snapshot_timer.daemon = True
+        self._snapshot_timer.start()
+
+    def stop_snapshots(self):
+        if self._snapshot_timer is not None:
+            self._snapshot_timer.cancel()
+            self._snapshot_timer = None
+
+
+class PricePublisher:
+    """Live marks from a market data hub, written to AssetPrice for every process's engine.
+
+    Runs on the bot supervisor's loop and hub, since the supervisor owns the
+    only ingestion service. Stablecoin-quoted TradeEvents update the latest
+    price per asset; every interval the marks that changed are upserted in
+    an executor.
+    """
+
+    def __init__(self, app, hub, interval=PRICE_PUBLISH_INTERVAL):
+        self.app = app
+        self.hub = hub
+        self.interval = interval
+        self.marks = {}
+        self._changed = set()
+        self._subscription = None
+        self._tasks = []
+        self.published = 0
+
+    def on_market_event(self, event):
+        mark = stablecoin_mark(event)
+        if mark is not None and self.marks.get(mark[0]) != mark[1]:
+            self.marks[mark[0]] = mark[1]
+            self._changed.add(mark[0])
+
+    async def _consume(self):
+        async for event in self._subscription:
+            self.on_market_event(event)
+
+    def _write(self, marks):
+        from app import db
+        from models import AssetPrice
+
+        now = datetime.utcnow()
+        with self.app.app_context():
+            for asset, price in marks.items():
+                db.session.merge(AssetPrice(asset=asset, price=price, updated_at=now))
+            db.session.commit()
+
+    async def publish(self):
+        if not self._changed:
+            return
+        marks = {asset: self.marks[asset] for asset in self._changed}
+        self._changed = set()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, marks)
+        except Exception:
+            # retried on the next publish unless a newer mark replaces them
+            self._changed.update(marks)
+            raise
+        self.published += len(marks)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.publish()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception('Price publish failed')
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Subscribe to the hub and start publishing on the running loop"""
+        from market_data import TradeEvent
+
+        # only the latest price matters, so a slow consumer loses ticks instead of holding the feed
+        self._subscription = self.hub.subscribe(kinds=(TradeEvent,), maxsize=10000,
+                                                policy='drop_oldest')
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._consume(), name='prices-consume'),
+                       loop.create_task(self._run(), name='prices-publish')]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._subscription is not None:
+            self.hub.unsubscribe(self._subscription)
+            self._subscription = None
+        await self.publish()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_valuation_engine():
+    """Process-wide engine, fed by the trade ledger and, if RUN_BACKGROUND_JOBS, snapshotted on a timer"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            from app import app
+            from trade_ledger import get_ledger
+            _engine = ValuationEngine(app)
+            get_ledger().add_listener(_engine.on_trades)
+            if app.config.get('RUN_BACKGROUND_JOBS', True):
+                _engine.start_snapshots()
+        return _engine
+
+
+if __name__ == '__main__':
+    # python portfolio_valuation.py: the snapshot writer as its own process
+    import time
+    from app import app
+    from models import User
+
+    logging.basicConfig(level=logging.INFO)
+    engine = ValuationEngine(app)
+    while True:
+        try:
+            with app.app_context():
+                # snapshot_all() covers loaded users; summary() loads any new ones
+                for (user_id,) in User.query.with_entities(User.id):
+                    engine.summary(user_id)
+                engine.snapshot_all()
+        except Exception:
+            logging.exception('Portfolio snapshot failed')
+        time.sleep(SNAPSHOT_INTERVAL)
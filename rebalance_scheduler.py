@@ -0,0 +1,282 @@
+"""Rebalance scheduler for portfolio_active bot configs.
+
+Configs sit in a min-heap keyed by their next due time. The scheduler
+thread sleeps until the top of the heap is due, pops everything that is due
+(O(log n) each) and hands them to a bounded worker pool as one batch, so
+the optimizer solves all of them in a single pass. Rescheduling or
+unscheduling a config bumps its version, and stale heap entries are skipped
+when they surface. This avoids searching the heap for them.
+
+When a config was last rebalanced is stored in BotConfig.last_rebalanced_at,
+so a restart resumes the schedule. Configs edited later are picked up by
+polling BotConfig.updated_at, so each poll reads only the changed rows.
+
+    python rebalance_scheduler.py
+"""
+import time
+import heapq
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+MIN_FREQUENCY = 60
+RELOAD_INTERVAL = 30.0
+
+
+class RebalanceScheduler:
+    """Heap of next-due times dispatching batches of due configs to a worker pool"""
+
+    def __init__(self, app, rebalance=None, max_workers=4, max_batch=500,
+                 reload_interval=RELOAD_INTERVAL, clock=time.time):
+        self.app = app
+        self.rebalance = rebalance or rebalance_configs
+        self.max_batch = max_batch
+        self.reload_interval = reload_interval
+        self.clock = clock
+
+        self._heap = []
+        self._entries = {}
+        self._running = set()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rebalance')
+        # at most one queued batch per worker; beyond that the scheduler thread waits
+        self._slots = threading.BoundedSemaphore(max_workers * 2)
+        self._thread = None
+        self._stopped = False
+        self._last_reload = None
+
+        self.dispatched = 0
+        self.completed = 0
+        self.failures = 0
+        self.skipped_busy = 0
+        self._latencies = deque(maxlen=4096)
+
+    # -- schedule ------------------------------------------------------------
+
+    def schedule(self, config_id, frequency, last_run=None):
+        """Schedule config_id every frequency seconds, next due one period after last_run"""
+        frequency = max(MIN_FREQUENCY, int(frequency or 0))
+        now = self.clock()
+        due = now if last_run is None else max(now, last_run + frequency)
+        with self._cond:
+            entry = self._entries.get(config_id)
+            if entry is not None and entry[1] == frequency:
+                return
+            version = entry[0] + 1 if entry is not None else 0
+            self._entries[config_id] = (version, frequency)
+            heapq.heappush(self._heap, (due, config_id, version))
+            if self._heap[0][1] == config_id:
+                self._cond.notify()
+
+    def unschedule(self, config_id):
+        with self._cond:
+            entry = self._entries.pop(config_id, None)
+            if entry is not None:
+                # keep the version counter so a later schedule() still outdates old entries
+                self._entries[config_id] = (entry[0] + 1, None)
+
+    def __len__(self):
+        return sum(1 for _, frequency in self._entries.values() if frequency is not None)
+
+    def _pop_due(self, now):
+        """Pop up to max_batch due entries, dropping stale ones"""
+        due = []
+        heap, entries = self._heap, self._entries
+        while heap and heap[0][0] <= now and len(due) < self.max_batch:
+            due_at, config_id, version = heapq.heappop(heap)
+            entry = entries.get(config_id)
+            if entry is None or entry[0] != version or entry[1] is None:
+                continue
+            if config_id in self._running:
+                # still working on the previous rebalance: try again one period later
+                self.skipped_busy += 1
+                heapq.heappush(heap, (due_at + entry[1], config_id, version))
+                continue
+            due.append((due_at, config_id, entry[1]))
+        return due
+
+    # -- loading -------------------------------------------------------------
+
+    def load(self):
+        """(Re)load schedules from the database, reading only configs changed since the last load.
+
+        A deleted config leaves no updated_at to find, so each reload also reads
+        the ids of all active portfolio configs and unschedules the rest.
+        """
+        from models import BotConfig
+
+        active = None
+        with self.app.app_context():
+            query = BotConfig.query.with_entities(
+                BotConfig.id, BotConfig.is_active, BotConfig.portfolio_active,
+                BotConfig.rebalance_frequency, BotConfig.last_rebalanced_at)
+            started = datetime.utcnow()
+            if self._last_reload is not None:
+                # small overlap so rows committed while the previous load ran are not missed
+                query = query.filter(BotConfig.updated_at >= self._last_reload - timedelta(seconds=5))
+                active = {config_id for (config_id,) in BotConfig.query.with_entities(BotConfig.id).filter(
+                    BotConfig.is_active.is_(True), BotConfig.portfolio_active.is_(True))}
+            else:
+                query = query.filter(BotConfig.is_active.is_(True), BotConfig.portfolio_active.is_(True))
+            rows = query.all()
+        self._last_reload = started
+
+        if active is not None:
+            with self._cond:
+                gone = [config_id for config_id, (_, frequency) in self._entries.items()
+                        if frequency is not None and config_id not in active]
+            for config_id in gone:
+                self.unschedule(config_id)
+
+        for config_id, is_active, portfolio_active, frequency, last_run in rows:
+            if is_active and portfolio_active:
+                epoch = (last_run - datetime(1970, 1, 1)).total_seconds() if last_run else None
+                self.schedule(config_id, frequency, epoch)
+            else:
+                self.unschedule(config_id)
+        return len(rows)
+
+    # -- dispatch ------------------------------------------------------------
+
+    def start(self):
+        if self._thread is None:
+            self.load()
+            self._thread = threading.Thread(target=self._run, name='rebalance-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self._pool.shutdown(wait=wait)
+
+    def _run(self):
+        next_reload = time.monotonic() + self.reload_interval
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = self.clock()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    timeout = next_reload - time.monotonic()
+                    if self._heap:
+                        timeout = min(timeout, self._heap[0][0] - now)
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                batch = self._pop_due(self.clock())
+                for _, config_id, _ in batch:
+                    self._running.add(config_id)
+
+            if batch:
+                self._slots.acquire()
+                self._pool.submit(self._execute, batch)
+            if time.monotonic() >= next_reload:
+                next_reload = time.monotonic() + self.reload_interval
+                try:
+                    self.load()
+                except Exception:
+                    logging.exception('Rebalance schedule reload failed')
+
+    def _execute(self, batch):
+        started = self.clock()
+        for due_at, _, _ in batch:
+            self._latencies.append(started - due_at)
+        self.dispatched += len(batch)
+        config_ids = [config_id for _, config_id, _ in batch]
+        try:
+            self.rebalance(self.app, config_ids)
+            self.completed += len(batch)
+        except Exception:
+            self.failures += len(batch)
+            logging.exception(f'Rebalance of {len(batch)} configs failed')
+        finally:
+            now = self.clock()
+            with self._cond:
+                for due_at, config_id, frequency in batch:
+                    self._running.discard(config_id)
+                    entry = self._entries.get(config_id)
+                    if entry is None or entry[1] != frequency:
+                        continue
+                    # stay on the original grid; skip slots that were missed while busy or down
+                    missed = max(0, int((now - due_at) // frequency))
+                    heapq.heappush(self._heap, (due_at + (missed + 1) * frequency, config_id, entry[0]))
+                self._cond.notify()
+            self._slots.release()
+
+    # -- metrics -------------------------------------------------------------
+
+    def metrics(self):
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+        with self._cond:
+            next_due = self._heap[0][0] - self.clock() if self._heap else None
+            return {
+                'scheduled': len(self),
+                'heap_size': len(self._heap),
+                'running': len(self._running),
+                'dispatched': self.dispatched,
+                'completed': self.completed,
+                'failures': self.failures,
+                'skipped_busy': self.skipped_busy,
+                'dispatch_latency_ms_p50': percentile(0.50),
+                'dispatch_latency_ms_p99': percentile(0.99),
+                'dispatch_latency_ms_max': percentile(1.0),
+                'next_due_in_s': round(next_due, 3) if next_due is not None else None,
+            }
+
+
+_optimizer = None
+_optimizer_lock = threading.Lock()
+
+
+def rebalance_configs(app, config_ids):
+    """Default job: optimize the given configs in one batch and stamp last_rebalanced_at.
+
+    The optimizer's universe is rebuilt from every current portfolio config,
+    so pairs that no config trades any more leave it.
+    """
+    global _optimizer
+    from app import db
+    from models import BotConfig, BotConfigPair
+    from portfolio_optimizer import PortfolioOptimizer
+
+    with _optimizer_lock:
+        if _optimizer is None:
+            _optimizer = PortfolioOptimizer()
+    # the optimizer locks only its statistics update, so workers' batches run in parallel
+    with app.app_context():
+        configs = BotConfig.query.filter(BotConfig.id.in_(config_ids)).all()
+        universe = [symbol for (symbol,) in db.session.query(BotConfigPair.symbol).join(BotConfig).filter(
+            BotConfig.is_active.is_(True), BotConfig.portfolio_active.is_(True)).distinct()]
+        _optimizer.rebalance(configs, universe)
+        db.session.execute(
+            db.update(BotConfig).where(BotConfig.id.in_(config_ids))
+            .values(last_rebalanced_at=datetime.utcnow(), updated_at=BotConfig.updated_at)
+        )
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    scheduler = RebalanceScheduler(app)
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(60)
+            logging.info(f'Rebalance scheduler: {scheduler.metrics()}')
+    except KeyboardInterrupt:
+        scheduler.stop()
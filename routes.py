@@ -1,10 +1,20 @@
-from flask import render_template, flash, redirect, url_for, request, jsonify
+from flask import render_template, flash, redirect, url_for, request, jsonify, Response
 from flask_login import login_user, logout_user, current_user, login_required
 from app import app, db
 from forms import (LoginForm, RegistrationForm, ForgotPasswordForm, ResetPasswordForm, 
                    ApiKeyForm, BotConfigForm, NotificationSettingsForm, WithdrawalForm, 
-                   OTPVerificationForm, BacktestForm)
-from models import User, ApiKey, BotConfig, Trade, ArbitrageOpportunity, PortfolioSnapshot, NewsItem
+                   OTPVerificationForm, BacktestForm, ParameterSweepForm)
+from models import (User, ApiKey, BotConfig, BotConfigPair, BotConfigStrategy, Trade, ArbitrageOpportunity,
+                    CycleArbitrageOpportunity, PortfolioSnapshot, PortfolioSnapshotAsset, NewsItem,
+                    BacktestResult, SweepJob)
+from history import (keyset_page, trade_to_dict, opportunity_to_dict, news_to_dict, config_to_dict,
+                     DEFAULT_PAGE_SIZE)
+from live_events import get_live_feed, stream
+from status_cache import get_status_cache
+from dashboard_cache import get_dashboard_cache, get_user_cache
+from db_routing import read_replica, replica_reads, pool_metrics
+from notifications import get_notifier, notify
+from portfolio_valuation import get_valuation_engine
 from datetime import datetime, timedelta
 import json
 import logging
@@ -103,35 +113,15 @@ def forgot_password():
 @login_required
 def dashboard():
     """Main trading dashboard"""
-    # Get user's bot configurations
-    bot_configs = BotConfig.query.filter_by(user_id=current_user.id).all()
-    
-    # Get recent trades
-    recent_trades = Trade.query.filter_by(user_id=current_user.id).order_by(Trade.timestamp.desc()).limit(10).all()
-    
-    # Get active arbitrage opportunities
-    arbitrage_opps = ArbitrageOpportunity.query.filter_by(
-        user_id=current_user.id, executed=False
-    ).order_by(ArbitrageOpportunity.timestamp.desc()).limit(5).all()
-    
-    # Portfolio summary (mock data for demo)
-    portfolio_summary = {
-        'total_value': 25847.32,
-        'daily_change': 3.24,
-        'daily_change_percent': 0.128,
-        'positions': [
-            {'symbol': 'BTC/USDT', 'value': 15000.00, 'change': 2.1},
-            {'symbol': 'ETH/USDT', 'value': 8000.00, 'change': -1.5},
-            {'symbol': 'ADA/USDT', 'value': 2847.32, 'change': 4.8}
-        ]
-    }
+    # bot configs, recent trades, open opportunities and portfolio summary in one read-model lookup
+    view = get_dashboard_cache().get(current_user.id)
     
     return render_template('dashboard.html', 
                          title='Trading Dashboard',
-                         bot_configs=bot_configs,
-                         recent_trades=recent_trades,
-                         arbitrage_opps=arbitrage_opps,
-                         portfolio=portfolio_summary)
+                         bot_configs=view['bot_configs'],
+                         recent_trades=view['recent_trades'],
+                         arbitrage_opps=view['arbitrage_opps'],
+                         portfolio=view['portfolio'])
 
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
@@ -176,6 +166,7 @@ def arbitrage():
 
 @app.route('/portfolio')
 @login_required
+@read_replica
 def portfolio():
     """Portfolio management and optimization"""
     # Get portfolio snapshots
@@ -189,6 +180,7 @@ def portfolio():
 
 @app.route('/news_sentiment')
 @login_required
+@read_replica
 def news_sentiment():
     """News sentiment analysis dashboard"""
     news_items = NewsItem.query.order_by(NewsItem.timestamp.desc()).limit(50).all()
@@ -204,13 +196,83 @@ def backtesting():
     form = BacktestForm()
     
     if form.validate_on_submit():
-        # In production, this would trigger actual backtesting
-        flash('Backtest started! Results will be available shortly.', 'info')
+        try:
+            # numpy and the backtester load on the first backtest, not at worker start
+            from backtester import run_and_save
+            result = run_and_save(
+                name=form.name.data,
+                strategy=form.strategy.data,
+                pairs=form.pairs.data,
+                days_back=form.days_back.data,
+                initial_capital=form.initial_capital.data,
+                user_id=current_user.id
+            )
+            flash(f'Backtest complete! Return: {result.total_return * 100:.2f}%, '
+                  f'Sharpe: {result.sharpe_ratio:.2f}', 'success')
+        except ValueError as e:
+            flash(str(e), 'error')
+        except Exception as e:
+            logging.exception('Backtest failed')
+            flash(f'Error running backtest: {str(e)}', 'error')
         return redirect(url_for('backtesting'))
     
+    with replica_reads():
+        results = BacktestResult.query.filter_by(
+            user_id=current_user.id
+        ).order_by(BacktestResult.created_at.desc()).limit(20).all()
+    
     return render_template('backtesting.html',
                          title='Strategy Backtesting',
-                         form=form)
+                         form=form,
+                         results=results)
+
+@app.route('/backtesting/sweep', methods=['GET', 'POST'])
+@login_required
+def backtest_sweep():
+    """Grid/random search over BotConfig parameters"""
+    form = ParameterSweepForm()
+    
+    if form.validate_on_submit():
+        try:
+            # the sweep runs as a background job; the request only validates and queues it
+            from parameter_sweep import submit_sweep
+            job = submit_sweep(
+                name=form.name.data,
+                strategy=form.strategy.data,
+                pairs=form.pairs.data,
+                days_back=form.days_back.data,
+                initial_capital=form.initial_capital.data,
+                user_id=current_user.id,
+                ranges=form.get_ranges(),
+                mode=form.mode.data,
+                n_samples=form.n_samples.data
+            )
+            flash(f'Sweep #{job.id} queued: {job.total_runs} backtests. '
+                  f'Results appear under your backtests when it finishes.', 'success')
+        except ValueError as e:
+            flash(str(e), 'error')
+        except Exception as e:
+            logging.exception('Parameter sweep failed')
+            flash(f'Error queuing parameter sweep: {str(e)}', 'error')
+        return redirect(url_for('backtesting'))
+    
+    return render_template('backtesting.html',
+                         title='Parameter Sweep',
+                         form=form,
+                         sweep=True)
+
+@app.route('/api/sweep_status/<int:job_id>')
+@login_required
+def api_sweep_status(job_id):
+    """Status of a queued parameter sweep, and its best result once finished"""
+    try:
+        from parameter_sweep import job_to_dict
+        job = SweepJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+        if job is None:
+            return jsonify({'success': False, 'message': 'Sweep not found'})
+        return jsonify({'success': True, 'data': job_to_dict(job)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
 
 # API Routes for AJAX calls
 @app.route('/api/add_api_key', methods=['POST'])
@@ -227,7 +289,9 @@ def api_add_api_key():
         )
         db.session.add(api_key)
         db.session.commit()
-        return jsonify({'success': True, 'message': 'API key added successfully'})
+        return jsonify({'success': True, 'message': 'API key added successfully',
+                        'data': {'id': api_key.id, 'exchange': api_key.exchange,
+                                 'key_prefix': api_key.api_key[:8], 'is_active': api_key.is_active}})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -250,11 +314,16 @@ def api_delete_api_key(key_id):
 def api_add_bot_config():
     """Add new bot configuration via AJAX"""
     try:
+        from backtester import parse_pairs
         data = request.get_json()
+        # the settings form posts a single strategy and comma separated pairs
+        strategies = data['strategies']
+        if isinstance(strategies, str):
+            strategies = [s.strip() for s in strategies.split(',') if s.strip()]
         config = BotConfig(
             name=data['name'],
-            strategies=data['strategies'],
-            pairs=data['pairs'],
+            strategies=json.dumps(strategies),
+            pairs=json.dumps(parse_pairs(data['pairs'])),
             hft_active=data.get('hft_active', False),
             arbitrage_active=data.get('arbitrage_active', False),
             portfolio_active=data.get('portfolio_active', False),
@@ -266,7 +335,28 @@ def api_add_bot_config():
         )
         db.session.add(config)
         db.session.commit()
-        return jsonify({'success': True, 'message': 'Bot configuration saved successfully'})
+        get_status_cache().bump(current_user.id)
+        get_dashboard_cache().invalidate(current_user.id)
+        get_live_feed().poke()
+        return jsonify({'success': True, 'message': 'Bot configuration saved successfully',
+                        'data': config_to_dict(config)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/delete_bot_config/<int:config_id>', methods=['DELETE'])
+@login_required
+def api_delete_bot_config(config_id):
+    """Delete bot configuration via AJAX"""
+    try:
+        config = BotConfig.query.filter_by(id=config_id, user_id=current_user.id).first()
+        if config:
+            db.session.delete(config)
+            db.session.commit()
+            get_status_cache().bump(current_user.id)
+            get_dashboard_cache().invalidate(current_user.id)
+            get_live_feed().broker.publish(current_user.id, 'bot_deleted', {'id': config_id})
+            return jsonify({'success': True, 'message': 'Bot configuration deleted successfully'})
+        return jsonify({'success': False, 'message': 'Configuration not found'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -278,12 +368,17 @@ def api_start_bot():
         data = request.get_json()
         config_id = data.get('config_id')
         
-        # In production, this would start the actual trading bot
+        # the bot supervisor daemon (bot_supervisor.py) starts the bot once is_active is committed
         config = BotConfig.query.filter_by(id=config_id, user_id=current_user.id).first()
         if config:
             config.is_active = True
             db.session.commit()
-            return jsonify({'success': True, 'message': f'Bot "{config.name}" started successfully'})
+            get_status_cache().bump(current_user.id)
+            get_dashboard_cache().invalidate(current_user.id)
+            get_live_feed().poke()
+            notify(current_user.id, 'bot_status', f'Bot "{config.name}" started')
+            return jsonify({'success': True, 'message': f'Bot "{config.name}" started successfully',
+                            'data': config_to_dict(config)})
         
         return jsonify({'success': False, 'message': 'Configuration not found'})
     except Exception as e:
@@ -301,7 +396,12 @@ def api_stop_bot():
         if config:
             config.is_active = False
             db.session.commit()
-            return jsonify({'success': True, 'message': f'Bot "{config.name}" stopped successfully'})
+            get_status_cache().bump(current_user.id)
+            get_dashboard_cache().invalidate(current_user.id)
+            get_live_feed().poke()
+            notify(current_user.id, 'bot_status', f'Bot "{config.name}" stopped')
+            return jsonify({'success': True, 'message': f'Bot "{config.name}" stopped successfully',
+                            'data': config_to_dict(config)})
         
         return jsonify({'success': False, 'message': 'Configuration not found'})
     except Exception as e:
@@ -310,21 +410,153 @@ def api_stop_bot():
 @app.route('/api/bot_status')
 @login_required
 def api_bot_status():
-    """Get bot status via AJAX"""
+    """Get bot status via AJAX: 304 for a matching If-None-Match, ?wait=N long-polls for a change"""
     try:
-        configs = BotConfig.query.filter_by(user_id=current_user.id).all()
-        status_data = []
-        
-        for config in configs:
-            status_data.append({
-                'id': config.id,
-                'name': config.name,
-                'is_active': config.is_active,
-                'strategies': config.get_strategies(),
-                'pairs': config.get_pairs()
-            })
-        
-        return jsonify({'success': True, 'data': status_data})
+        user_id = current_user.id
+        cache = get_status_cache()
+        version, status_data, etag = cache.get(user_id)
+        wait = request.args.get('wait', 0, type=float)
+        if wait > 0 and request.if_none_match.contains(etag):
+            # do not hold a pooled connection while parked
+            db.session.close()
+            cache.wait(user_id, version, wait)
+            version, status_data, etag = cache.get(user_id)
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify({'success': True, 'data': status_data, 'version': version})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/stream')
+@login_required
+def api_stream():
+    """Server-sent events for the dashboard: trades, opportunities, bot status, portfolio value"""
+    feed = get_live_feed()
+    return Response(stream(feed.broker, current_user.id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/history/trades')
+@login_required
+@read_replica
+def api_trade_history():
+    """Keyset-paginated trade history"""
+    try:
+        query = Trade.query.filter_by(user_id=current_user.id)
+        trades, next_cursor = keyset_page(query, Trade, request.args.get('cursor'),
+                                          request.args.get('limit', DEFAULT_PAGE_SIZE, type=int))
+        return jsonify({'success': True, 'data': [trade_to_dict(t) for t in trades],
+                        'next_cursor': next_cursor})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/history/opportunities')
+@login_required
+@read_replica
+def api_opportunity_history():
+    """Keyset-paginated arbitrage opportunity history (?executed=true|false to filter)"""
+    try:
+        query = ArbitrageOpportunity.query.filter_by(user_id=current_user.id)
+        executed = request.args.get('executed')
+        if executed is not None:
+            query = query.filter_by(executed=executed.lower() == 'true')
+        opps, next_cursor = keyset_page(query, ArbitrageOpportunity, request.args.get('cursor'),
+                                        request.args.get('limit', DEFAULT_PAGE_SIZE, type=int))
+        return jsonify({'success': True, 'data': [opportunity_to_dict(o) for o in opps],
+                        'next_cursor': next_cursor})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/history/news')
+@login_required
+@read_replica
+def api_news_history():
+    """Keyset-paginated news history (?asset=ETH for news mentioning an asset)"""
+    try:
+        asset = request.args.get('asset')
+        query = NewsItem.mentioning(asset) if asset else NewsItem.query
+        items, next_cursor = keyset_page(query, NewsItem, request.args.get('cursor'),
+                                         request.args.get('limit', DEFAULT_PAGE_SIZE, type=int))
+        return jsonify({'success': True, 'data': [news_to_dict(n) for n in items],
+                        'next_cursor': next_cursor})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/sentiment')
+@login_required
+def api_sentiment():
+    """Rolling per-asset sentiment (?assets=BTC,ETH; default every asset with news)"""
+    try:
+        from sentiment_aggregates import get_sentiment_aggregates
+        assets = [a.strip().upper() for a in request.args.get('assets', '').split(',') if a.strip()]
+        return jsonify({'success': True, 'data': get_sentiment_aggregates().snapshot(assets or None)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/ledger_metrics')
+@login_required
+def api_ledger_metrics():
+    """Trade ledger buffer and flush-latency metrics"""
+    try:
+        from trade_ledger import get_ledger
+        return jsonify({'success': True, 'data': get_ledger().metrics()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/db_pool_metrics')
+@login_required
+def api_db_pool_metrics():
+    """Connection pool occupancy and checkout-wait metrics per database bind"""
+    try:
+        return jsonify({'success': True, 'data': pool_metrics(db)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/save_notification_settings', methods=['POST'])
+@login_required
+def save_notification_settings():
+    """Save email notification preferences"""
+    form = NotificationSettingsForm()
+    if form.validate_on_submit():
+        current_user.notification_email = form.notification_email.data or None
+        current_user.email_notifications_enabled = form.email_notifications_enabled.data
+        current_user.notify_trades = form.notify_trades.data
+        current_user.notify_arbitrage = form.notify_arbitrage.data
+        current_user.notify_ml = form.notify_ml.data
+        current_user.notify_errors = form.notify_errors.data
+        current_user.notify_bot_status = form.notify_bot_status.data
+        current_user.preferences_updated_at = datetime.utcnow()
+        db.session.commit()
+        # drop this process's cached copy now; other processes see preferences_updated_at
+        get_notifier().preferences.invalidate(current_user.id)
+        get_user_cache().invalidate(current_user.id)
+        flash('Notification settings saved', 'success')
+    else:
+        flash('Invalid notification settings', 'error')
+    return redirect(url_for('settings'))
+
+@app.route('/api/test_notification', methods=['POST'])
+@login_required
+def api_test_notification():
+    """Send one test email right away, bypassing digests and rate limits"""
+    try:
+        address = current_user.notification_email or current_user.email
+        get_notifier().send_now(address, 'Crypto Trading Bot: test notification',
+                                'Email notifications are working.')
+        return jsonify({'success': True, 'message': f'Test notification sent to {address}'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/notification_metrics')
+@login_required
+def api_notification_metrics():
+    """Notification dispatcher queue, digest and delivery counters"""
+    try:
+        return jsonify({'success': True, 'data': get_notifier().metrics()})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -335,11 +567,18 @@ def emergency_reset():
         # Clear all tables
         db.session.query(Trade).delete()
         db.session.query(ArbitrageOpportunity).delete()
+        db.session.query(CycleArbitrageOpportunity).delete()
+        db.session.query(PortfolioSnapshotAsset).delete()
         db.session.query(PortfolioSnapshot).delete()
+        db.session.query(BotConfigPair).delete()
+        db.session.query(BotConfigStrategy).delete()
         db.session.query(BotConfig).delete()
         db.session.query(ApiKey).delete()
+        db.session.query(SweepJob).delete()
         db.session.query(User).delete()
         db.session.commit()
+        get_dashboard_cache().clear()
+        get_user_cache().invalidate()
         
         flash('Database cleared successfully! You can now register fresh.', 'success')
         return redirect(url_for('register'))
@@ -354,6 +593,8 @@ def quick_reset():
         # Clear existing data
         db.session.query(User).delete()
         db.session.commit()
+        get_dashboard_cache().clear()
+        get_user_cache().invalidate()
         
         # Create default admin user
         admin = User(username='admin', email='admin@cryptobot.com')
@@ -0,0 +1,292 @@
+"""Per-asset rolling news sentiment.
+
+Each asset keeps its scored articles in time buckets (bucket_seconds wide),
+and each window (1h and 24h by default) keeps a running count and score
+sum over the buckets inside it. Adding an article updates every window in
+O(1). A lookup first retires the buckets that have left the window. Each
+bucket is retired once, so lookups are O(1) amortized, and they never read
+NewsItem or decode related_assets.
+
+Each window also keeps an exponentially decayed mean score, with a time
+constant equal to the window length, so recent articles weigh more. The
+decayed weight is the effective number of recent articles.
+
+The aggregates are loaded from the last 24h of NewsItem rows once. After
+that, a background thread applies only rows with ids above a high-water mark,
+so articles stored by the news pipeline daemon are picked up within
+CATCH_UP_INTERVAL seconds.
+
+    aggregates = get_sentiment_aggregates()
+    aggregates.score('BTC', '1h')       # decayed mean score, or the default
+    aggregates.get('BTC', '24h')        # count, mean, decayed_score, weight
+"""
+import json
+import math
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+BUCKET_SECONDS = 300
+WINDOWS = {'1h': 3600, '24h': 86400}
+CATCH_UP_INTERVAL = 2.0
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch(timestamp):
+    return (timestamp - EPOCH).total_seconds()
+
+
+def _related_assets(value):
+    try:
+        return json.loads(value) if value else []
+    except ValueError:
+        return []
+
+
+class _Window:
+    __slots__ = ('buckets', 'tau', 'low', 'count', 'total', 'decayed_sum', 'decayed_weight', 'decayed_at')
+
+    def __init__(self, buckets, tau, low):
+        self.buckets = buckets
+        self.tau = tau
+        self.low = low
+        self.count = 0
+        self.total = 0.0
+        self.decayed_sum = 0.0
+        self.decayed_weight = 0.0
+        self.decayed_at = None
+
+
+class _AssetSentiment:
+    __slots__ = ('buckets', 'windows')
+
+    def __init__(self, windows, now_index):
+        # bucket index -> [count, score sum], covering the longest window
+        self.buckets = {}
+        self.windows = {name: _Window(n, tau, now_index - n + 1) for name, (n, tau) in windows.items()}
+
+
+class SentimentAggregates:
+    """Rolling count, mean and decayed sentiment per asset and window"""
+
+    def __init__(self, app=None, bucket_seconds=BUCKET_SECONDS, windows=None, clock=time.time):
+        self.app = app
+        self.bucket_seconds = bucket_seconds
+        windows = windows or WINDOWS
+        self.windows = {name: (max(1, int(seconds // bucket_seconds)), float(seconds))
+                        for name, seconds in windows.items()}
+        # shortest first: the longest window deletes the buckets it retires
+        self._order = sorted(self.windows, key=lambda name: self.windows[name][0])
+        self._longest = self._order[-1]
+        self.clock = clock
+        self._assets = {}
+        self._lock = threading.RLock()
+        self._hwm = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+        self.applied = 0
+        self.catch_ups = 0
+
+    # -- updates -------------------------------------------------------------
+
+    def add(self, asset, score, timestamp=None):
+        """Count one scored article for asset; timestamp in epoch seconds (default now)"""
+        now = self.clock()
+        timestamp = now if timestamp is None else timestamp
+        index = int(timestamp // self.bucket_seconds)
+        with self._lock:
+            state = self._assets.get(asset)
+            if state is None:
+                state = self._assets[asset] = _AssetSentiment(self.windows, int(now // self.bucket_seconds))
+            self._expire(state, int(now // self.bucket_seconds))
+            longest = state.windows[self._longest]
+            if index >= longest.low:
+                bucket = state.buckets.get(index)
+                if bucket is None:
+                    bucket = state.buckets[index] = [0, 0.0]
+                bucket[0] += 1
+                bucket[1] += score
+            for window in state.windows.values():
+                if index >= window.low:
+                    window.count += 1
+                    window.total += score
+                if window.decayed_at is None or timestamp >= window.decayed_at:
+                    if window.decayed_at is not None:
+                        decay = math.exp(-(timestamp - window.decayed_at) / window.tau)
+                        window.decayed_sum *= decay
+                        window.decayed_weight *= decay
+                    window.decayed_at = timestamp
+                    window.decayed_sum += score
+                    window.decayed_weight += 1.0
+                else:
+                    # late arrival: weigh it as of now instead of rewinding the decay
+                    weight = math.exp(-(window.decayed_at - timestamp) / window.tau)
+                    window.decayed_sum += weight * score
+                    window.decayed_weight += weight
+            self.applied += 1
+
+    def add_item(self, assets, score, timestamp=None):
+        """Count one article for each asset it mentions"""
+        for asset in assets:
+            self.add(asset.upper(), score, timestamp)
+
+    def _expire(self, state, now_index):
+        """Retire buckets that have left each window since the last call"""
+        for name in self._order:
+            window = state.windows[name]
+            cutoff = now_index - window.buckets + 1
+            if cutoff <= window.low:
+                continue
+            prune = name == self._longest
+            if cutoff - window.low >= window.buckets:
+                # idle for longer than the window: nothing in it is still current
+                window.count = 0
+                window.total = 0.0
+                if prune:
+                    state.buckets = {i: b for i, b in state.buckets.items() if i >= cutoff}
+            else:
+                for index in range(window.low, cutoff):
+                    bucket = state.buckets.pop(index, None) if prune else state.buckets.get(index)
+                    if bucket is not None:
+                        window.count -= bucket[0]
+                        window.total -= bucket[1]
+                if window.count <= 0:
+                    window.count = 0
+                    window.total = 0.0
+            window.low = cutoff
+
+    # -- reads ---------------------------------------------------------------
+
+    def get(self, asset, window='1h'):
+        """{'count', 'mean', 'decayed_score', 'weight'} for one asset and window"""
+        now = self.clock()
+        with self._lock:
+            state = self._assets.get(asset.upper())
+            if state is None:
+                return {'count': 0, 'mean': None, 'decayed_score': None, 'weight': 0.0}
+            self._expire(state, int(now // self.bucket_seconds))
+            w = state.windows[window]
+            weight = w.decayed_weight
+            if w.decayed_at is not None and now > w.decayed_at:
+                weight *= math.exp(-(now - w.decayed_at) / w.tau)
+            return {
+                'count': w.count,
+                'mean': w.total / w.count if w.count else None,
+                'decayed_score': w.decayed_sum / w.decayed_weight if w.count and w.decayed_weight else None,
+                'weight': weight,
+            }
+
+    def score(self, asset, window='1h', default=0.0):
+        """Decayed mean sentiment of asset, or default with no news in the window"""
+        with self._lock:
+            state = self._assets.get(asset.upper())
+            if state is None:
+                return default
+            self._expire(state, int(self.clock() // self.bucket_seconds))
+            w = state.windows[window]
+            # the decayed mean outlives the window; an empty window is no signal
+            if not w.count or not w.decayed_weight:
+                return default
+            return w.decayed_sum / w.decayed_weight
+
+    def assets(self):
+        return sorted(self._assets)
+
+    def snapshot(self, assets=None):
+        """{asset: {window: aggregates}} for the given (default: all) assets"""
+        return {asset: {name: self.get(asset, name) for name in self.windows}
+                for asset in (assets or self.assets())}
+
+    # -- loading -------------------------------------------------------------
+
+    def _apply_rows(self, rows):
+        for related_assets, score, timestamp in rows:
+            self.add_item(_related_assets(related_assets), score, _epoch(timestamp) if timestamp else None)
+
+    def load(self):
+        """Aggregate the last window of scored news once and fix the high-water mark"""
+        from app import db
+        from models import NewsItem
+
+        seconds = max(seconds for _, seconds in self.windows.values())
+        since = datetime.utcfromtimestamp(self.clock()) - timedelta(seconds=seconds)
+        with self.app.app_context():
+            hwm = db.session.query(func.max(NewsItem.id)).scalar() or 0
+            rows = NewsItem.query.with_entities(
+                NewsItem.related_assets, NewsItem.sentiment_score, NewsItem.timestamp
+            ).filter(NewsItem.timestamp >= since, NewsItem.id <= hwm,
+                     NewsItem.sentiment_score.isnot(None)).order_by(NewsItem.timestamp).all()
+            with self._lock:
+                self._apply_rows(rows)
+                self._hwm = hwm
+        return len(rows)
+
+    def catch_up(self):
+        """Apply NewsItems stored (by any process) since the last load or catch-up"""
+        from models import NewsItem
+
+        if self._hwm is None:
+            return self.load()
+        with self.app.app_context():
+            rows = NewsItem.query.with_entities(
+                NewsItem.id, NewsItem.related_assets, NewsItem.sentiment_score, NewsItem.timestamp
+            ).filter(NewsItem.id > self._hwm).order_by(NewsItem.id).all()
+        with self._lock:
+            self._apply_rows((assets, score, ts) for _, assets, score, ts in rows if score is not None)
+            if rows:
+                self._hwm = rows[-1][0]
+            self.catch_ups += 1
+        return len(rows)
+
+    def start(self, interval=CATCH_UP_INTERVAL):
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stopped:
+                try:
+                    self.catch_up()
+                except Exception:
+                    logging.exception('Sentiment aggregate catch-up failed')
+                self._wake.wait(interval)
+                self._wake.clear()
+
+        self._thread = threading.Thread(target=run, name='sentiment-aggregates', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def metrics(self):
+        return {
+            'assets': len(self._assets),
+            'applied': self.applied,
+            'catch_ups': self.catch_ups,
+            'high_water_mark': self._hwm,
+        }
+
+
+_aggregates = None
+_aggregates_lock = threading.Lock()
+
+
+def get_sentiment_aggregates():
+    """Process-wide aggregates, kept current from NewsItem in the background"""
+    global _aggregates
+    with _aggregates_lock:
+        if _aggregates is None:
+            from app import app
+            _aggregates = SentimentAggregates(app)
+            _aggregates.load()
+            _aggregates.start()
+        return _aggregates
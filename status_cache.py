@@ -0,0 +1,100 @@
+"""Per-user cache of the /api/bot_status payload.
+
+Every user has a version counter. Routes that start, stop, add or delete a
+config bump it, and so does the live feed when it sees a config change
+made by another process. The payload is built at most once per version,
+and its ETag is a hash of the content, so clients polling with
+If-None-Match get 304 without a query or a JSON encode. Entries also expire
+after `ttl` seconds, which bounds staleness for changes made by other
+workers that this process never heard about.
+
+wait() blocks a long-poll request until the user's version moves or the
+timeout passes.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+STATUS_CACHE_TTL = float(os.environ.get('STATUS_CACHE_TTL', 30))
+MAX_WAIT = 60.0
+
+
+class StatusCache:
+    """(version, payload, etag) per user, rebuilt only after a bump or expiry"""
+
+    def __init__(self, loader=None, ttl=STATUS_CACHE_TTL, clock=time.monotonic):
+        self.loader = loader or load_bot_status
+        self.ttl = ttl
+        self.clock = clock
+        self._versions = {}
+        self._entries = {}
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, user_id):
+        with self._cond:
+            return self._versions.get(user_id, 0)
+
+    def bump(self, user_id):
+        with self._cond:
+            version = self._versions.get(user_id, 0) + 1
+            self._versions[user_id] = version
+            self._entries.pop(user_id, None)
+            self._cond.notify_all()
+            return version
+
+    def get(self, user_id):
+        """(version, payload, etag) for user_id, loading it if the cached one is stale"""
+        with self._cond:
+            version = self._versions.get(user_id, 0)
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version and self.clock() < entry[3]:
+                self.hits += 1
+                return entry[:3]
+        self.misses += 1
+        payload = self.loader(user_id)
+        etag = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        with self._cond:
+            # a bump while loading makes this result stale: serve it but do not keep it
+            if self._versions.get(user_id, 0) == version:
+                self._entries[user_id] = (version, payload, etag, self.clock() + self.ttl)
+        return version, payload, etag
+
+    def wait(self, user_id, version, timeout):
+        """Block until user_id's version differs from version; returns the current version"""
+        deadline = self.clock() + min(timeout, MAX_WAIT)
+        with self._cond:
+            while self._versions.get(user_id, 0) == version:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._versions.get(user_id, 0)
+
+    def metrics(self):
+        with self._cond:
+            return {'users': len(self._versions), 'cached': len(self._entries),
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def load_bot_status(user_id):
+    from history import config_to_dict
+    from models import BotConfig
+
+    configs = BotConfig.query.filter_by(user_id=user_id).order_by(BotConfig.id).all()
+    return [config_to_dict(config) for config in configs]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_status_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = StatusCache()
+        return _cache
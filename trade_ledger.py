@@ -0,0 +1,342 @@
+"""Buffered Trade ledger writer.
+
+Strategies call record() which only appends to an in-memory buffer of at most
+capacity rows. A background thread flushes the buffer when it reaches
+batch_size rows or flush_interval seconds after the oldest pending row. Each
+flush is one multi-row INSERT (executemany) or, on PostgreSQL, COPY. A failed
+flush puts its rows back at the front of the buffer and retries.
+
+record() never waits: it runs on the bot supervisor's event loop. Once the
+buffer is full, rows are appended as JSON lines to a local spill file
+(TRADE_LEDGER_SPILL) instead, and the flusher reads them back in order as the
+buffer empties, so a stalled database costs disk and not memory. A spill file
+left behind by a process that died is picked up by the next one to record.
+close() drains everything still buffered; it runs at interpreter exit and from
+the bot supervisor's SIGTERM/SIGINT handler, since atexit does not run when a
+process is killed by a signal. Rows it cannot write stay in the spill file.
+
+    ledger = get_ledger()
+    ledger.record(user_id=1, exchange='binance', symbol='BTC/USDT', side='buy',
+                  type='market', quantity=0.01, price=60000.0, strategy='hft')
+"""
+import io
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+# status of simulated fills (bot_supervisor.paper_execute): shown in history, but never
+# counted as holdings by the valuation engine nor emailed as trade fills
+PAPER_STATUS = 'paper'
+
+TRADE_LEDGER_SPILL = os.environ.get('TRADE_LEDGER_SPILL', 'trade_ledger.spill')
+
+TRADE_COLUMNS = ('exchange', 'symbol', 'order_id', 'side', 'type', 'quantity', 'price', 'cost',
+                 'fee', 'status', 'strategy', 'profit_loss', 'timestamp', 'user_id')
+
+
+class TradeLedger:
+    """Bounded, batch-flushed writer for Trade rows that spills to disk when full"""
+
+    def __init__(self, app, batch_size=500, flush_interval=0.25, capacity=100000,
+                 use_copy=True, retry_delay=1.0, spill_path=TRADE_LEDGER_SPILL):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # rows held in memory; a failed flush may requeue up to batch_size more
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.use_copy = use_copy
+        self.retry_delay = retry_delay
+
+        self._buffer = deque()
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._spill = None
+        self._spill_offset = 0
+        self.spilled = 0
+
+        self.recorded = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.overflowed = 0
+        self._overflowing = False
+        self._latencies = deque(maxlen=2048)
+        self._last_flush_at = None
+        self._listeners = []
+
+    # -- producer side -------------------------------------------------------
+
+    def record(self, user_id, exchange, symbol, side, type, quantity, price, strategy,
+               cost=None, fee=None, status='filled', order_id=None, profit_loss=None,
+               timestamp=None):
+        """Buffer one fill; always returns immediately"""
+        row = {
+            'exchange': exchange,
+            'symbol': symbol,
+            'order_id': order_id,
+            'side': side,
+            'type': type,
+            'quantity': quantity,
+            'price': price,
+            'cost': cost if cost is not None else quantity * price,
+            'fee': fee,
+            'status': status,
+            'strategy': strategy,
+            'profit_loss': profit_loss,
+            'timestamp': timestamp or datetime.utcnow(),
+            'user_id': user_id,
+        }
+        self._ensure_started()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Trade ledger is closed')
+            self.recorded += 1
+            if self.spilled or len(self._buffer) >= self.capacity:
+                # never drop a fill and never block the caller: once spilling, keep
+                # spilling until the file is read back, so rows stay in order
+                self._spill_row(row)
+                self.overflowed += 1
+                if not self._overflowing:
+                    self._overflowing = True
+                    logging.warning(f'Trade ledger over capacity ({self.capacity} rows); '
+                                    f'spilling to {self.spill_path}')
+            else:
+                if not self._buffer:
+                    self._oldest = time.monotonic()
+                self._buffer.append(row)
+            if self._pending() >= self.batch_size:
+                self._cond.notify_all()
+
+    def add_listener(self, callback):
+        """Call callback(rows) with every batch after it has been committed"""
+        self._listeners.append(callback)
+
+    # -- spill file ------------------------------------------------------------
+
+    def _pending(self):
+        return len(self._buffer) + self.spilled
+
+    def _open_spill(self):
+        """Open the spill file, picking up rows a previous process left in it"""
+        if self._spill is None:
+            self._spill = open(self.spill_path, 'a+', buffering=1)
+            self._spill.seek(0)
+            lines = self._spill.readlines()
+            if lines and not lines[-1].endswith('\n'):
+                # a row cut short when its process died; _unspill skips it
+                self._spill.write('\n')
+            self.spilled = len(lines)
+            self._spill_offset = 0
+            if self.spilled:
+                self._oldest = self._oldest or time.monotonic()
+                self._overflowing = True
+                logging.warning(f'Trade ledger recovered {self.spilled} unwritten trades '
+                                f'from {self.spill_path}')
+        return self._spill
+
+    def _spill_row(self, row):
+        spill = self._open_spill()
+        spill.write(json.dumps(dict(row, timestamp=row['timestamp'].isoformat())) + '\n')
+        self.spilled += 1
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def _unspill(self, n):
+        """Move up to n spilled rows to the back of the buffer, in the order they were spilled"""
+        spill = self._spill
+        spill.flush()
+        spill.seek(self._spill_offset)
+        for _ in range(min(n, self.spilled)):
+            line = spill.readline()
+            if not line:
+                self.spilled = 0
+                break
+            self.spilled -= 1
+            try:
+                row = json.loads(line)
+                row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+            except ValueError:
+                logging.error(f'Trade ledger skipped an unreadable row in {self.spill_path}: {line[:200]!r}')
+                continue
+            self._buffer.append(row)
+        self._spill_offset = spill.tell()
+        if not self.spilled:
+            # everything is back in memory: start the file over
+            spill.seek(0)
+            spill.truncate()
+            self._spill_offset = 0
+
+    # -- flusher ---------------------------------------------------------------
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._cond:
+                if self._thread is None:
+                    if os.path.exists(self.spill_path):
+                        self._open_spill()
+                    self._thread = threading.Thread(target=self._run, name='trade-ledger', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._pending() >= self.batch_size:
+                        break
+                    if self._pending() and time.monotonic() - self._oldest >= self.flush_interval:
+                        break
+                    timeout = self.flush_interval
+                    if self._pending():
+                        timeout = max(0.0, self.flush_interval - (time.monotonic() - self._oldest))
+                    self._cond.wait(timeout)
+                if self._closed and not self._pending():
+                    return
+            if not self.flush() and not self._closed:
+                time.sleep(self.retry_delay)
+
+    def _take_batch(self):
+        with self._cond:
+            if self.spilled and len(self._buffer) < self.batch_size:
+                self._unspill(min(self.batch_size, self.capacity - len(self._buffer)))
+            n = min(len(self._buffer), self.batch_size)
+            batch = [self._buffer.popleft() for _ in range(n)]
+            self._oldest = time.monotonic() if self._pending() else None
+            if self._overflowing and not self.spilled:
+                self._overflowing = False
+            self._cond.notify_all()
+            return batch
+
+    def _requeue(self, batch):
+        with self._cond:
+            self._buffer.extendleft(reversed(batch))
+            self._oldest = time.monotonic()
+
+    def flush(self):
+        """Write one batch synchronously; returns False if the write failed"""
+        with self._flush_lock:
+            batch = self._take_batch()
+            if not batch:
+                return True
+            start = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    self._write(batch)
+            except Exception as e:
+                self.failures += 1
+                self._requeue(batch)
+                logging.error(f'Trade ledger flush of {len(batch)} rows failed: {e}')
+                return False
+            self._latencies.append(time.perf_counter() - start)
+            self._last_flush_at = datetime.utcnow()
+            self.flushed += len(batch)
+            self.batches += 1
+        for callback in self._listeners:
+            try:
+                callback(batch)
+            except Exception:
+                logging.exception('Trade ledger listener failed')
+        return True
+
+    def _write(self, batch):
+        from app import db
+        from models import Trade
+
+        # the 'writer' bind has its own pool, so fills never queue behind web requests for a connection
+        engine = db.engines.get('writer') or db.engine
+        if self.use_copy and engine.dialect.name == 'postgresql':
+            self._copy(engine, batch)
+        else:
+            with engine.begin() as connection:
+                connection.execute(db.insert(Trade), batch)
+
+    def _copy(self, engine, batch):
+        """COPY rows into the trade table through the raw psycopg2 connection"""
+        buf = io.StringIO()
+        for row in batch:
+            buf.write('\t'.join('\\N' if row[c] is None else
+                                str(row[c]).replace('\\', '\\\\').replace('\t', ' ').replace('\n', ' ')
+                                for c in TRADE_COLUMNS))
+            buf.write('\n')
+        buf.seek(0)
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.copy_expert(f'COPY trade ({", ".join(TRADE_COLUMNS)}) FROM STDIN', buf)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def drain(self, timeout=30.0):
+        """Flush until the buffer is empty or the timeout passes; returns rows left"""
+        deadline = time.monotonic() + timeout
+        while self._pending() and time.monotonic() < deadline:
+            if not self.flush():
+                time.sleep(min(self.retry_delay, max(0.0, deadline - time.monotonic())))
+        return self._pending()
+
+    def close(self, timeout=30.0):
+        """Stop accepting trades and write everything still buffered"""
+        with self._cond:
+            if self._closed:
+                return self._pending()
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        left = self.drain(timeout)
+        if left:
+            with self._cond:
+                # keep what is still in memory on disk for the next process
+                while self._buffer:
+                    self._spill_row(self._buffer.popleft())
+            logging.error(f'Trade ledger closed with {left} unwritten trades, kept in {self.spill_path}')
+        return left
+
+    # -- metrics ---------------------------------------------------------------
+
+    def metrics(self):
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+        return {
+            'pending': self._pending(),
+            'spilled': self.spilled,
+            'recorded': self.recorded,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'failures': self.failures,
+            'overflowed': self.overflowed,
+            'avg_batch_size': round(self.flushed / self.batches, 1) if self.batches else 0,
+            'flush_ms_p50': percentile(0.50),
+            'flush_ms_p99': percentile(0.99),
+            'flush_ms_max': percentile(1.0),
+            'last_flush_at': self._last_flush_at.isoformat() if self._last_flush_at else None,
+        }
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """Process-wide ledger, flushed at interpreter exit (and by daemons' signal handlers)"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            from app import app
+            _ledger = TradeLedger(app)
+            atexit.register(_ledger.close)
+        return _ledger
@@ -0,0 +1,13 @@
+"""Production WSGI entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Web workers only serve requests. Portfolio snapshots, the bot supervisor
+(which owns market data ingestion), the news pipeline and the rebalance
+scheduler run as their own processes (see Procfile), so starting more
+workers does not start more copies of them. main.py remains the
+development server.
+"""
+from app import create_app
+
+app = application = create_app({'RUN_BACKGROUND_JOBS': False})